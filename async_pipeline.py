@@ -0,0 +1,314 @@
+import numpy as np
+
+import csv
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# my functions
+from main import load_params, with_params, load_spectra, smooth_csre, bin_errorbars, chisquared
+from batch import result_fields, target_name
+from precision import get_dtype
+import run_pandexo
+import profiling
+import main
+
+# stages of the pipeline, in order
+stage_names = ['load', 'smooth', 'noise', 'finish']
+
+# marks the end of a queue
+_done = object()
+
+
+# ----- stage functions (module level, so they can run in process pools too) -----
+
+def load_stage(params):
+    """
+    Spectra of a target: (wave, star_spec, planet_spec).
+    """
+
+    return load_spectra(params)
+
+
+def smooth_stage(params, wave, star_spec, planet_spec, dtype):
+    """
+    Smoothed CSRE spectrum of a target.
+    """
+
+    return smooth_csre(params, wave, star_spec, planet_spec, dtype)
+
+
+def noise_stage(params, use_cache, backend):
+    """
+    PandExo (or surrogate) error bars of a target: (err_wave, err).
+    """
+
+    with profiling.stage('run_pandexo'):
+        return run_pandexo.run_pandexo(params, use_cache = use_cache, backend = backend)
+
+
+def finish_stage(wave, smooth_csre_spec, err_wave, err, numtran, err_R, method, dtype):
+    """
+    Binned error bars and chi-squared: (errs, (chisq, numsig, mu)).
+    """
+
+    errs = bin_errorbars(err_wave, err, wave, smooth_csre_spec, err_R, method, dtype)
+
+    return errs, chisquared(None, errs, numtran)
+
+
+# ----- pipeline -----
+
+def _labelled(name, func, *args):
+    """
+    func(*args), with any profiling stages inside it labelled with the target name.
+    """
+
+    with profiling.target(name):
+        return func(*args)
+
+
+def _make_executor(kind, workers):
+
+    if kind == 'thread':
+        return ThreadPoolExecutor(max_workers = workers)
+    if kind == 'process':
+        return ProcessPoolExecutor(max_workers = workers)
+
+    raise ValueError(f"executor has to be 'thread' or 'process', not '{kind}'")
+
+
+async def _feed(targets, queue):
+    """
+    Puts the targets on the first queue (waiting whenever it's full), then _done.
+    Each target's params are loaded once here, as a plain copy (see main.with_params)
+    so they can be sent to process pools even when they come from a {name}_params module.
+
+    If iterating over targets itself raises (e.g. catalog.catalog_params finding no
+    usable rows), _done is still put, so the stages finish the targets they already
+    have and the error comes out of csre_pipeline instead of the run hanging.
+    """
+
+    try:
+        for target in targets:
+            item = {'start' : time.perf_counter(),
+                    'row'   : {'name' : target_name(target), 'chisq' : np.nan, 'numsig' : np.nan, 'mu' : np.nan,
+                               'status' : 'ok', 'error' : ''}}
+            try:
+                item['params'] = with_params(load_params(target))
+            except Exception as e:
+                item['row']['status'], item['row']['error'] = 'failed', f'{type(e).__name__}: {e}'
+
+            await queue.put(item)
+    finally:
+        await queue.put(_done)
+
+
+async def _stage(func, args, pools, name, workers, inq, outq):
+    """
+    Runs func(*args(item)) in the stage's executor (pools[name]) for every item
+    from inq with `workers` items in flight, stores the result under the stage's
+    name and passes the item on to outq. Failed items skip the rest of the stages.
+
+    If a worker process dies (e.g. a segfault in PandExo), every item in its pool
+    gets a BrokenProcessPool. The pool is then replaced for the items still to
+    come, and the ones that were in flight are rerun one at a time, each in a pool
+    of its own: only the one that kills its worker again is marked failed (same as
+    batch.run_batch).
+    """
+
+    loop = asyncio.get_running_loop()
+    solo = asyncio.Lock()
+
+    async def run(executor, item):
+        return await loop.run_in_executor(executor, _labelled, item['row']['name'], func, *args(item))
+
+    async def rerun(item):
+        async with solo:
+            executor = ProcessPoolExecutor(max_workers = 1)
+            try:
+                return await run(executor, item)
+            finally:
+                executor.shutdown(wait = False)
+
+    async def worker():
+        while True:
+            item = await inq.get()
+            if item is _done:
+                # leave it for the other workers
+                await inq.put(_done)
+                return
+
+            if item['row']['status'] == 'ok':
+                executor = pools[name]
+                try:
+                    try:
+                        item[func.__name__] = await run(executor, item)
+                    except BrokenProcessPool:
+                        # the first of the pool's items to get here replaces it
+                        if pools[name] is executor:
+                            executor.shutdown(wait = False)
+                            pools[name] = _make_executor('process', workers)
+                        item[func.__name__] = await rerun(item)
+                except Exception as e:
+                    item['row']['status'], item['row']['error'] = 'failed', f'{type(e).__name__}: {e}'
+
+            await outq.put(item)
+
+    await asyncio.gather(*(worker() for i in range(workers)))
+    await outq.put(_done)
+
+
+async def csre_pipeline(targets, numtran = 1, prefetch = 2, workers = None, executors = None,
+                        use_cache = True, err_R = 25, dtype = None):
+    """
+    Runs CSRE + chisquared for many targets as a pipeline of stages connected by
+    bounded queues, so target N+1's spectra are loaded and smoothed while target N
+    is in PandExo:
+
+    load (spectra) -> smooth (CSRE spectrum) -> noise (PandExo) -> finish (binning, chi-squared)
+
+    Each stage runs its blocking work in its own thread or process pool. A stage
+    waits whenever the queue after it is full, so at most about prefetch + workers
+    targets are held per stage however many targets there are (targets can be a
+    generator, e.g. catalog.catalog_params, and is only read as fast as needed).
+
+    e.g.
+
+        async for row, result in csre_pipeline(names, prefetch = 4):
+            ...
+
+    Results come out in order of completion, same as batch.run_batch, and a
+    target that kills its process pool worker is marked failed without taking
+    the other targets in the pool with it (see _stage). With profiling on, stages in thread pools overlap, so their CPU times and peak
+    memory (which are for the whole process) do too; wall times are per stage.
+
+    ================== Params ==================
+
+    targets    : iterable of system names and/or param dicts/objects (see main.load_params)
+    numtran    : number of transits to scale the errorbars by (Default is 1)
+    prefetch   : size of the queue before each stage, i.e. how many targets each stage
+                 can get ahead of the next one (at least 1, Default is 2)
+    workers    : dict of stage -> number of targets it works on at once
+                 (Default is 2 for load and 1 for everything else)
+    executors  : dict of stage -> 'thread' or 'process' (Default is 'process' for noise,
+                 since PandExo holds the GIL, and 'thread' for everything else)
+    use_cache  : whether to use the on-disk PandExo cache (Default is True)
+    err_R      : resolution of the error bars (Default is 25, same as main.errorbars)
+    dtype      : dtype of the spectra and error bars (Default is None, precision.dtype)
+
+    ================== Yields ==================
+
+    row     : dict with the batch.result_fields for a target
+    result  : (wave, smooth_csre_spec, errs) as returned by main.CSRE (None if it failed)
+
+    """
+
+    workers   = dict({'load' : 2, 'smooth' : 1, 'noise' : 1, 'finish' : 1}, **(workers or {}))
+    executors = dict({'load' : 'thread', 'smooth' : 'thread', 'noise' : 'process', 'finish' : 'thread'},
+                     **(executors or {}))
+
+    if prefetch < 1:
+        # an asyncio.Queue with maxsize 0 is unbounded, which would read every target up front
+        raise ValueError(f'prefetch has to be at least 1, not {prefetch}')
+
+    unknown = (set(workers) | set(executors)) - set(stage_names)
+    if unknown:
+        raise ValueError(f'unknown stages {sorted(unknown)}, expected some of {stage_names}')
+
+    # settings are resolved here, so process pool workers don't depend on module state
+    dtype   = get_dtype(dtype)
+    backend = run_pandexo.noise_backend
+    method  = main.resample_method
+
+    stages = [
+        (load_stage,   lambda item: (item['params'],)),
+        (smooth_stage, lambda item: (item['params'], *item['load_stage'], dtype)),
+        (noise_stage,  lambda item: (item['params'], use_cache, backend)),
+        (finish_stage, lambda item: (item['load_stage'][0], item['smooth_stage'], *item['noise_stage'],
+                                     numtran, err_R, method, dtype))
+    ]
+
+    # one queue before each stage and one for the results
+    queues = [asyncio.Queue(maxsize = prefetch) for i in range(len(stages) + 1)]
+    pools  = {name : _make_executor(executors[name], workers[name]) for name in stage_names}
+
+    tasks = [asyncio.create_task(_feed(targets, queues[0]))]
+    for i, (name, (func, args)) in enumerate(zip(stage_names, stages)):
+        tasks.append(asyncio.create_task(_stage(func, args, pools, name, workers[name], queues[i], queues[i + 1])))
+
+    try:
+        while True:
+            item = await queues[-1].get()
+            if item is _done:
+                break
+
+            row, result = item['row'], None
+            if row['status'] == 'ok':
+                errs, (row['chisq'], row['numsig'], row['mu']) = item['finish_stage']
+                result = item['load_stage'][0], item['smooth_stage'], errs
+            row['elapsed'] = time.perf_counter() - item['start']
+
+            yield row, result
+
+        # re-raise anything that went wrong outside the stage functions (e.g. in targets)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for pool in pools.values():
+            pool.shutdown(cancel_futures = True)
+
+
+def run_pipeline(targets, numtran = 1, results_file = 'csre_results.csv', keep_arrays = False, **kwargs):
+    """
+    Runs csre_pipeline to completion, writing each finished target to
+    results_file straight away (same table as batch.run_batch).
+
+    ================== Params ==================
+
+    targets       : iterable of system names and/or param dicts (see main.load_params)
+    numtran       : number of transits to scale the errorbars by (Default is 1)
+    results_file  : csv file to write the results table to (None to skip writing)
+    keep_arrays   : whether to also return every target's spectra and error bars (Default is
+                    False, so memory doesn't grow with the number of targets)
+    kwargs        : passed on to csre_pipeline (prefetch, workers, executors, use_cache, ...)
+
+    ================== Returns =================
+
+    results  : list of result rows in order of completion
+    arrays   : dict of name -> (wave, smooth_csre_spec, errs) (only if keep_arrays)
+
+    """
+
+    async def collect():
+        results, arrays = [], {}
+
+        f = None
+        if results_file is not None:
+            f = open(results_file, 'w', newline = '')
+            writer = csv.DictWriter(f, fieldnames = result_fields)
+            writer.writeheader()
+
+        try:
+            async for row, result in csre_pipeline(targets, numtran, **kwargs):
+                results.append(row)
+                if keep_arrays and result is not None:
+                    arrays[row['name']] = result
+
+                if f is not None:
+                    writer.writerow(row)
+                    f.flush()
+        finally:
+            if f is not None:
+                f.close()
+
+        return results, arrays
+
+    results, arrays = asyncio.run(collect())
+
+    if keep_arrays:
+        return results, arrays
+
+    return results
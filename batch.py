@@ -0,0 +1,281 @@
+import numpy as np
+
+import os
+import csv
+import time
+import signal
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# my functions
+from main import CSRE, chisquared, load_params
+import profiling
+
+# columns of the results table
+result_fields = ['name', 'chisq', 'numsig', 'mu', 'status', 'error', 'elapsed']
+
+
+def target_name(target):
+    """
+    Name used for a target in the results table: the string itself for
+    system names, or the 'name' entry (falling back to the planet name from 
+    csre_params) for param dicts/objects.
+    """
+
+    if isinstance(target, str):
+        return target
+
+    try:
+        params = load_params(target)
+        return getattr(params, 'name', None) or params.csre_params['planet_name']
+    except (AttributeError, KeyError, TypeError):
+        return repr(target)
+
+
+@contextmanager
+def time_limit(timeout):
+    """
+    Raises TimeoutError if the body takes longer than timeout seconds.
+    Uses SIGALRM, so it only does anything on POSIX systems (pool workers
+    run tasks in their main thread, so this is fine inside them).
+    """
+
+    if timeout is None or not hasattr(signal, 'SIGALRM'):
+        yield
+        return
+
+    def handler(signum, frame):
+        raise TimeoutError(f'took longer than {timeout} s')
+
+    old_handler = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+
+def run_target(target, numtran = 1, timeout = None, use_cache = True, return_arrays = False):
+    """
+    Runs CSRE + chisquared for a single target, catching any failure so one
+    bad target can't take down the whole batch.
+
+    ================== Params ==================
+
+    target         : system name or param dict/object (see main.load_params)
+    numtran        : number of transits to scale the errorbars by (Default is 1)
+    timeout        : time limit for this target in seconds (Default is None, no limit)
+    use_cache      : whether to use the on-disk PandExo cache (Default is True)
+    return_arrays  : whether to return the CSRE output too (Default is False)
+
+    ================== Returns =================
+
+    row     : dict with the result_fields for this target
+    result  : (wave, smooth_csre_spec, errs) from main.CSRE, or None if it failed
+              (only if return_arrays)
+
+    """
+
+    start = time.perf_counter()
+    row   = {'name' : target_name(target), 'chisq' : np.nan, 'numsig' : np.nan, 'mu' : np.nan,
+             'status' : 'ok', 'error' : ''}
+    result = None
+
+    try:
+        with time_limit(timeout), profiling.target(row['name']):
+            wave, smooth_csre_spec, errs = CSRE(target, use_cache = use_cache)
+            row['chisq'], row['numsig'], row['mu'] = chisquared(row['name'], errs, numtran)
+            result = wave, smooth_csre_spec, errs
+    except TimeoutError as e:
+        row['status'], row['error'] = 'timeout', str(e)
+    except Exception as e:
+        row['status'], row['error'] = 'failed', f'{type(e).__name__}: {e}'
+
+    row['elapsed'] = time.perf_counter() - start
+
+    if return_arrays:
+        return row, result
+
+    return row
+
+
+def run_batch(targets, numtran = 1, max_workers = None, timeout = None,
+              results_file = 'csre_results.csv', use_cache = True, store = None, max_in_flight = None):
+    """
+    Runs CSRE + chisquared for many systems in parallel over a process pool.
+    Each finished target is appended to results_file straight away, so
+    partial results survive if the batch is interrupted.
+
+    Only max_in_flight targets are submitted at a time, so a streaming input
+    (e.g. catalog.catalog_params) is read as the pool works through it rather
+    than all at once. If a worker process dies (e.g. a segfault or running out
+    of memory in PandExo) the pool is restarted, and the targets that were in
+    flight are rerun one at a time: the one that kills its worker again is
+    marked failed and the rest carry on.
+
+    With a result store (see result_store.py), targets already in it with the
+    same params are not rerun (their rows are worked out from the stored error
+    bars, with status 'skipped'), and every new result is added to it as it
+    finishes, so an interrupted batch picks up where it left off. A target
+    repeated within the batch is only run once too (the repeats get a copy of
+    its row, with status 'skipped').
+
+    ================== Params ==================
+
+    targets        : iterable of system names and/or param dicts (see main.load_params)
+    numtran        : number of transits to scale the errorbars by (Default is 1)
+    max_workers    : number of worker processes (Default is None, one per CPU)
+    timeout        : per-target time limit in seconds (Default is None, no limit)
+    results_file   : csv file to write the results table to (None to skip writing)
+    use_cache      : whether to use the on-disk PandExo cache (Default is True)
+    store          : SQLite result store file, or True for result_store.db_path (Default is None, no store)
+    max_in_flight  : most targets submitted to the pool at once (Default is None, twice the workers)
+
+    ================== Returns =================
+
+    results : list of result rows (dicts with name, chisq, numsig, mu, status, error, elapsed),
+              in order of completion
+
+    """
+
+    workers       = max_workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    if max_in_flight < 1:
+        raise ValueError(f'max_in_flight has to be at least 1, not {max_in_flight}')
+
+    results = []
+
+    f = None
+    if results_file is not None:
+        f = open(results_file, 'w', newline = '')
+        writer = csv.DictWriter(f, fieldnames = result_fields)
+        writer.writeheader()
+
+    def add_row(row):
+        results.append(row)
+
+        if f is not None:
+            writer.writerow(row)
+            f.flush()
+
+    conn, done = None, set()
+    repeats    = {} # key -> targets with that key waiting on the first one to finish
+    if store:
+        import result_store
+        conn = result_store.connect(None if store is True else store)
+        done = result_store.existing_keys(conn)
+
+    targets = iter(targets)
+
+    def next_job():
+        """
+        Next (target, key) to run, adding rows for the ones already in the store (None when done).
+        """
+
+        for target in targets:
+            key = None
+            if conn is not None:
+                try:
+                    key = result_store.result_key(target)
+                except Exception:
+                    # bad params, let run_target report it
+                    pass
+
+            if key in done:
+                stored = result_store.load_result(conn, key)
+                row    = {'name' : stored['name'], 'status' : 'skipped', 'error' : '', 'elapsed' : 0.0}
+                row['chisq'], row['numsig'], row['mu'] = chisquared(stored['name'], stored['errs'], numtran)
+                add_row(row)
+                continue
+
+            if key in repeats:
+                # same name and params as a target that's already running, wait for its result
+                repeats[key].append(target)
+                continue
+
+            if key is not None:
+                repeats[key] = []
+
+            return target, key
+
+        return None
+
+    def finish(job, row, result = None):
+        target, key = job
+        if key is not None:
+            result_store.store_result(conn, target, row, result, key)
+
+        add_row(row)
+
+        for repeat in repeats.pop(key, []):
+            add_row(dict(row, name = target_name(repeat), status = 'skipped' if row['status'] == 'ok' else row['status'],
+                          elapsed = 0.0))
+
+    def failed_row(target, e):
+        return {'name' : target_name(target), 'chisq' : np.nan, 'numsig' : np.nan, 'mu' : np.nan,
+                'status' : 'failed', 'error' : f'{type(e).__name__}: {e}', 'elapsed' : np.nan}
+
+    executor = ProcessPoolExecutor(max_workers = max_workers)
+    pending  = {}       # future -> (target, key)
+    suspects = deque()  # targets in flight when a worker died, rerun one at a time
+    solo     = False    # whether the only target in flight is a suspect
+
+    try:
+        while True:
+            if suspects:
+                if not pending:
+                    job  = suspects.popleft()
+                    solo = True
+                    pending[executor.submit(run_target, job[0], numtran, timeout, use_cache, conn is not None)] = job
+            else:
+                solo = False
+                while len(pending) < max_in_flight:
+                    job = next_job()
+                    if job is None:
+                        break
+                    pending[executor.submit(run_target, job[0], numtran, timeout, use_cache, conn is not None)] = job
+
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when = FIRST_COMPLETED)
+
+            # a dead worker breaks the whole pool, and every future in it fails
+            broken = any(isinstance(future.exception(), BrokenProcessPool) for future in finished)
+            if broken:
+                finished, _ = wait(pending)
+
+            for future in finished:
+                job = pending.pop(future)
+                try:
+                    row = future.result()
+                except BrokenProcessPool as e:
+                    if solo:
+                        # it died on its own, so this target is the one killing the worker
+                        finish(job, failed_row(job[0], e))
+                    else:
+                        suspects.append(job)
+                    continue
+                except Exception as e:
+                    finish(job, failed_row(job[0], e))
+                    continue
+
+                if conn is not None:
+                    finish(job, *row)
+                else:
+                    finish(job, row)
+
+            if broken:
+                executor.shutdown(wait = False)
+                executor = ProcessPoolExecutor(max_workers = max_workers)
+    finally:
+        executor.shutdown(cancel_futures = True)
+        if f is not None:
+            f.close()
+        if conn is not None:
+            conn.close()
+
+    return results
@@ -0,0 +1,254 @@
+"""
+Benchmarks for the smoothing, binning and CSRE hot paths.
+
+Run all of them and save a baseline:
+
+    python benchmarks.py --out bench_baseline.json
+
+Run again later and flag anything more than 20% slower than the baseline:
+
+    python benchmarks.py --out bench_new.json --compare bench_baseline.json --threshold 0.2
+
+Everything runs on synthetic ExoTransmit-like grids and the PandExo outputs
+saved in pandexo_output/, with PandExo itself stubbed out.
+"""
+
+import numpy as np
+
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import argparse
+import tempfile
+
+# my functions
+import main
+from smoothing import adap_smooth
+from binning import bin_err, white_light_curve, error_pyramid
+
+# grid sizes (pixels) and resolutions to benchmark
+grid_sizes  = [2900, 10000, 100000, 1000000]
+resolutions = [25, 100, 1000, 2700]
+
+# saved PandExo error bars (wave, spectrum, err columns)
+pandexo_errs_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pandexo_output', 'pandexo_errs.txt')
+
+
+def synthetic_grid(npix, wave_range = (0.3, 30), seed = 0):
+    """
+    ExoTransmit-like spectrum: log-spaced wavelengths (microns) and a smooth
+    transit depth (ppm) with some absorption-like bumps and noise on top.
+    """
+
+    rng  = np.random.default_rng(seed)
+    wave = np.geomspace(*wave_range, npix)
+    spec = 7000 + 200*np.sin(3*wave) + 100*np.exp(-((wave - 1.4)/0.05)**2) + rng.normal(0, 5, npix)
+
+    return wave, spec
+
+
+def synthetic_errs(npix):
+    """
+    PandExo-like error bars (ppm) resampled onto a grid of npix points.
+    """
+
+    err_data = np.loadtxt(pandexo_errs_file)
+    wave     = np.geomspace(err_data[0, 0], err_data[-1, 0], npix)
+    err      = np.interp(wave, err_data[:, 0], err_data[:, 2]) * np.sqrt(npix / len(err_data))
+
+    return wave, err
+
+
+def time_it(func, min_time = 0.2, repeat = 5):
+    """
+    Times func(), returning the min and median seconds per call over repeat runs.
+    The number of calls per run is chosen so each run takes at least min_time.
+    """
+
+    timer = timeit.Timer(func)
+
+    # calls per run, growing until a run takes at least min_time
+    number = 1
+    while timer.timeit(number) < min_time and number < 10**6:
+        number *= 10
+
+    times = np.array(timer.repeat(repeat = repeat, number = number)) / number
+
+    return {'min' : float(times.min()), 'median' : float(np.median(times)), 'number' : number, 'repeat' : repeat}
+
+
+def stub_pandexo(params, use_cache = True):
+    """
+    Stands in for run_pandexo: returns the saved PandExo error bars.
+    """
+
+    err_data = np.loadtxt(pandexo_errs_file)
+
+    return err_data[:, 0], err_data[:, 2]
+
+
+def bench_csre(npix, repeat = 3):
+    """
+    End-to-end CSRE + chisquared on a synthetic .dat file of npix points, with
+    PandExo stubbed out (so it times loading, slicing, smoothing, binning and chisq).
+    """
+
+    wave, spec = synthetic_grid(npix)
+    params = {
+        'csre_params'    : {'Rp' : 7.118e6, 'Rs' : 8.2927e7, 'Rref' : 6.957e8, 'planet_name' : 'benchb',
+                            'star_name' : 'bench', 'flat' : True, 'R' : 100},
+        'pandexo_params' : {}
+    }
+
+    old = main.spectra_path, main.store_path, main.run_pandexo
+    with tempfile.TemporaryDirectory() as tmp:
+        # ExoTransmit files are in meters and %
+        np.savetxt(os.path.join(tmp, 'transmission_bench.dat'), np.c_[wave * 1e-6, spec * 1e-4],
+                   header = 'synthetic\nbenchmark', comments = '')
+        main.spectra_path, main.store_path, main.run_pandexo = tmp, os.path.join(tmp, 'no_store'), stub_pandexo
+        try:
+            def run():
+                wave, smooth_csre_spec, errs = main.CSRE(params)
+                main.chisquared('bench', errs)
+            return time_it(run, repeat = repeat)
+        finally:
+            main.spectra_path, main.store_path, main.run_pandexo = old
+
+
+def run_benchmarks(sizes = None, Rs = None, repeat = 5, csre = True, verbose = True):
+    """
+    Runs the whole benchmark suite.
+
+    ================== Params ==================
+
+    sizes    : list of grid sizes in pixels (Default is grid_sizes)
+    Rs       : list of resolutions (Default is resolutions)
+    repeat   : number of timing runs per benchmark (Default is 5)
+    csre     : whether to include the end-to-end CSRE benchmarks (Default is True)
+    verbose  : whether to print each result as it's done (Default is True)
+
+    ================== Returns =================
+
+    report : dict with 'meta' (versions, machine, date) and 'results'
+             (benchmark name -> min/median seconds per call)
+
+    """
+
+    sizes = grid_sizes if sizes is None else sizes
+    Rs    = resolutions if Rs is None else Rs
+
+    results = {}
+    def add(name, func, **kwargs):
+        results[name] = func(**kwargs) if kwargs else func()
+        if verbose:
+            print(f"{name:<40} {results[name]['min']*1e3:12.3f} ms", flush = True)
+
+    err_data = np.loadtxt(pandexo_errs_file)
+    pandexo_wave, pandexo_err = err_data[:, 0], err_data[:, 2]
+
+    for npix in sizes:
+        wave, spec         = synthetic_grid(npix)
+        err_wave, err      = synthetic_errs(npix)
+
+        for R in Rs:
+            add(f'adap_smooth[n={npix},R={R}]', lambda: time_it(lambda: adap_smooth(wave, spec, R), repeat = repeat))
+            add(f'bin_err[n={npix},R={R}]', lambda: time_it(lambda: bin_err(err_wave, err, R), repeat = repeat))
+
+        add(f'white_light_curve[n={npix}]', lambda: time_it(lambda: white_light_curve(err_wave, err), repeat = repeat))
+        add(f'error_pyramid[n={npix}]', lambda: time_it(lambda: error_pyramid(err_wave, err, Rs), repeat = repeat))
+
+        if csre:
+            add(f'CSRE[n={npix}]', bench_csre, npix = npix, repeat = min(repeat, 3))
+
+    # on the real PandExo output grid
+    for R in Rs:
+        add(f'bin_err[pandexo,R={R}]', lambda: time_it(lambda: bin_err(pandexo_wave, pandexo_err, R), repeat = repeat))
+
+    errs = bin_err(pandexo_wave, pandexo_err, 25)
+    errs = (errs[0], 7000 + 10*np.sin(errs[0]), errs[1])
+    add('chisquared[pandexo,R=25]', lambda: time_it(lambda: main.chisquared('bench', errs), repeat = repeat))
+
+    meta = {
+        'date'     : time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python'   : platform.python_version(),
+        'numpy'    : np.__version__,
+        'machine'  : platform.machine(),
+        'platform' : platform.platform(),
+        'cpus'     : os.cpu_count()
+    }
+
+    return {'meta' : meta, 'results' : results}
+
+
+def compare(baseline, current, threshold = 0.2, stat = 'min'):
+    """
+    Compares two benchmark reports and flags regressions.
+
+    ================== Params ==================
+
+    baseline   : report dict (or path to a saved JSON report) to compare against
+    current    : report dict (or path to a saved JSON report) to check
+    threshold  : fractional slowdown that counts as a regression (Default is 0.2, i.e. 20%)
+    stat       : which timing to compare, 'min' or 'median' (Default is 'min')
+
+    ================== Returns =================
+
+    rows        : list of (name, baseline seconds, current seconds, ratio) for every shared benchmark
+    regressions : the subset of rows slower than the threshold
+
+    """
+
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.load(f)
+    if isinstance(current, str):
+        with open(current) as f:
+            current = json.load(f)
+
+    rows = []
+    for name, result in current['results'].items():
+        if name in baseline['results']:
+            old, new = baseline['results'][name][stat], result[stat]
+            rows.append((name, old, new, new / old))
+
+    regressions = [row for row in rows if row[3] > 1 + threshold]
+
+    return rows, regressions
+
+
+def print_comparison(rows, regressions, threshold = 0.2):
+    """
+    Prints the output of compare() as a table, flagging the regressions.
+    """
+
+    for name, old, new, ratio in rows:
+        flag = '  <-- REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{name:<40} {old*1e3:10.3f} ms -> {new*1e3:10.3f} ms  ({ratio:5.2f}x){flag}')
+    if regressions:
+        print(f'{len(regressions)} regression(s) beyond {threshold:.0%}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks for the smoothing, binning and CSRE hot paths.')
+    parser.add_argument('--out', default = 'bench_results.json', help = 'where to save the JSON report')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = grid_sizes, help = 'grid sizes in pixels')
+    parser.add_argument('--R', type = int, nargs = '+', default = resolutions, help = 'resolutions')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'timing runs per benchmark')
+    parser.add_argument('--no-csre', action = 'store_true', help = 'skip the end-to-end CSRE benchmarks')
+    parser.add_argument('--compare', metavar = 'BASELINE', help = 'baseline JSON report to compare against')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'fractional slowdown flagged as a regression')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.R, args.repeat, csre = not args.no_csre)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent = 1)
+    print(f'saved to {args.out}')
+
+    if args.compare:
+        rows, regressions = compare(args.compare, report, args.threshold)
+        print_comparison(rows, regressions, args.threshold)
+        if regressions:
+            sys.exit(1)
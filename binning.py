@@ -1,9 +1,221 @@
 import numpy as np
+from collections import namedtuple
 
+from precision import get_dtype, accum_dtype
 
-def bin_err(wave, err, R):
+
+# bin layout for a given (wave, R), see bin_plan
+BinPlan = namedtuple('BinPlan', ['centers', 'widths', 'lo', 'hi'])
+
+# binned errors for several resolutions, stored back to back, see error_pyramid
+ErrorPyramid = namedtuple('ErrorPyramid', ['R', 'centers', 'errs', 'widths', 'offsets'])
+
+
+def bin_plan(wave, R):
+    """
+    Computes the bin layout used by bin_err for a wavelength grid and resolution R.
+    Only depends on (wave, R), so it can be computed once and reused for any number
+    of error arrays on the same grid (e.g. many targets or numbers of transits).
+
+    The bin centers form a geometric sequence going backwards from the red end:
+
+    lamb_k = lamb_last * ((2R - 1)/(2R + 1))^k
+
+    so the whole layout is computed in one shot instead of bin by bin.
+
+    ================== Params ==================
+
+    wave  : array or list of wavelengths (microns, sorted, increasing)
+    R     : spectral resolution (JWST NIRSPEC: ~100 (prism), ~1000, or ~2700)
+
+    ================== Returns =================
+
+    BinPlan with fields (in order of increasing wavelength):
+
+    centers : bin centers (microns)
+    widths  : full bin widths (microns)
+    lo, hi  : index arrays such that bin k holds wave[lo[k]:hi[k]]
+
+    """
+
+    wave = np.asarray(wave)
+
+    # last bin center lines up the rightmost bin edge with the last point in wave
+    last_bin_center = (2*R)/(2*R + 1) * wave[-1]
+    ratio           = (2*R - 1)/(2*R + 1)
+
+    # number of full bins whose left edge (lamb_k * (2R - 1)/2R) stays inside wave,
+    # padded by a couple so the mask below decides the exact count
+    nbins   = int(np.ceil(np.log(wave[0] * 2*R / ((2*R - 1) * last_bin_center)) / np.log(ratio))) + 2
+    centers = last_bin_center * ratio ** np.arange(max(nbins, 1) + 1)
+    dellambs = centers / R
+    nfull   = np.count_nonzero(centers - dellambs/2 >= wave[0])
+    nfull   = max(nfull, 1) # the last bin is always kept
+
+    # full bins, from the red end backwards
+    full_centers  = centers[:nfull]
+    full_dellambs = dellambs[:nfull]
+    lo = np.searchsorted(wave, full_centers - full_dellambs/2, side = 'left')
+    hi = np.searchsorted(wave, full_centers + full_dellambs/2, side = 'left')
+    hi[0] = len(wave) # last bin takes everything redward of its left edge
+
+    # for first bin, reset bin center to first element of wavelength array
+    # bin_width is now just the rest of the wavelength array
+    # take difference between previous bin edge and first point in the
+    # wavelength array to be the dellamb/2
+    first_edge    = centers[nfull] + dellambs[nfull]/2
+    first_dellamb = 2 * (first_edge - wave[0])
+    first_hi      = np.searchsorted(wave, wave[0] + first_dellamb/2, side = 'left')
+
+    # flip to be in order of increasing wavelength
+    return BinPlan(centers = np.append(wave[0], full_centers[::-1]),
+                   widths  = np.append(first_dellamb, full_dellambs[::-1]),
+                   lo      = np.append(0, lo[::-1]),
+                   hi      = np.append(first_hi, hi[::-1]))
+
+
+def bin_err(wave, err, R, plan = None, reference = False, dtype = None):
     """
     Bins error bars to a resolution R:
+
+    R = lamb / deltalamb
+
+    Thus, the bin size changes for each wavelength.
+
+    The inverse variances are summed per bin with a prefix sum over the bin
+    plan's index ranges, so err can also be a 2-D stack of error arrays
+    (n_errs x n_wave) that are all binned in one go. The errors are in dtype,
+    the prefix sum always in precision.accum_dtype (float64).
+
+    ================== Params ==================
+
+    wave       : array or list of wavelengths (microns)
+    err        : array or list of errors on transit spectrum (ppm), shape (n_wave,) or (n_errs, n_wave)
+    R          : spectral resolution (JWST NIRSPEC: ~100 (prism), ~1000, or ~2700)
+    plan       : optional BinPlan from bin_plan(wave, R) to reuse
+    reference  : if True, use the original bin-by-bin loop (bin_err_loop)
+    dtype      : dtype of new_err (Default is None, precision.dtype)
+
+    ================== Returns =================
+
+    bin_centers : bin centers (microns)
+    new_err     : standard error of the weighted mean in each bin (ppm)
+    bin_widths  : full bin widths (microns)
+
+    """
+
+    dtype = get_dtype(dtype)
+
+    if reference:
+        centers, new_err, widths = bin_err_loop(wave, np.asarray(err), R)
+        return np.array(centers), np.array(new_err, dtype = dtype), np.array(widths)
+
+    if plan is None:
+        plan = bin_plan(wave, R)
+
+    cumsum = weight_cumsum(err, dtype)
+
+    return plan.centers, binned_err(cumsum, plan.lo, plan.hi, dtype), plan.widths
+
+
+def weight_cumsum(err, dtype = None):
+    """
+    Prefix sum of the weights 1/err^2 along the last axis, with a leading zero so
+    the sum over [lo, hi) is cumsum[hi] - cumsum[lo]. Built in place in one buffer,
+    always in precision.accum_dtype (float64); err is read as dtype.
+    """
+
+    err     = np.asarray(err, dtype = get_dtype(dtype))
+    cumsum  = np.zeros(err.shape[:-1] + (err.shape[-1] + 1,), dtype = accum_dtype)
+    weights = cumsum[..., 1:]
+    np.square(err, out = weights)
+    np.reciprocal(weights, out = weights)
+    np.cumsum(weights, axis = -1, out = weights)
+
+    return cumsum
+
+
+def binned_err(cumsum, lo, hi, dtype = None):
+    """
+    Standard error of the weighted mean over each [lo, hi) index range, from weight_cumsum.
+    """
+
+    with np.errstate(divide = 'ignore'):
+        new_err  = cumsum[..., hi]
+        new_err -= cumsum[..., lo]
+        np.reciprocal(new_err, out = new_err)
+        np.sqrt(new_err, out = new_err)
+
+    return new_err.astype(get_dtype(dtype), copy = False)
+
+
+def error_pyramid(wave, err, Rs, white = True, dtype = None):
+    """
+    Bins error bars to a whole list of resolutions in one pass: the prefix sum
+    of the inverse variances is built once from the native grid, and every
+    resolution after that is just its bin plan and two lookups per bin. The
+    results are stored back to back in flat arrays (see pyramid_level).
+
+    ================== Params ==================
+
+    wave   : array or list of wavelengths (microns, sorted, increasing)
+    err    : array or list of errors on transit spectrum (ppm), shape (n_wave,) or (n_errs, n_wave)
+    Rs     : list of spectral resolutions
+    white  : whether to add the white light curve (one bin over everything, see
+             white_light_curve) as a last level with R = 0 (Default is True)
+    dtype  : dtype of errs (Default is None, precision.dtype)
+
+    ================== Returns =================
+
+    ErrorPyramid with fields:
+
+    R        : resolution of each level
+    centers  : bin centers of all levels (microns)
+    errs     : binned errors of all levels (ppm), shape (n_bins,) or (n_errs, n_bins)
+    widths   : full bin widths of all levels (microns)
+    offsets  : level k is [offsets[k], offsets[k+1]) of the flat arrays
+
+    """
+
+    wave   = np.asarray(wave)
+    cumsum = weight_cumsum(err, dtype)
+
+    plans = [bin_plan(wave, R) for R in Rs]
+    if white:
+        plans.append(BinPlan(centers = np.array([np.mean([wave[0], wave[-1]])]),
+                             widths  = np.array([wave[-1] - wave[0]]),
+                             lo      = np.array([0]),
+                             hi      = np.array([len(wave)])))
+
+    lo = np.concatenate([plan.lo for plan in plans])
+    hi = np.concatenate([plan.hi for plan in plans])
+
+    return ErrorPyramid(R       = np.array(list(Rs) + ([0] if white else [])),
+                        centers = np.concatenate([plan.centers for plan in plans]),
+                        errs    = binned_err(cumsum, lo, hi, dtype),
+                        widths  = np.concatenate([plan.widths for plan in plans]),
+                        offsets = np.cumsum([0] + [len(plan.lo) for plan in plans]))
+
+
+def pyramid_level(pyramid, R):
+    """
+    (bin centers, errors, bin widths) for resolution R of an ErrorPyramid, same as
+    bin_err(wave, err, R) (R = 0 for the white light curve). These are views, not copies.
+    """
+
+    matches = np.flatnonzero(pyramid.R == R)
+    if not len(matches):
+        raise KeyError(f'R = {R} is not in the pyramid, it has R = {list(pyramid.R)}')
+
+    level = slice(pyramid.offsets[matches[0]], pyramid.offsets[matches[0] + 1])
+
+    return pyramid.centers[level], pyramid.errs[..., level], pyramid.widths[level]
+
+
+def bin_err_loop(wave, err, R):
+    """
+    Original bin-by-bin implementation of bin_err, kept as a reference
+    to check the bin plan version against. Bins error bars to a resolution R:
     
     R = lamb / deltalamb
     
@@ -0,0 +1,312 @@
+import numpy as np
+
+import re
+import csv
+from itertools import islice
+
+# my functions
+from batch import run_batch
+from main import has_spectrum
+from constants import R_earth, R_jup, R_sun, G_cgs, M_sun_g, T_sun
+
+# values used for anything the catalogs don't have (none of the shipped ones list
+# magnitudes; exports with sy_jmag/koi_jmag columns use those instead). Rows that
+# used any of these list them under 'defaults_used'.
+# 'star_temp' [K] can be added too, for rows with no Teff and no stellar mass to estimate it from
+default_params = {
+    'Rref'       : 6.957e8, # reference star used in the ExoTransmit runs (Sun)
+    'flat'       : True,
+    'R'          : 100,
+    'mag'        : 10.0,
+    'ref_wave'   : 'J',
+    'star_metal' : 0.0,
+    'trans_dur'  : 2.0,     # [hours]
+}
+
+
+def spectrum_name(name):
+    """
+    Turns a catalog name into the name used for its ExoTransmit spectrum file,
+    e.g. 'TRAPPIST-1 b' -> 'trappist1b' (same convention as trappist1b_params.py).
+    """
+
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def read_catalog(path, chunksize = 500):
+    """
+    Streams a NASA Exoplanet Archive csv export in chunks of rows, skipping
+    the '#' comment header. Numeric fields are converted to floats (missing
+    values become nan) and everything else is left as a string.
+
+    ================== Params ==================
+
+    path       : path to the csv file (e.g. 'tess_planets.csv', 'kepler_stars.csv')
+    chunksize  : number of rows per chunk (Default is 500)
+
+    ================== Returns =================
+
+    generator of lists of row dicts
+
+    """
+
+    with open(path, newline = '') as f:
+        reader = csv.DictReader(line for line in f if not line.startswith('#'))
+
+        while True:
+            chunk = [{key : _to_number(value) for key, value in row.items()} for row in islice(reader, chunksize)]
+            if not chunk:
+                return
+            yield chunk
+
+
+def _to_number(value):
+    """
+    Converts a csv field to a float where possible.
+    """
+
+    if value is None or value == '':
+        return np.nan
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _first(row, *keys):
+    """
+    Returns the first of keys that is present and not nan in row (or nan).
+    """
+
+    for key in keys:
+        value = row.get(key, np.nan)
+        if isinstance(value, str) or not np.isnan(value):
+            return value
+    return np.nan
+
+
+def main_sequence_teff(Ms, Rs):
+    """
+    Rough effective temperature [K] of a main sequence star from its mass and
+    radius, for catalogs that don't list Teff (e.g. tess_planets.csv). Uses the
+    mass-luminosity relation
+
+    L = 0.23 M^2.3 (M < 0.43), M^4 (M < 2), 1.4 M^3.5 (M >= 2)    [L_sun, M_sun]
+
+    and L = 4 pi Rs^2 sigma Teff^4, i.e. Teff = T_sun (L / Rs^2)^(1/4) in solar units.
+
+    ================== Params ==================
+
+    Ms  : stellar mass [M_sun]
+    Rs  : stellar radius [m]
+
+    """
+
+    if Ms < 0.43:
+        L = 0.23 * Ms**2.3
+    elif Ms < 2:
+        L = Ms**4
+    else:
+        L = 1.4 * Ms**3.5
+
+    return float(T_sun * (L / (Rs / R_sun)**2)**0.25)
+
+
+def row_to_params(row, defaults = None):
+    """
+    Builds csre_params/pandexo_params-equivalent dicts from one catalog row,
+    in the same form as the hand-written {name}_params.py files. Works with both
+    the planetary systems exports (pl_*, st_* columns) and the KOI exports (koi_* columns).
+
+    Stellar radius falls back to Rp / sqrt(transit depth), log g to G M / Rs^2 and
+    Teff to main_sequence_teff (then defaults['star_temp'], if given) when the catalog
+    doesn't list them. The J magnitude is taken from sy_jmag/koi_jmag if the export
+    has them. The stellar ExoTransmit spectrum is looked up
+    by host name (e.g. transmission_trappist1.dat) unless defaults has a 'star_name'.
+
+    ================== Params ==================
+
+    row       : dict of one catalog row (from read_catalog)
+    defaults  : dict of values to use for anything missing (Default is default_params)
+
+    ================== Returns =================
+
+    params : dict with 'name', 'csre_params' and 'pandexo_params' (usable by main.load_params),
+             and 'defaults_used', the list of values that came from defaults rather than
+             the catalog (e.g. ['mag', 'trans_dur']), or None if the row is missing
+             something we can't fill in
+
+    """
+
+    defaults = dict(default_params, **(defaults or {}))
+    used     = []
+
+    ### Names ###
+    if 'kepoi_name' in row:
+        planet = row['kepler_name'] if isinstance(row['kepler_name'], str) else row['kepoi_name']
+        host   = row['kepoi_name'].split('.')[0]
+        if isinstance(row['kepler_name'], str):
+            host = row['kepler_name'].rsplit(' ', 1)[0]
+    else:
+        planet, host = row['pl_name'], row['hostname']
+
+    ### Radii ###
+    Rp    = _first(row, 'pl_rade', 'koi_prad') * R_earth # [m]
+    Rs    = _first(row, 'st_rad', 'koi_srad') * R_sun    # [m]
+    depth = _first(row, 'pl_trandep', 'koi_depth')
+    depth = depth / 100 if 'pl_trandep' in row else depth * 1e-6 # % or ppm -> fraction
+    if np.isnan(Rs):
+        Rs = float(Rp / np.sqrt(depth))
+
+    ### Star ###
+    Ms   = _first(row, 'st_mass', 'koi_smass')
+    Teff = _first(row, 'st_teff', 'koi_steff')
+    if np.isnan(Teff) and Ms > 0:
+        Teff = main_sequence_teff(Ms, Rs)
+    if np.isnan(Teff) and 'star_temp' in defaults:
+        Teff = defaults['star_temp']
+        used.append('star_temp')
+
+    logg  = _first(row, 'st_logg')
+    if np.isnan(logg):
+        logg = float(np.log10(G_cgs * Ms * M_sun_g / (Rs * 100)**2))
+
+    mag, ref_wave = _first(row, 'sy_jmag', 'koi_jmag'), 'J'
+    if np.isnan(mag):
+        mag, ref_wave = defaults['mag'], defaults['ref_wave']
+        used.append('mag')
+
+    trans_dur = _first(row, 'pl_trandur')
+    if np.isnan(trans_dur):
+        trans_dur = defaults['trans_dur']
+        used.append('trans_dur')
+
+    if np.any(np.isnan([Rp, Rs, Teff, logg])) or Rp <= 0 or Rs <= 0:
+        return None
+
+    if 'star_name' in defaults:
+        used.append('star_name')
+
+    csre_params = {
+        'Rp'          : Rp,
+        'Rs'          : Rs,
+        'Rref'        : defaults['Rref'],
+        'planet_name' : spectrum_name(planet),
+        'star_name'   : defaults.get('star_name', spectrum_name(host)),
+        'flat'        : defaults['flat'],
+        'R'           : defaults['R']
+    }
+
+    pandexo_params = {
+        'sys_name'      : spectrum_name(host),
+        'mag'           : mag,
+        'ref_wave'      : ref_wave,
+        'star_temp'     : Teff,
+        'star_metal'    : defaults['star_metal'],
+        'star_logg'     : logg,
+        'trans_dur'     : trans_dur,
+        'star_radius'   : Rs / R_sun,
+        'planet_radius' : Rp / R_jup
+    }
+
+    return {'name' : planet, 'csre_params' : csre_params, 'pandexo_params' : pandexo_params, 'defaults_used' : used}
+
+
+def missing_spectra(params):
+    """
+    Names of the ExoTransmit spectra a param dict needs but that can't be found
+    (in main.spectra_path or the packed store), e.g. ['trappist1'].
+    """
+
+    csre  = params['csre_params']
+    names = [csre['star_name']] if csre['flat'] else [csre['star_name'], csre['planet_name']]
+
+    return [name for name in names if not has_spectrum(name)]
+
+
+def m_dwarfs(params):
+    """
+    Example filter: keeps M dwarf hosts (Teff < 4000 K).
+    """
+
+    return params['pandexo_params']['star_temp'] < 4000
+
+
+def catalog_params(path, keep = None, defaults = None, chunksize = 500, require_spectra = True):
+    """
+    Streams param dicts for every usable row in a catalog, without ever holding
+    the whole file or writing any {name}_params.py modules.
+
+    Rows whose ExoTransmit spectra can't be found (see missing_spectra) are skipped,
+    since they'd only fail in the batch, unless require_spectra is False, in which
+    case they're kept with the missing names under 'missing_spectra'.
+
+    ================== Params ==================
+
+    path             : path to the csv file
+    keep             : optional filter, a function of the param dict returning True to keep it (e.g. m_dwarfs)
+    defaults         : dict of values to use for anything missing (see default_params)
+    chunksize        : number of rows to parse at a time (Default is 500)
+    require_spectra  : whether to skip rows without spectra (Default is True)
+
+    ================== Returns =================
+
+    generator of param dicts (see row_to_params)
+
+    Raises ValueError if the file has rows but none of them are usable (e.g. a
+    catalog without some column and nothing in defaults to fill it in, or no
+    spectra for any of them).
+
+    """
+
+    nrows, usable, no_spectra = 0, 0, set()
+    for chunk in read_catalog(path, chunksize):
+        for row in chunk:
+            nrows += 1
+            params = row_to_params(row, defaults)
+            if params is None:
+                continue
+
+            missing = missing_spectra(params)
+            if missing:
+                no_spectra.update(missing)
+                if require_spectra:
+                    continue
+                params['missing_spectra'] = missing
+
+            usable += 1
+            if keep is not None and not keep(params):
+                continue
+            yield params
+
+    if nrows and not usable:
+        if no_spectra:
+            raise ValueError(f'none of the {nrows} rows in {path} have ExoTransmit spectra (e.g. transmission_'
+                             f'{sorted(no_spectra)[0]}.dat); check main.spectra_path, or give a star_name in '
+                             'defaults to use one spectrum for every host')
+        raise ValueError(f'none of the {nrows} rows in {path} could be turned into params (each needs a planet '
+                         'radius, a stellar radius or transit depth, a Teff or stellar mass, and a log g or '
+                         "stellar mass); add what's missing to defaults, e.g. {'star_temp' : 3500}")
+
+
+def screen_catalog(path, keep = None, defaults = None, numtran = 1, require_spectra = True, **batch_kwargs):
+    """
+    Runs the CSRE + chi-squared pipeline on every (filtered) target in a catalog.
+
+    ================== Params ==================
+
+    path             : path to the csv file
+    keep             : optional filter on the param dicts (e.g. m_dwarfs)
+    defaults         : dict of values to use for anything missing (see default_params)
+    numtran          : number of transits to scale the errorbars by (Default is 1)
+    require_spectra  : whether to skip rows without spectra (Default is True, see catalog_params)
+    batch_kwargs     : passed on to batch.run_batch (max_workers, timeout, results_file, store, ...)
+
+    ================== Returns =================
+
+    results : list of result rows from batch.run_batch
+
+    """
+
+    return run_batch(catalog_params(path, keep, defaults, require_spectra = require_spectra),
+                     numtran = numtran, **batch_kwargs)
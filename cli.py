@@ -0,0 +1,448 @@
+"""
+Command line entry point for unattended runs:
+
+    python cli.py csre hats6b trappist1b --numtran 5 --workers 4
+    python cli.py sweep hats6b --R 50 100 200 --noise-Teff 2800 3000 3200
+    python cli.py bench --compare bench_baseline.json
+
+Settings come from (later ones win) default_config, a TOML file (csre.toml in
+the working directory, or the one given by CSRE_CONFIG / --config), environment
+variables (config_env) and the command line, e.g. a csre.toml of
+
+    spectra_path  = "/data/Exo_Transmit/Spectra"
+    cache_dir     = "/scratch/pandexo_cache"
+    workers       = 8
+    noise_backend = "surrogate"
+
+Every run writes a JSON manifest to manifest_dir with the inputs, settings,
+package versions, git commit, per-stage timings and a summary of the outputs,
+so runs can be reproduced and compared later.
+
+PandExo, matplotlib, scipy and molmass are never imported here; the pipeline
+modules are only imported once a subcommand needs them.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+# default settings
+default_config = {
+    'spectra_path'  : None,  # None keeps main.spectra_path
+    'cache_dir'     : 'pandexo_cache',
+    'workers'       : None,  # None is one process per CPU
+    'noise_backend' : 'pandexo',
+    'manifest_dir'  : 'manifests'
+}
+
+# environment variable for each setting
+config_env = {
+    'spectra_path'  : 'CSRE_SPECTRA_PATH',
+    'cache_dir'     : 'PANDEXO_CACHE_DIR',
+    'workers'       : 'CSRE_WORKERS',
+    'noise_backend' : 'NOISE_BACKEND',
+    'manifest_dir'  : 'CSRE_MANIFEST_DIR'
+}
+
+# config file picked up from the working directory if there is one
+default_config_file = 'csre.toml'
+
+# packages whose versions go into the manifests (read from the install metadata, not imported)
+tracked_packages = ['numpy', 'scipy', 'matplotlib', 'molmass', 'pandexo.engine']
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_toml(path):
+    """
+    Reads a TOML file (tomllib on Python 3.11+, the tomli package before that).
+    """
+
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+
+def load_config(path = None, overrides = None):
+    """
+    Collects the run settings from the defaults, the config file, the
+    environment and overrides (in that order, later ones win).
+
+    ================== Params ==================
+
+    path       : TOML config file (Default is None: CSRE_CONFIG, or csre.toml if it exists)
+    overrides  : dict of settings to force, e.g. from the command line (None values are ignored)
+
+    ================== Returns =================
+
+    config : dict of settings, plus 'config_file' (the file that was read, or None)
+
+    """
+
+    config = dict(default_config)
+
+    if path is None:
+        path = os.environ.get('CSRE_CONFIG')
+    if path is None and os.path.exists(default_config_file):
+        path = default_config_file
+
+    if path is not None:
+        for key, value in read_toml(path).items():
+            if key not in default_config:
+                raise ValueError(f"unknown setting '{key}' in {path}, expected one of {list(default_config)}")
+            config[key] = value
+
+    for key, var in config_env.items():
+        if var in os.environ:
+            config[key] = os.environ[var]
+
+    config.update({key : value for key, value in (overrides or {}).items() if value is not None})
+
+    if config['workers'] is not None:
+        config['workers'] = int(config['workers'])
+    config['config_file'] = path
+
+    return config
+
+
+def apply_config(config):
+    """
+    Points the pipeline modules at the configured spectra, cache and noise backend.
+    Also exports them as environment variables so spawned worker processes
+    (which re-import the modules) pick up the same settings.
+    """
+
+    import main
+    import run_pandexo
+    import pandexo_cache
+
+    if config['spectra_path'] is not None:
+        main.spectra_path = config['spectra_path']
+    config['spectra_path'] = main.spectra_path
+
+    pandexo_cache.cache_dir   = config['cache_dir']
+    run_pandexo.noise_backend = config['noise_backend']
+
+    for key in ('spectra_path', 'cache_dir', 'noise_backend'):
+        os.environ[config_env[key]] = str(config[key])
+
+
+def package_versions(packages = None):
+    """
+    Installed versions of python and the tracked packages (None if not installed).
+    """
+
+    from importlib import metadata
+
+    versions = {'python' : platform.python_version()}
+    for package in (tracked_packages if packages is None else packages):
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return versions
+
+
+def git_state():
+    """
+    Commit the code was run from and whether tracked files had local changes
+    (None if this isn't a git checkout or git isn't available).
+    """
+
+    def git(*args):
+        return subprocess.run(['git', *args], cwd = package_dir, capture_output = True,
+                              text = True, timeout = 30, check = True).stdout.strip()
+
+    try:
+        return {'commit' : git('rev-parse', 'HEAD'),
+                'dirty'  : bool(git('status', '--porcelain', '--untracked-files=no'))}
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def target_inputs(targets):
+    """
+    The csre_params and pandexo_params each target was run with.
+    """
+
+    from main import load_params
+    from batch import target_name
+
+    inputs = {}
+    for target in targets:
+        try:
+            params = load_params(target)
+            inputs[target_name(target)] = {'csre_params'    : dict(params.csre_params),
+                                           'pandexo_params' : dict(params.pandexo_params)}
+        except Exception as e:
+            # the run itself will report this target as failed
+            inputs[target_name(target)] = {'error' : f'{type(e).__name__}: {e}'}
+
+    return inputs
+
+
+def stage_timings(rows):
+    """
+    Number of calls and total wall/CPU time per stage from profiling records.
+    """
+
+    timings = {}
+    for row in rows:
+        entry = timings.setdefault(row['stage'], {'calls' : 0, 'wall' : 0.0, 'cpu' : 0.0})
+        entry['calls'] += 1
+        entry['wall']  += row['wall']
+        entry['cpu']   += row['cpu']
+
+    return timings
+
+
+def write_manifest(manifest, path = None, manifest_dir = 'manifests'):
+    """
+    Saves a run manifest as JSON.
+
+    ================== Params ==================
+
+    manifest      : manifest dict (see run)
+    path          : file to write to (Default is None, {manifest_dir}/{command}-{date}-{pid}.json)
+    manifest_dir  : directory for automatically named manifests (Default is 'manifests')
+
+    ================== Returns =================
+
+    path : where the manifest was written
+
+    """
+
+    if path is None:
+        os.makedirs(manifest_dir, exist_ok = True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(manifest['started']))
+        path  = os.path.join(manifest_dir, f"{manifest['command']}-{stamp}-{os.getpid()}.json")
+
+    from pandexo_cache import _jsonable
+
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent = 1, default = _jsonable)
+
+    return path
+
+
+def cmd_csre(args, config):
+    """
+    CSRE + chisquared for each target over a process pool (see batch.run_batch).
+    """
+
+    from batch import run_batch
+
+    inputs = target_inputs(args.names)
+    if args.prefetch is None:
+        results = run_batch(args.names, numtran = args.numtran, max_workers = config['workers'],
+                            timeout = args.timeout, results_file = args.out, use_cache = not args.no_cache,
+                            store = args.store)
+    else:
+        from async_pipeline import run_pipeline
+
+        # --workers sets how many targets are in PandExo at once
+        results = run_pipeline(args.names, numtran = args.numtran, results_file = args.out,
+                               prefetch = args.prefetch, use_cache = not args.no_cache,
+                               workers = {'noise' : config['workers'] or 1})
+
+    for row in results:
+        print(f"{row['name']:<20} {row['status']:<8} numsig = {row['numsig']:8.3f}  {row['error']}")
+
+    failed  = [row['name'] for row in results if row['status'] not in ('ok', 'skipped')]
+    outputs = {'results_file' : args.out, 'store' : args.store, 'results' : results, 'failed' : failed}
+
+    return inputs, outputs, 1 if failed else 0
+
+
+def cmd_sweep(args, config):
+    """
+    Parameter sweep for one system (see sweep.csre_sweep), saved as an .npz
+    with the result cube and the parameter grids.
+    """
+
+    import numpy as np
+    from sweep import csre_sweep
+
+    inputs = target_inputs([args.name])
+    inputs['grid'] = {key : getattr(args, key) for key in ('Rp', 'Rs', 'noise_Teff', 'R')}
+
+    coords, cube = csre_sweep(args.name, Rp = args.Rp, Rs = args.Rs, noise_Teff = args.noise_Teff, R = args.R,
+                              numtran = args.numtran, err_R = args.err_R, use_cache = not args.no_cache)
+    np.savez(args.out, cube = cube, **coords)
+
+    best = np.unravel_index(np.argmax(cube['numsig']), cube.shape)
+    print(f'saved {cube.shape} sweep to {args.out}')
+    print('highest numsig {:.3f} at '.format(cube['numsig'][best])
+          + ', '.join(f'{key} = {coords[key][i]:g}' for key, i in zip(coords, best)))
+
+    outputs = {'file' : args.out, 'shape' : list(cube.shape),
+               'max_numsig' : float(cube['numsig'][best]),
+               'max_numsig_at' : {key : coords[key][i] for key, i in zip(coords, best)}}
+
+    return inputs, outputs, 0
+
+
+def cmd_bench(args, config):
+    """
+    Benchmark suite (see benchmarks.py), optionally compared against a baseline.
+    """
+
+    import benchmarks
+
+    report = benchmarks.run_benchmarks(args.sizes, args.R, args.repeat, csre = not args.no_csre)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent = 1)
+    print(f'saved to {args.out}')
+
+    outputs = {'file' : args.out, 'regressions' : None}
+    if args.compare:
+        rows, regressions = benchmarks.compare(args.compare, report, args.threshold)
+        benchmarks.print_comparison(rows, regressions, args.threshold)
+        outputs['regressions'] = [row[0] for row in regressions]
+
+    inputs = {'sizes' : args.sizes, 'R' : args.R, 'repeat' : args.repeat, 'baseline' : args.compare}
+
+    return inputs, outputs, 1 if outputs['regressions'] else 0
+
+
+def positive_int(value):
+    """
+    argparse type for integers of at least 1.
+    """
+
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'has to be at least 1, not {number}')
+
+    return number
+
+
+def build_parser():
+    """
+    Argument parser for the csre, sweep and bench subcommands.
+    """
+
+    parser = argparse.ArgumentParser(description = 'Chromatic stellar radii effect pipeline.')
+    parser.add_argument('--config', help = f'TOML config file (Default is $CSRE_CONFIG or ./{default_config_file})')
+    parser.add_argument('--spectra-path', help = 'directory with the ExoTransmit spectra')
+    parser.add_argument('--cache-dir', help = 'PandExo cache directory')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes')
+    parser.add_argument('--backend', choices = ['pandexo', 'surrogate'], help = 'noise backend')
+    parser.add_argument('--manifest', help = 'where to write the run manifest (Default is an automatic name in manifest_dir)')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+
+    csre = subparsers.add_parser('csre', help = 'CSRE + chisquared for one or more systems')
+    csre.add_argument('names', nargs = '+', help = 'system names ({name}_params.py)')
+    csre.add_argument('--numtran', type = int, default = 1, help = 'number of transits')
+    csre.add_argument('--timeout', type = float, help = 'per-target time limit in seconds')
+    csre.add_argument('--out', default = 'csre_results.csv', help = 'results table')
+    csre.add_argument('--no-cache', action = 'store_true', help = "don't use the PandExo cache")
+    csre.add_argument('--store', help = 'SQLite result store, targets already in it are skipped')
+    csre.add_argument('--prefetch', type = positive_int, help = ('run as an async pipeline (see async_pipeline.py), loading '
+                                                        'and smoothing up to this many targets ahead of PandExo'))
+    csre.set_defaults(func = cmd_csre)
+
+    sweep = subparsers.add_parser('sweep', help = 'parameter sweep for one system')
+    sweep.add_argument('name', help = 'system name ({name}_params.py)')
+    sweep.add_argument('--Rp', type = float, nargs = '+', help = 'planet radii [m]')
+    sweep.add_argument('--Rs', type = float, nargs = '+', help = 'stellar radii [m]')
+    sweep.add_argument('--noise-Teff', type = float, nargs = '+',
+                       help = "stellar temperatures for PandExo [K] (only change the error bars, not the star's spectrum)")
+    sweep.add_argument('--R', type = int, nargs = '+', help = 'smoothing resolutions')
+    sweep.add_argument('--numtran', type = int, default = 1, help = 'number of transits')
+    sweep.add_argument('--err-R', type = int, default = 25, help = 'resolution of the error bars')
+    sweep.add_argument('--out', default = 'csre_sweep.npz', help = 'output .npz file')
+    sweep.add_argument('--no-cache', action = 'store_true', help = "don't use the PandExo cache")
+    sweep.set_defaults(func = cmd_sweep)
+
+    bench = subparsers.add_parser('bench', help = 'benchmark suite')
+    bench.add_argument('--out', default = 'bench_results.json', help = 'where to save the JSON report')
+    bench.add_argument('--sizes', type = int, nargs = '+', help = 'grid sizes in pixels')
+    bench.add_argument('--R', type = int, nargs = '+', help = 'resolutions')
+    bench.add_argument('--repeat', type = int, default = 5, help = 'timing runs per benchmark')
+    bench.add_argument('--no-csre', action = 'store_true', help = 'skip the end-to-end CSRE benchmarks')
+    bench.add_argument('--compare', metavar = 'BASELINE', help = 'baseline JSON report to compare against')
+    bench.add_argument('--threshold', type = float, default = 0.2, help = 'fractional slowdown flagged as a regression')
+    bench.set_defaults(func = cmd_bench)
+
+    return parser
+
+
+def run(argv = None):
+    """
+    Runs a subcommand and writes its manifest, even if the run fails.
+
+    ================== Params ==================
+
+    argv  : command line arguments (Default is sys.argv[1:])
+
+    ================== Returns =================
+
+    status : exit code (0 if everything succeeded)
+
+    """
+
+    parser = build_parser()
+    args   = parser.parse_args(argv)
+    if getattr(args, 'prefetch', None) is not None and (args.store or args.timeout is not None):
+        parser.error('--store and --timeout only work without --prefetch')
+
+    config = load_config(args.config, {'spectra_path'  : args.spectra_path,
+                                       'cache_dir'     : args.cache_dir,
+                                       'workers'       : args.workers,
+                                       'noise_backend' : args.backend})
+    apply_config(config)
+
+    import profiling
+
+    # stage records go through a file so the ones from pool workers are kept too
+    # (with fork or spawn, since enable() exports the path as CSRE_PROFILE)
+    fd, profile_path = tempfile.mkstemp(suffix = '.jsonl')
+    os.close(fd)
+    profiling.enable(profile_path, memory = False)
+
+    manifest = {
+        'command'  : args.command,
+        'argv'     : sys.argv[1:] if argv is None else list(argv),
+        'args'     : {key : value for key, value in vars(args).items() if key != 'func'},
+        'config'   : config,
+        'versions' : package_versions(),
+        'git'      : git_state(),
+        'host'     : {'machine' : platform.machine(), 'platform' : platform.platform(), 'cpus' : os.cpu_count()},
+        'started'  : time.time()
+    }
+
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    status = 1
+    try:
+        manifest['inputs'], manifest['outputs'], status = args.func(args, config)
+        manifest['status'] = 'ok' if status == 0 else 'failed'
+    except Exception as e:
+        manifest['status'] = 'error'
+        manifest['error']  = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        profiling.disable()
+        manifest['elapsed'] = time.perf_counter() - wall0
+        manifest['cpu']     = time.process_time() - cpu0
+        manifest['stages']  = stage_timings(profiling.read_jsonl(profile_path))
+        os.remove(profile_path)
+
+        path = write_manifest(manifest, args.manifest, config['manifest_dir'])
+        print(f'manifest saved to {path}')
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(run())
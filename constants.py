@@ -0,0 +1,7 @@
+# unit conversions shared by the catalog loader, sweeps, etc.
+R_earth = 6.371e6   # [m]
+R_jup   = 7.1492e7  # [m]
+R_sun   = 6.957e8   # [m]
+G_cgs   = 6.674e-8  # [cm^3 / g / s^2]
+M_sun_g = 1.989e33  # [g]
+T_sun   = 5772.0    # [K]
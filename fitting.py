@@ -0,0 +1,232 @@
+import numpy as np
+
+import csv
+from collections import namedtuple
+
+# my functions
+from main import load_params, load_spectrum
+import main
+from smoothing import adap_smooth
+from resampling import resample
+
+# observed transmission spectrum, sorted by wavelength (microns, depths and errors in ppm)
+Observed = namedtuple('Observed', ['wave', 'depth', 'err_lo', 'err_hi'])
+
+# row labels used in the observed spectra files, and which value they are
+row_labels = {
+    'median'       : 'depth',
+    'upper'        : 'upper',
+    'lower'        : 'lower',
+    'std error +1' : 'upper',
+    'std error -1' : 'lower'
+}
+
+
+def read_observed(path, unit = None):
+    """
+    Reads an observed transmission spectrum saved as three rows per point
+    (wavelength, depth, point index, label), with labels median/upper/lower
+    (trappist-1b.csv) or median/std error +1/std error -1 (hat-p-18b.csv).
+
+    ================== Params ==================
+
+    path  : csv file
+    unit  : 'ppm' or 'fraction' (Default is None: fraction if every depth is below 1)
+
+    ================== Returns =================
+
+    Observed with fields (sorted by wavelength):
+
+    wave    : wavelengths of the medians (microns)
+    depth   : median transit depths (ppm)
+    err_lo  : distance from the median down to the lower error bar (ppm)
+    err_hi  : distance from the median up to the upper error bar (ppm)
+
+    """
+
+    points = {}
+    with open(path, newline = '') as f:
+        for row in csv.reader(f, skipinitialspace = True):
+            if not row:
+                continue
+            wave, depth, index, label = row[:4]
+            if label.strip() not in row_labels:
+                raise ValueError(f"unknown row label '{label}' in {path}, expected one of {list(row_labels)}")
+            points.setdefault(int(index), {})[row_labels[label.strip()]] = (float(wave), float(depth))
+
+    missing = [index for index, point in points.items() if len(point) != 3]
+    if missing:
+        raise ValueError(f'points {missing} in {path} don\'t have a median, upper and lower row')
+
+    data = np.array([[point['depth'][0], point['depth'][1], point['lower'][1], point['upper'][1]]
+                     for point in points.values()])
+    data = data[np.argsort(data[:, 0], kind = 'stable')]
+
+    if unit is None:
+        unit = 'fraction' if np.all(data[:, 1:] < 1) else 'ppm'
+    if unit not in ('ppm', 'fraction'):
+        raise ValueError(f"unit has to be 'ppm' or 'fraction', not '{unit}'")
+    scale = 1e6 if unit == 'fraction' else 1
+
+    wave, depth, lower, upper = data.T
+
+    return Observed(wave   = wave,
+                    depth  = depth * scale,
+                    err_lo = np.abs(depth - lower) * scale,
+                    err_hi = np.abs(upper - depth) * scale)
+
+
+class CSRELikelihood:
+    """
+    Log-likelihood of an observed transmission spectrum under the CSRE model
+    of a system, for many (Rp, Rs, offset) at once.
+
+    Everything that doesn't depend on the fit parameters is done once here:
+    loading the spectra, building the CSRE spectrum at the system's Rp and Rs,
+    smoothing it to R and resampling it onto the observed wavelengths. Scaling
+    the planet radius by Rp/Rp0 and the (chromatic) stellar radius by Rs/Rs0
+    scales the depth by (Rp/Rp0 * Rs0/Rs)^2, and smoothing and resampling are
+    linear, so the model at the observed wavelengths is just
+
+    model = (Rp/Rp0 * Rs0/Rs)^2 * template + offset
+
+    Note the depths only constrain Rp/Rs; Rs is a separate parameter so it can
+    be given its own prior.
+
+    The asymmetric error bars are used as a split normal: a point's residual is
+    scaled by its upper error bar if the model is above it and by the lower one
+    otherwise, with the split normal's normalization so the likelihood stays
+    continuous and normalized.
+
+    e.g.
+
+        like = CSRELikelihood('trappist1b', 'trappist-1b.csv')
+        logl = like.log_likelihood(Rp, Rs, offset)        # arrays of any (broadcastable) shape
+        logp = like(walkers)                               # (n_walkers x 3) array, e.g. for emcee
+
+    ================== Params ==================
+
+    name      : name of system (or param dict/object, see main.load_params)
+    observed  : Observed spectrum, or path to a file for read_observed
+    R         : resolution to smooth the model to (Default is None, R in csre_params)
+    method    : resampling onto the observed points, 'linear' or 'bin_average' over the
+                spacing between them (Default is None, main.resample_method)
+
+    """
+
+    def __init__(self, name, observed, R = None, method = None):
+
+        params = load_params(name)
+        csre   = params.csre_params
+
+        if isinstance(observed, str):
+            observed = read_observed(observed)
+        self.observed = observed
+
+        self.Rp0, self.Rs0 = csre['Rp'], csre['Rs']
+        R = csre['R'] if R is None else R
+
+        # CSRE spectrum at the system's Rp and Rs (same as main.CSRE)
+        wave, star_spec = load_spectrum(csre['star_name'])
+        if csre['flat']:
+            csre_spec = (self.Rp0 / csre['Rref'])**2 * 1e6 / star_spec  # ppm
+        else:
+            planet_wave, planet_spec = load_spectrum(csre['planet_name'])
+            csre_spec = planet_spec / star_spec * 1e6  # ppm
+
+        smooth_csre_spec = adap_smooth(wave, csre_spec, R, dtype = np.float64)
+
+        # bin widths for 'bin_average': the distance between the midpoints to the neighbouring points
+        widths = np.gradient(observed.wave)
+
+        self.template = resample(wave, smooth_csre_spec, observed.wave, widths,
+                                 method or main.resample_method, dtype = np.float64)
+
+        # split normal: 1/sigma^2 on each side and the log normalization, summed over the points
+        self.inv_var_lo = observed.err_lo**-2
+        self.inv_var_hi = observed.err_hi**-2
+        self.log_norm   = np.sum(np.log(2 / (np.sqrt(2*np.pi) * (observed.err_lo + observed.err_hi))))
+
+    def model(self, Rp, Rs, offset = 0):
+        """
+        Model depths at the observed wavelengths (ppm), shape (broadcast shape of the params, n_points).
+        """
+
+        Rp, Rs, offset = np.broadcast_arrays(*(np.asarray(p, dtype = float) for p in (Rp, Rs, offset)))
+        scale = (Rp / self.Rp0 * self.Rs0 / Rs)**2
+
+        return scale[..., None] * self.template + offset[..., None]
+
+    def log_likelihood(self, Rp, Rs, offset = 0, chunksize = 100000):
+        """
+        Log-likelihood for any number of parameter values at once.
+
+        ================== Params ==================
+
+        Rp         : planet radius [m] (number or array)
+        Rs         : stellar radius [m] (number or array)
+        offset     : constant depth offset [ppm] (number or array, Default is 0)
+        chunksize  : number of parameter vectors evaluated per chunk, to bound memory (Default is 10^5)
+
+        ================== Returns =================
+
+        logl : log-likelihood, with the broadcast shape of Rp, Rs and offset
+
+        """
+
+        Rp, Rs, offset = np.broadcast_arrays(*(np.asarray(p, dtype = float) for p in (Rp, Rs, offset)))
+        shape = Rp.shape
+        Rp, Rs, offset = Rp.ravel(), Rs.ravel(), offset.ravel()
+
+        logl = np.empty(Rp.size)
+        for start in range(0, Rp.size, chunksize):
+            chunk = slice(start, start + chunksize)
+
+            resid = self.observed.depth - self.model(Rp[chunk], Rs[chunk], offset[chunk])
+            chisq = np.sum(resid**2 * np.where(resid < 0, self.inv_var_hi, self.inv_var_lo), axis = -1)
+
+            logl[chunk] = self.log_norm - 0.5 * chisq
+
+        return logl.reshape(shape)
+
+    def __call__(self, theta):
+        """
+        Log-likelihood of (..., 3) arrays of (Rp, Rs, offset), with -inf for
+        non-positive radii (e.g. as the log-probability of a vectorized sampler).
+        """
+
+        theta = np.asarray(theta, dtype = float)
+        Rp, Rs, offset = theta[..., 0], theta[..., 1], theta[..., 2]
+
+        valid = (Rp > 0) & (Rs > 0)
+        logl  = np.full(Rp.shape, -np.inf)
+        logl[valid] = self.log_likelihood(Rp[valid], Rs[valid], offset[valid])
+
+        return logl
+
+
+def fit_grid(likelihood, Rp, Rs, offset):
+    """
+    Evaluates a CSRELikelihood over the full grid of Rp x Rs x offset.
+
+    ================== Params ==================
+
+    likelihood  : CSRELikelihood
+    Rp          : planet radii to try [m]
+    Rs          : stellar radii to try [m]
+    offset      : depth offsets to try [ppm]
+
+    ================== Returns =================
+
+    logl  : log-likelihood cube of shape (len(Rp), len(Rs), len(offset))
+    best  : dict with the 'Rp', 'Rs', 'offset' and 'logl' of the best grid point
+
+    """
+
+    Rp, Rs, offset = (np.atleast_1d(np.asarray(p, dtype = float)) for p in (Rp, Rs, offset))
+    logl = likelihood.log_likelihood(Rp[:, None, None], Rs[None, :, None], offset[None, None, :])
+
+    i, j, k = np.unravel_index(np.argmax(logl), logl.shape)
+    best = {'Rp' : Rp[i], 'Rs' : Rs[j], 'offset' : offset[k], 'logl' : logl[i, j, k]}
+
+    return logl, best
@@ -1,19 +1,120 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.interpolate import interp1d
 
+import os
 import importlib
+from types import SimpleNamespace
 
 # my functions
 from smoothing import adap_smooth
 from run_pandexo import run_pandexo
 from binning import bin_err
+from resampling import resample
+from spectra_store import nirspec_slice
+import spectra_store
+from profiling import stage
+from precision import get_dtype
 
-# path to transit spectra
-spectra_path = '/Users/coffey/Downloads/kipping/Exo_Transmit/Spectra'
+# path to transit spectra (set CSRE_SPECTRA_PATH, or spectra_path in csre.toml for cli.py)
+spectra_path = os.environ.get('CSRE_SPECTRA_PATH', '/Users/coffey/Downloads/kipping/Exo_Transmit/Spectra')
 
+# how the smoothed spectrum is matched to the error bins: 'linear' (interpolate at
+# the bin centers) or 'bin_average' (flux-conserving average over each bin)
+resample_method = 'linear'
 
-def errorbars(params, wave, smooth_csre_spec, R = 25):
+# path to the packed binary store of the spectra (see spectra_store.pack_spectra)
+# None means {spectra_path}/store
+store_path = None
+
+
+def load_params(name):
+    """
+    Loads the parameters for an exoplanet system.
+    
+    ================== Params ==================
+    
+    name  : name of system (loads {name}_params.py), or a dict with 'csre_params' 
+            and 'pandexo_params' entries, or an object that already has them as attributes
+    
+    ================== Returns =================
+    
+    params : object with csre_params and pandexo_params dicts as attributes
+    """
+    
+    if isinstance(name, str):
+        return importlib.import_module(f'{name}_params')
+    
+    if isinstance(name, dict):
+        return SimpleNamespace(**name)
+    
+    return name
+
+
+def with_params(params, csre_params = None, pandexo_params = None):
+    """
+    Copy of a system's parameters with some values changed, e.g.
+    with_params(params, pandexo_params = {'star_temp' : 3100}).
+    The original params (module or object) are left untouched.
+    
+    ================== Params ==================
+    
+    params          : parameter object (see load_params)
+    csre_params     : dict of csre_params values to change
+    pandexo_params  : dict of pandexo_params values to change
+    
+    ================== Returns =================
+    
+    params : new parameter object
+    """
+    
+    return SimpleNamespace(csre_params    = dict(params.csre_params, **(csre_params or {})),
+                           pandexo_params = dict(params.pandexo_params, **(pandexo_params or {})))
+
+
+def load_spectrum(name):
+    """
+    Loads an ExoTransmit transit spectrum sliced to JWST NIRSpec (0.6 - 5.3 um).
+    Reads a zero-copy slice from the packed store if it has the object,
+    and falls back to the transmission_{name}.dat file otherwise.
+    
+    ================== Params ==================
+    
+    name  : object name, as in transmission_{name}.dat
+    
+    ================== Returns =================
+    
+    wave  : wavelengths (microns)
+    spec  : transit depths (fraction, not %)
+    """
+    
+    with stage('load'):
+        wave, spec = spectra_store.load_spectrum(name, store_path or f'{spectra_path}/store')
+        if wave is None:
+            spectrum = np.loadtxt(f'{spectra_path}/transmission_{name}.dat', skiprows = 2).T  # ExoTransmit 0.3 - 30 um
+    
+    if wave is not None:
+        return wave, spec
+    
+    # slicing wavelength range to JWST NIRSpec (0.6 - 5.3 um)
+    with stage('slice'):
+        wave_index = nirspec_slice(spectrum[0], (0.6e-6, 5.3e-6))
+        wave       = spectrum[0][wave_index] * 1e6  # microns
+        spec       = spectrum[1][wave_index] / 100  # convert from %
+    
+    return wave, spec
+
+
+def has_spectrum(name):
+    """
+    Whether load_spectrum can find an object's spectrum (in the packed store or as a .dat file).
+    """
+
+    if spectra_store.load_spectrum(name, store_path or f'{spectra_path}/store')[0] is not None:
+        return True
+
+    return os.path.exists(f'{spectra_path}/transmission_{name}.dat')
+
+
+def errorbars(params, wave, smooth_csre_spec, R = 25, use_cache = True, method = None, dtype = None):
     """
     Places errorbars on the final transit spectrum.
     
@@ -23,6 +124,9 @@ def errorbars(params, wave, smooth_csre_spec, R = 25):
     wave              : array or list of wavelengths (microns)
     smooth_csre_spec  : transit spectrum including the CSRE, smoothed to chosen resolution
     R                 : resolution of error bars (defaulted at 25 to reduce plot clutter)
+    use_cache         : whether to use the on-disk PandExo cache (Default is True)
+    method            : 'linear' or 'bin_average' resampling onto the error bins (Default is resample_method)
+    dtype             : dtype of y and yerr (Default is None, precision.dtype)
     
     ================== Returns =================
     
@@ -32,27 +136,128 @@ def errorbars(params, wave, smooth_csre_spec, R = 25):
     """
     
     # Running PandExo
-    err_wave, err = run_pandexo(params)
+    with stage('run_pandexo'):
+        err_wave, err = run_pandexo(params, use_cache = use_cache)
+    
+    return bin_errorbars(err_wave, err, wave, smooth_csre_spec, R, method, dtype)
+
+
+def bin_errorbars(err_wave, err, wave, smooth_csre_spec, R = 25, method = None, dtype = None):
+    """
+    Bins PandExo's error bars to R and finds the transit depths at them
+    (the part of errorbars after the noise model). Raises ValueError if the
+    error bars reach past the ends of wave, like the interp1d this used to use.
+    
+    ================== Params ==================
+    
+    err_wave          : wavelengths of the PandExo error bars (microns)
+    err               : PandExo error bars (ppm)
+    wave              : array or list of wavelengths (microns)
+    smooth_csre_spec  : transit spectrum including the CSRE, smoothed to chosen resolution
+    R                 : resolution of error bars (Default is 25)
+    method            : 'linear' or 'bin_average' resampling onto the error bins (Default is resample_method)
+    dtype             : dtype of y and yerr (Default is None, precision.dtype)
+    
+    ================== Returns =================
+    
+    x     : wavelength positions of error bars (microns)
+    y     : transit depths at x wavelength positions (ppm)
+    yerr  : array or list of errors on transit spectrum (ppm)
+    """
     
     # rebinning to a lower R
-    new_err_wave, new_err, dellambs = bin_err(err_wave, err, R)
+    with stage('bin_err'):
+        new_err_wave, new_err, dellambs = bin_err(err_wave, err, R, dtype = dtype)
     
-    # need to interp to find y value for error bars on the transit spectrum
-    interp_func = interp1d(wave, smooth_csre_spec)
-
-    x    = new_err_wave
-    y    = interp_func(new_err_wave)
+    # need to resample to find y value for error bars on the transit spectrum
+    with stage('resample'):
+        x    = new_err_wave
+        y    = resample(wave, smooth_csre_spec, new_err_wave, dellambs, method or resample_method, dtype)
     yerr = new_err
     
     return x, y, yerr
 
 
+def load_spectra(params):
+    """
+    Loads the spectra a system's CSRE is made from (see load_spectrum).
+    
+    ================== Params ==================
+    
+    params  : parameter object (see load_params)
+    
+    ================== Returns =================
+    
+    wave         : wavelengths (microns)
+    star_spec    : star's transit depths (fraction)
+    planet_spec  : planet's transit depths on the same grid (None if flat)
+    """
+    
+    csre = params.csre_params
+    
+    # ExoTransmit spectrum sliced to JWST NIRSpec (0.6 - 5.3 um)
+    wave, star_spec = load_spectrum(csre['star_name'])
+    
+    planet_spec = None
+    if csre['flat'] == False:
+        planet_wave, planet_spec = load_spectrum(csre['planet_name']) # same grid as the star
+    
+    return wave, star_spec, planet_spec
+
 
-def CSRE(name):
+def smooth_csre(params, wave, star_spec, planet_spec = None, dtype = None):
+    """
+    CSRE transit spectrum smoothed to the resolution R in csre_params.
+    
+    ================== Params ==================
+    
+    params       : parameter object (see load_params)
+    wave         : wavelengths (microns)
+    star_spec    : star's transit depths (fraction)
+    planet_spec  : planet's transit depths (only used if not flat)
+    dtype        : dtype of the spectrum (Default is None, precision.dtype)
+    
+    ================== Returns =================
+    
+    smooth_csre_spec  : transit spectrum including the CSRE, smoothed to chosen resolution (ppm)
+    """
+    
+    # loading the CSRE params
+    Rp, Rref, flat, R = [params.csre_params[key] for key in ('Rp', 'Rref', 'flat', 'R')]
+    
+    dtype = get_dtype(dtype)
+    
+    # The star's spectrum is (Rs_lamb / Rref)^2 from the ExoTransmit run, so multiplying
+    # out the Sun's radius and combining for our new (Rp/Rs)^2 is done in place in a
+    # single array (a copy, since star_spec can be a read-only view of the store)
+    
+    ### Default mode (assume flat planet spectrum) ###
+    if flat == True:
+        # (Rp / (sqrt(star_spec) * Rref))^2 = (Rp / Rref)^2 / star_spec
+        csre_spec = star_spec.astype(dtype)
+        np.reciprocal(csre_spec, out = csre_spec)
+        csre_spec *= (Rp / Rref)**2 * 1e6  # ppm 
+    
+    ### include planet absorption ###
+    else:
+        # (sqrt(planet_spec) * Rref / (sqrt(star_spec) * Rref))^2 = planet_spec / star_spec
+        csre_spec  = planet_spec.astype(dtype)
+        csre_spec /= star_spec
+        csre_spec *= 1e6  # ppm 
+    
+    # smoothing to JWST resolution (R ~ 100 for PRISM is default)
+    with stage('adap_smooth'):
+        smooth_csre_spec = adap_smooth(wave, csre_spec, R, dtype = dtype)
+    
+    return smooth_csre_spec
+
+
+def CSRE(name, use_cache = True, dtype = None):
     """
     Calculates the chromatic stellar radii effect (CSRE) for the
     exoplanetary system specified by name. Must have a corresponding
-    parameter file of the form 'name.py' in the same directory!
+    parameter file of the form 'name_params.py' in the same directory,
+    or pass the parameters directly (see load_params)!
     
     ================== Params ==================
     
@@ -63,6 +268,9 @@ def CSRE(name):
     star_name   : name of star (string)
     flat        : whether or not to include planet's absorption features (True assumes a flat transit spectrum)
     R           : resolution to smooth final spectrum to, we recommend 100 to match JWST NIRSpec's PRISM grating
+    use_cache   : whether to use the on-disk PandExo cache (Default is True)
+    dtype       : dtype of the spectra and error bars, e.g. 'float32' to halve the memory
+                  (Default is None, precision.dtype)
     
     ================== Returns =================
     
@@ -72,46 +280,16 @@ def CSRE(name):
     """
     
     # loading parameter file for the exoplanet system
-    params = importlib.import_module(f'{name}_params')
-    
-    # loading the CSRE params
-    Rp, Rs, Rref, planet_name, star_name, flat, R = params.csre_params.values()
-    
-    star_spectrum = np.loadtxt(f'{spectra_path}/transmission_{star_name}.dat', skiprows = 2).T  # ExoTransmit 0.3 - 30 um
-    
-    # slicing wavelength range to JWST NIRSpec (0.6 - 5.3 um)
-    wave_index = slice(np.where(star_spectrum[0] < 0.6e-6)[0][-1], np.where(star_spectrum[0] > 5.3e-6)[0][0])
-    wave       = star_spectrum[0][wave_index] * 1e6  # microns
-    star_spec  = star_spectrum[1][wave_index] / 100  # convert from %
+    with stage('params'):
+        params = load_params(name)
     
-    # Multiplying out the Sun's radius
-    star_spec_noRref = np.sqrt(star_spec) * Rref
-    
-    ### Default mode (assume flat planet spectrum) ###
-    if flat == True:
-        # combining the spectra for our new (Rp/Rs)^2
-        csre_spec  = (Rp / star_spec_noRref)**2 * 1e6  # ppm 
-
-        # smoothing to JWST resolution (R ~ 100 for PRISM)
-        smooth_csre_spec = adap_smooth(wave, csre_spec, R)
+    dtype = get_dtype(dtype)
     
+    wave, star_spec, planet_spec = load_spectra(params)
+    smooth_csre_spec = smooth_csre(params, wave, star_spec, planet_spec, dtype)
     
-    ### include planet absorption ###
-    if flat == False:
-        planet_spectrum = np.loadtxt(f'{spectra_path}/transmission_{planet_name}.dat', skiprows = 2).T # ExoTransmit 0.3 - 30 um
-        planet_spec     = planet_spectrum[1][wave_index] / 100  # convert from %
-        
-        # Multiplying out the Sun's radius
-        planet_spec_noRref = np.sqrt(planet_spec) * Rref
-        
-        # combining the spectra for our new (Rp/Rs)^2
-        csre_spec  = (planet_spec_noRref / star_spec_noRref)**2 * 1e6  # ppm 
-    
-        # smoothing to JWST resolution (R ~ 100 for PRISM is default)
-        smooth_csre_spec = adap_smooth(wave, csre_spec, R)
-        
     ### Error bars ###
-    errs = errorbars(params, wave, smooth_csre_spec)    
+    errs = errorbars(params, wave, smooth_csre_spec, use_cache = use_cache, dtype = dtype)
     
     return wave, smooth_csre_spec, errs
 
@@ -120,35 +298,53 @@ def chisquared(name, errs, numtran = 1):
     """
     Calculates chisq and number of standard deviations of the errorbars.
     
+    Since yerr scales as 1/sqrt(numtran), the flux-weighted mean doesn't depend
+    on numtran and chisq is exactly linear in it: chisq(numtran) = numtran * chisq(1).
+    So numtran can also be an array, and every value is done in one go.
+    
     ================== Params ==================
     
     name    : name of system ; must match what is on {name}_params.py
     errs    : error array output by CSRE function
-    numtran : number of transits to scale the errorbars by (Default is 1)
+    numtran : number of transits to scale the errorbars by, number or array (Default is 1)
     
     ================== Returns =================
     
-    chisq   : chi-squared value of errorbs compared to mu
-    numsig  : number of standard deviations from mu
+    chisq   : chi-squared value of errorbs compared to mu (same shape as numtran)
+    numsig  : number of standard deviations from mu (same shape as numtran)
     mu      : flux-weighted average
     """
     
-    x, y, yerr = errs
-    x, y, yerr = np.array(x), np.array(y), np.array(yerr) / np.sqrt(numtran)
+    with stage('chisquared'):
+        # always in float64, even if the error bars are in a compact dtype
+        x, y, yerr = errs
+        x, y, yerr = np.asarray(x, dtype = float), np.asarray(y, dtype = float), np.asarray(yerr, dtype = float)
 
-    mu = np.sum(y * yerr**-2) / np.sum(yerr**-2)
+        mu = np.sum(y * yerr**-2) / np.sum(yerr**-2)
 
-    chisq = np.sum(((y - mu)/yerr)**2)
+        # chisq for a single transit, scaled up to numtran transits
+        chisq = np.sum(((y - mu)/yerr)**2) * np.asarray(numtran)
 
-    N = len(yerr)
-    numsig = np.sqrt(chisq)
+        numsig = np.sqrt(chisq)
     
     return chisq, numsig, mu
 
 
-
-
-
-
-
-
+def transits_needed(errs, numsig = (1, 3, 5)):
+    """
+    Number of transits needed to reach each detection significance, solved
+    in closed form from chisq(numtran) = numtran * chisq(1) = numsig^2.
+    
+    ================== Params ==================
+    
+    errs    : error array output by CSRE function
+    numsig  : list of significance levels (Default is 1, 3 and 5 sigma)
+    
+    ================== Returns =================
+    
+    numtran : number of transits (not rounded up) for each level in numsig
+    """
+    
+    chisq1 = chisquared(None, errs)[0]
+    
+    return np.asarray(numsig, dtype = float)**2 / chisq1
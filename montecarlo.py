@@ -0,0 +1,87 @@
+import numpy as np
+from scipy import stats, special
+
+
+def detection_threshold(nbins, numsig = 3):
+    """
+    chisq above which a flat spectrum is rejected at numsig (two-sided Gaussian
+    equivalent), for the nbins - 1 degrees of freedom left after fitting mu.
+    """
+
+    p = special.erfc(numsig / np.sqrt(2))
+
+    return stats.chi2.isf(p, nbins - 1)
+
+
+def detection_rates(errs, numtran = (1, 2, 5, 10, 20, 50, 100), ndraws = 10000, numsig = 3,
+                    chunksize = 10000, seed = None):
+    """
+    Monte Carlo detection probability of the CSRE vs. number of transits.
+
+    Draws noisy realizations of the binned CSRE spectrum from the errs tuple,
+    refits the flat (flux-weighted mean) model to each and counts how often it's
+    rejected at numsig. The draws are done as (chunksize x n_bins) arrays, and the
+    same draws are reused for every numtran: with w = yerr^-2, r = y - mu and e the
+    mean-subtracted noise of a single transit, a draw's chisq for n transits is
+
+    chisq(n) = n * sum(w r^2) + 2 sqrt(n) * sum(w r e) + sum(w e^2)
+
+    so only two sums per draw are needed no matter how many numtran values are asked for.
+
+    ================== Params ==================
+
+    errs       : error array output by CSRE function, (x, y, yerr) for a single transit
+    numtran    : numbers of transits to get detection rates for
+    ndraws     : number of noise realizations (Default is 10^4)
+    numsig     : detection significance (Default is 3 sigma)
+    chunksize  : number of draws per chunk, to bound memory (Default is 10^4)
+    seed       : seed for the random number generator (Default is None)
+
+    ================== Returns =================
+
+    results : dict with
+              'numtran'        : the numbers of transits
+              'detection_rate' : fraction of draws where the flat model is rejected, for each numtran
+              'analytic_rate'  : same from the noncentral chi-squared distribution, as a check
+              'chisq_median'   : median chisq of the draws, for each numtran
+              'threshold'      : chisq detection threshold
+
+    """
+
+    x, y, yerr = errs
+    y, yerr = np.asarray(y, dtype = float), np.asarray(yerr, dtype = float)
+    numtran = np.atleast_1d(np.asarray(numtran, dtype = float))
+
+    rng     = np.random.default_rng(seed)
+    weights = yerr**-2
+    mu      = np.sum(y * weights) / np.sum(weights)
+    resid   = y - mu
+
+    # noiseless part of chisq (chisquared for a single transit)
+    A = np.sum(weights * resid**2)
+
+    threshold = detection_threshold(len(y), numsig)
+    detected  = np.zeros(len(numtran))
+    chisqs    = np.empty((ndraws, len(numtran)))
+
+    for start in range(0, ndraws, chunksize):
+        n = min(chunksize, ndraws - start)
+
+        # single-transit noise for each draw, with its own flux-weighted mean taken out
+        noise = rng.standard_normal((n, len(y))) * yerr
+        noise -= (noise @ weights / np.sum(weights))[:, None]
+
+        B = noise @ (weights * resid)
+        C = (noise**2) @ weights
+
+        chisq = numtran * A + 2 * np.sqrt(numtran) * B[:, None] + C[:, None]
+        chisqs[start:start + n] = chisq
+        detected += np.sum(chisq > threshold, axis = 0)
+
+    return {
+        'numtran'        : numtran,
+        'detection_rate' : detected / ndraws,
+        'analytic_rate'  : stats.ncx2.sf(threshold, len(y) - 1, numtran * A),
+        'chisq_median'   : np.median(chisqs, axis = 0),
+        'threshold'      : threshold
+    }
@@ -0,0 +1,174 @@
+import numpy as np
+
+import os
+import pickle as pk
+
+# directory with the saved PandExo runs
+package_dir = os.path.dirname(os.path.abspath(__file__))
+
+# saved NIRSpec Prism PandExo runs used as templates, with the inputs they were run with
+# (the star params aren't saved in the pickles, they're from the params files / pandexo notebooks)
+template_runs = {
+    'hats6_pandexo.p'    : {'star_temp' : 3000, 'star_logg' : 4.683, 'star_metal' : 0.2},
+    'trappist_pandexo.p' : {'star_temp' : 2566, 'star_logg' : 5.276, 'star_metal' : -1.4},
+    'toi700_pandexo.p'   : {'star_temp' : 3459, 'star_logg' : 4.809, 'star_metal' : -0.07},
+}
+
+# PandExo's noise floor for our runs (ppm)
+noise_floor = 14
+
+# templates loaded so far
+_templates = {}
+
+
+def load_templates(files = None):
+    """
+    Builds the template library from the saved PandExo runs: the error bars
+    without the noise floor, normalized to J = 0 mag and a 1 hour transit, so
+    they can be rescaled to any target.
+
+    ================== Params ==================
+
+    files  : dict of pickle file -> star params (Default is template_runs)
+
+    ================== Returns =================
+
+    templates : dict with 'wave' (microns), 'temp' (K, sorted) and 'log_err'
+                (log of the normalized errors, one row per template)
+
+    """
+
+    files = template_runs if files is None else files
+
+    key = tuple(sorted(files))
+    if key in _templates:
+        return _templates[key]
+
+    wave, temps, log_errs = None, [], []
+    for fname, star in files.items():
+        with open(os.path.join(package_dir, fname), 'rb') as f:
+            result = pk.load(f)
+
+        mag       = result['input']['Target Mag']
+        trans_dur = result['timing']['Transit Duration']  # hours
+        err       = result['RawData']['error_no_floor'] * 1e6  # ppm
+
+        if wave is None:
+            wave = result['RawData']['wave']
+        elif not np.array_equal(wave, result['RawData']['wave']):
+            raise ValueError(f'{fname} is not on the same wavelength grid as the other templates')
+
+        # photon noise: err ~ 10^(0.2 mag) / sqrt(transit duration) (baseline scales with the duration too)
+        log_errs.append(np.log(err) - 0.2*np.log(10)*mag + 0.5*np.log(trans_dur))
+        temps.append(star['star_temp'])
+
+    order = np.argsort(temps)
+    templates = {'wave' : wave, 'temp' : np.array(temps, dtype = float)[order], 'log_err' : np.array(log_errs)[order]}
+    _templates[key] = templates
+
+    return templates
+
+
+def surrogate_errors(pandexo_params, noccultations = 1, floor = noise_floor, templates = None):
+    """
+    Fast stand-in for a NIRSpec Prism PandExo run. Interpolates the template
+    library in stellar temperature (in log error, clamped to the range of the
+    templates), then scales it to the target's J magnitude, transit duration and
+    number of transits, and applies the noise floor the same way PandExo's
+    error_w_floor does.
+
+    Only the parameters that matter most for the noise are used (mag, star_temp,
+    trans_dur); logg, metallicity and the radii are ignored, and mag is assumed
+    to be a J magnitude like all the templates. Saturation isn't modelled, so
+    expect it to be worse for very bright stars.
+
+    ================== Params ==================
+
+    pandexo_params  : dict with the same entries as pandexo_params in {name}_params.py
+    noccultations   : number of transits (Default is 1)
+    floor           : noise floor in ppm (Default is 14, same as run_pandexo)
+    templates       : template library (Default is load_templates())
+
+    ================== Returns =================
+
+    wave  : wavelength axis (microns)
+    err   : error bars (ppm)
+
+    """
+
+    if templates is None:
+        templates = load_templates()
+
+    temp = pandexo_params['star_temp']
+    temps, log_err = templates['temp'], templates['log_err']
+
+    # linear interpolation in temperature between the two nearest templates
+    if len(temps) == 1 or temp <= temps[0]:
+        log_template = log_err[0]
+    elif temp >= temps[-1]:
+        log_template = log_err[-1]
+    else:
+        i = np.searchsorted(temps, temp) - 1
+        frac = (temp - temps[i]) / (temps[i + 1] - temps[i])
+        log_template = (1 - frac) * log_err[i] + frac * log_err[i + 1]
+
+    err = np.exp(log_template + 0.2*np.log(10)*pandexo_params['mag']
+                 - 0.5*np.log(pandexo_params['trans_dur']) - 0.5*np.log(noccultations))
+
+    # noise floor (PandExo raises anything below the floor up to it)
+    err = np.maximum(err, floor)
+
+    return templates['wave'], err
+
+
+def validate(files = None):
+    """
+    Leave-one-out check of the surrogate against the saved PandExo runs: each
+    run is predicted from a library built from the other runs only.
+
+    ================== Params ==================
+
+    files  : dict of pickle file -> star params (Default is template_runs)
+
+    ================== Returns =================
+
+    report : dict of file -> {'median_frac_err', 'max_frac_err', 'median_ratio'} of the
+             surrogate's error_w_floor against PandExo's
+
+    """
+
+    files = template_runs if files is None else files
+
+    report = {}
+    for fname, star in files.items():
+        others = {other : files[other] for other in files if other != fname}
+        if not others:
+            continue
+
+        with open(os.path.join(package_dir, fname), 'rb') as f:
+            result = pk.load(f)
+
+        params = dict(star, mag = result['input']['Target Mag'], trans_dur = result['timing']['Transit Duration'])
+        wave, err = surrogate_errors(params, templates = load_templates(others))
+        true_err  = result['FinalSpectrum']['error_w_floor'] * 1e6
+
+        ratio = err / true_err
+        report[fname] = {
+            'median_frac_err' : float(np.median(np.abs(ratio - 1))),
+            'max_frac_err'    : float(np.max(np.abs(ratio - 1))),
+            'median_ratio'    : float(np.median(ratio))
+        }
+
+    return report
+
+
+def validation_report(files = None):
+    """
+    Human-readable version of validate().
+    """
+
+    lines = [f"{'PandExo run':<24} {'median |frac err|':>18} {'max |frac err|':>16} {'median ratio':>14}"]
+    for fname, stats in validate(files).items():
+        lines.append(f"{fname:<24} {stats['median_frac_err']:18.3f} {stats['max_frac_err']:16.3f} {stats['median_ratio']:14.3f}")
+
+    return '\n'.join(lines)
@@ -0,0 +1,131 @@
+import numpy as np
+
+import os
+import json
+import hashlib
+import tempfile
+
+# where cached PandExo results live (one compressed .npz per input set)
+cache_dir = os.environ.get('PANDEXO_CACHE_DIR', 'pandexo_cache')
+
+# total size the cache is allowed to grow to before the least recently used entries are removed
+max_cache_size = 200 * 2**20 # bytes
+
+# hit/miss counters for the current session
+cache_stats = {'hits' : 0, 'misses' : 0}
+
+
+def _jsonable(obj):
+    """
+    Converts numpy types (and anything else json can't handle) for hashing.
+    """
+
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return repr(obj)
+
+
+def cache_key(exo_dict, instrument):
+    """
+    Content-addressed key for a PandExo run: a hash of the full exo_dict
+    plus the instrument name, so any change to the inputs gives a new key.
+
+    ================== Params ==================
+
+    exo_dict    : PandExo input dictionary (from jdi.load_exo_dict, filled in)
+    instrument  : instrument name, e.g. 'NIRSpec Prism'
+
+    ================== Returns =================
+
+    key  : hex string
+
+    """
+
+    blob = json.dumps({'exo_dict' : exo_dict, 'instrument' : instrument}, sort_keys = True, default = _jsonable)
+
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(cache_dir, f'{key}.npz')
+
+
+def load_cached(key):
+    """
+    Returns the cached (wave, err) for key, or None if it isn't in the cache.
+    Updates the hit/miss counters and marks the entry as recently used.
+    """
+
+    path = _cache_path(key)
+
+    try:
+        with np.load(path) as data:
+            wave, err = data['wave'], data['err']
+    except (OSError, KeyError, ValueError):
+        cache_stats['misses'] += 1
+        return None
+
+    # bumping the modification time is what the LRU eviction goes by
+    os.utime(path)
+    cache_stats['hits'] += 1
+
+    return wave, err
+
+
+def save_cached(key, wave, err):
+    """
+    Stores (wave, err) under key and evicts old entries if the cache is too big.
+    Written to a temporary file first so parallel runs never see half-written entries.
+    """
+
+    os.makedirs(cache_dir, exist_ok = True)
+
+    fd, tmp_path = tempfile.mkstemp(dir = cache_dir, suffix = '.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez_compressed(f, wave = wave, err = err)
+    os.replace(tmp_path, _cache_path(key))
+
+    evict()
+
+
+def evict(max_size = None):
+    """
+    Removes least recently used entries until the cache is under max_size bytes
+    (defaults to max_cache_size).
+    """
+
+    if max_size is None:
+        max_size = max_cache_size
+
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = []
+    for fname in os.listdir(cache_dir):
+        if fname.endswith('.npz'):
+            stat = os.stat(os.path.join(cache_dir, fname))
+            entries.append((stat.st_mtime, stat.st_size, fname))
+
+    # oldest first
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, fname in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, fname))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear_cache():
+    """
+    Empties the cache and resets the hit/miss counters.
+    """
+
+    evict(max_size = 0)
+    cache_stats['hits'], cache_stats['misses'] = 0, 0
@@ -0,0 +1,191 @@
+import numpy as np
+from collections import OrderedDict
+
+# my functions
+import main
+from main import load_params, with_params, load_spectrum, chisquared
+from smoothing import adap_smooth
+from run_pandexo import run_pandexo
+from binning import bin_err
+from resampling import resample
+from profiling import stage
+
+
+class CSREPipeline:
+    """
+    Memoized, dependency-aware version of main.CSRE for one system. Every
+    intermediate is cached under the inputs it actually depends on, so after
+    a parameter change only the stages it invalidates are recomputed:
+
+    spectra           : star_name (+ planet_name if not flat)
+    star_spec_noRref  : star_name, Rref
+    smoothed spectrum : star_name, Rref, R (+ planet_name if not flat); for a flat
+                        planet Rp only rescales the result, so it never re-smooths
+    PandExo errors    : pandexo_params, backend
+    binned errors     : pandexo_params, backend, err_R
+
+    e.g.
+
+        pipe = CSREPipeline('hats6b')
+        wave, smooth_csre_spec, errs = pipe.run()
+        pipe.update(R = 50)       # only re-smooths
+        pipe.update(Rp = 7.5e7)   # only rescales (flat = True)
+
+    ================== Params ==================
+
+    name         : name of system (or param dict/object, see main.load_params)
+    use_cache    : whether to use the on-disk PandExo cache (Default is True)
+    backend      : noise backend for run_pandexo (Default is None, run_pandexo's default)
+    err_R        : resolution of the error bars (Default is 25, same as main.errorbars)
+    max_entries  : how many results to keep per stage (Default is 8)
+
+    """
+
+    def __init__(self, name, use_cache = True, backend = None, err_R = 25, max_entries = 8):
+
+        # own copy of the params, so updates don't touch the {name}_params module
+        self.params      = with_params(load_params(name))
+        self.use_cache   = use_cache
+        self.backend     = backend
+        self.err_R       = err_R
+        self.max_entries = max_entries
+
+        self._cache   = {}
+        self.computed = {} # number of times each stage was actually computed
+
+    def update(self, **changes):
+        """
+        Changes csre_params and/or pandexo_params values, e.g. update(R = 50, star_temp = 3100).
+        Nothing is recomputed until the next run().
+        """
+
+        for key, value in changes.items():
+            if key in self.params.csre_params:
+                self.params.csre_params[key] = value
+            elif key in self.params.pandexo_params:
+                self.params.pandexo_params[key] = value
+            else:
+                raise KeyError(f"'{key}' is not in csre_params or pandexo_params")
+
+        return self
+
+    def _memo(self, stage_name, key, func):
+        """
+        Returns the cached result of stage_name for key, computing it with func() if needed.
+        """
+
+        entries = self._cache.setdefault(stage_name, OrderedDict())
+        if key in entries:
+            entries.move_to_end(key)
+            return entries[key]
+
+        with stage(stage_name):
+            value = func()
+        self.computed[stage_name] = self.computed.get(stage_name, 0) + 1
+
+        entries[key] = value
+        if len(entries) > self.max_entries:
+            entries.popitem(last = False)
+
+        return value
+
+    def spectra(self):
+        """
+        Star (and planet, if not flat) spectra sliced to NIRSpec.
+        """
+
+        csre = self.params.csre_params
+        star = self._memo('load_star', csre['star_name'], lambda: load_spectrum(csre['star_name']))
+        if csre['flat']:
+            return star[0], star[1], None
+
+        planet = self._memo('load_planet', csre['planet_name'], lambda: load_spectrum(csre['planet_name']))
+
+        return star[0], star[1], planet[1]
+
+    def star_spec_noRref(self):
+        """
+        Stellar spectrum with the Sun's radius multiplied out.
+        """
+
+        csre = self.params.csre_params
+        wave, star_spec, planet_spec = self.spectra()
+
+        return self._memo('star_spec_noRref', (csre['star_name'], csre['Rref']),
+                          lambda: np.sqrt(star_spec) * csre['Rref'])
+
+    def smooth_csre_spec(self):
+        """
+        CSRE transit spectrum smoothed to resolution R (ppm).
+        """
+
+        csre = self.params.csre_params
+        wave, star_spec, planet_spec = self.spectra()
+        star_spec_noRref = self.star_spec_noRref()
+
+        ### Default mode (assume flat planet spectrum) ###
+        if csre['flat']:
+            # smoothing is linear, so smooth (1/star)^2 once and scale by Rp^2
+            key  = (csre['star_name'], csre['Rref'], csre['R'])
+            base = self._memo('adap_smooth', ('flat',) + key,
+                              lambda: adap_smooth(wave, (1 / star_spec_noRref)**2 * 1e6, csre['R']))
+            return csre['Rp']**2 * base
+
+        ### include planet absorption ###
+        def smooth():
+            planet_spec_noRref = np.sqrt(planet_spec) * csre['Rref']
+            csre_spec = (planet_spec_noRref / star_spec_noRref)**2 * 1e6  # ppm
+            return adap_smooth(wave, csre_spec, csre['R'])
+
+        key = (csre['star_name'], csre['planet_name'], csre['Rref'], csre['R'])
+
+        return self._memo('adap_smooth', ('planet',) + key, smooth)
+
+    def _pandexo_key(self):
+        return (tuple(sorted(self.params.pandexo_params.items())), self.backend)
+
+    def pandexo_errors(self):
+        """
+        PandExo (or surrogate) error bars on the native grid.
+        """
+
+        return self._memo('run_pandexo', self._pandexo_key(),
+                          lambda: run_pandexo(self.params, use_cache = self.use_cache, backend = self.backend))
+
+    def binned_errors(self):
+        """
+        Error bars binned to err_R: (bin centers, errors, bin widths).
+        """
+
+        err_wave, err = self.pandexo_errors()
+
+        return self._memo('bin_err', (self._pandexo_key(), self.err_R), lambda: bin_err(err_wave, err, self.err_R))
+
+    def run(self):
+        """
+        Same outputs as main.CSRE, recomputing only what changed since the last run.
+
+        ================== Returns =================
+
+        wave              : array of wavelengths (microns)
+        smooth_csre_spec  : transit spectrum including the CSRE, smoothed to chosen resolution
+        errs              : (x,y,yerr) of error bars on transit spectrum (ppm)
+
+        """
+
+        wave = self.spectra()[0]
+        smooth_csre_spec = self.smooth_csre_spec()
+        x, yerr, dellambs = self.binned_errors()
+
+        # need to resample to find y value for error bars on the transit spectrum
+        with stage('resample'):
+            y = resample(wave, smooth_csre_spec, x, dellambs, main.resample_method)
+
+        return wave, smooth_csre_spec, (x, y, yerr)
+
+    def chisquared(self, numtran = 1):
+        """
+        main.chisquared on the current error bars.
+        """
+
+        return chisquared(None, self.run()[2], numtran)
@@ -1,21 +1,40 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import scipy as sp
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import math
-from scipy.interpolate import interp1d
 
-import importlib
-import molmass
+from main import chisquared, load_params
+from scale_heights import depth_changes
 
-from main import chisquared
 
-def plotting(name, wave, smooth_csre_spec, errs = None, numtran = 1, chisq = None, numsig = None, mu = None):
+def new_figure(figsize, headless = False, **kwargs):
+    """
+    Makes a figure and its axes (kwargs go to subplots). Headless figures are
+    drawn straight onto an Agg canvas without going through pyplot, so they
+    need no display, don't touch pyplot's global state and are never shown.
+    """
+    
+    if not headless:
+        return plt.subplots(figsize = figsize, **kwargs)
+    
+    fig = Figure(figsize = figsize)
+    FigureCanvasAgg(fig)
+    
+    return fig, fig.subplots(**kwargs)
+
+
+def plotting(name, wave, smooth_csre_spec, errs = None, numtran = 1, chisq = None, numsig = None, mu = None,
+             params = None, headless = False):
     """
     Makes some nice plots.
+    
+    params (Default is loading {name}_params.py) and headless (see new_figure,
+    Default is False) are for rendering without a display, e.g. from render.py.
     """
     
     # loading parameter file for the exoplanet system
-    params = importlib.import_module(f'{name}_params')
+    params = load_params(name if params is None else params)
     
     # loading the Rp and Rs from CSRE params
     Rp, Rs = params.csre_params['Rp'], params.csre_params['Rs']
@@ -24,7 +43,7 @@ def plotting(name, wave, smooth_csre_spec, errs = None, numtran = 1, chisq = Non
     # includes no absorption effects from planet OR star!
     fixed_depth = (Rp / Rs)**2 * 1e6 # ppm
     
-    fig, ax = plt.subplots(figsize = (9,4))
+    fig, ax = new_figure((9,4), headless)
     
     ### Transit spectrum ###
     ax.plot(wave, smooth_csre_spec, c = 'black', label = 'CSRE', alpha = 1)
@@ -35,7 +54,7 @@ def plotting(name, wave, smooth_csre_spec, errs = None, numtran = 1, chisq = Non
         x,y,yerr = errs
         # plots multiple errorbars corresponding for different number of transits
         if isinstance(numtran, list):
-            numtran.sort() # makes sure it plots smaller errorbars on top of larger ones
+            numtran = sorted(numtran) # makes sure it plots smaller errorbars on top of larger ones
             alphas = np.logspace(np.log10(0.33),np.log10(1),len(numtran))
             for i in range(len(numtran)):
                 ax.errorbar(x, y, yerr/np.sqrt(numtran[i]), None, 'o', ms = 2, c = 'slateblue', label = f'{int(numtran[i])} transits', capsize = 2.5, alpha = alphas[i]) 
@@ -62,32 +81,42 @@ def plotting(name, wave, smooth_csre_spec, errs = None, numtran = 1, chisq = Non
     # setting better plot limits
     ax.set_xlim(np.min(wave), np.max(wave))
     ax.set_ylim(np.min(smooth_csre_spec) - 1, fixed_depth + 1)
-    fig.show()
+    if not headless:
+        fig.show()
 
     return fig, ax
 
 
-def sigma_lines(fig, ax, x, y, numsig):
+def sigma_lines(fig, ax, x, y, numsig, verbose = True):
     """
     Handles the plotting of the lines for 
     1sigma, 2sigma, 3sigma, etc. on the chisq plot.
     
+    chisq is exactly linear in the number of transits (see main.chisquared),
+    so the number of transits for each line is solved in closed form from
+    the slope of the (x, y) = (numtran, chisq) curve rather than interpolated.
+    Prints the number of transits for each line unless verbose is False.
+    
     """
     
+    # chisq per transit (least squares slope through the origin, exact for a linear curve)
+    x, y = np.asarray(x, dtype = float), np.asarray(y, dtype = float)
+    chisq1 = np.sum(x * y) / np.sum(x * x)
+    
     for i in range(len(numsig)):
         # chisq = (ns)^2
         hline_value = numsig[i]**2
         
         # min and max for lines
-        xfunc = interp1d(y,x)
-        hline_max = xfunc(hline_value)
+        hline_max = hline_value / chisq1
 
         ax.hlines(hline_value, 0, hline_max, ls = 'dotted', color = 'black')
         ax.vlines(hline_max, 0, hline_value, ls = 'dotted', color = 'black')
 
         ax.text(hline_max, hline_value, f'${numsig[i]} \sigma$', horizontalalignment = 'right', verticalalignment='bottom')
         
-        print(f"{numsig[i]}-sigma level: {math.ceil(hline_max)} transits")
+        if verbose:
+            print(f"{numsig[i]}-sigma level: {math.ceil(hline_max)} transits")
         
         # using for plot limits
         if i == 0:
@@ -104,9 +133,51 @@ def sigma_lines(fig, ax, x, y, numsig):
     return fig, ax
 
 
-def plot_depth_changes(name, wave, spec, errs, molecules, N = 1):
+def plot_chisq(name, numtran, chisq, numsig, numsig_lines = (1, 2, 3, 4), title = None, headless = False):
+    """
+    Plots chisq and number of sigma vs. number of transits side by side,
+    with the sigma_lines on the chisq panel.
+    
+    ================== Params ==================
+    
+    name          : name of system, used as the title unless title is given
+    numtran       : array of numbers of transits
+    chisq         : chisq for each numtran (see main.chisquared)
+    numsig        : number of sigma for each numtran (see main.chisquared)
+    numsig_lines  : significance levels to mark on the chisq panel (Default is 1-4 sigma)
+    title         : figure title (Default is name)
+    headless      : see new_figure (Default is False)
+    
+    ================== Returns =================
+    
+    fig  : figure object
+    axs  : axes objects
+    """
+    
+    fig, axs = new_figure((10,4), headless, ncols = 2)
+    
+    axs[0].plot(numtran, chisq)
+    axs[0].set_xlabel('Number of transits')
+    axs[0].set_ylabel(r'$\chi^2$')
+    
+    axs[1].plot(numtran, numsig)
+    axs[1].set_xlabel('Number of transits')
+    axs[1].set_ylabel(r'Number of $\sigma$')
+    axs[1].set_xlim(1, np.max(numtran))
+    axs[1].set_ylim(0, np.nanmax(numsig))
+    
+    fig.suptitle(name if title is None else title)
+    
+    sigma_lines(fig, axs[0], numtran, chisq, list(numsig_lines), verbose = not headless)
+    
+    return fig, axs
+
+
+def plot_depth_changes(name, wave, spec, errs, molecules, N = 1, mu = None, params = None, headless = False,
+                       deltadeltas = None):
     """
-    Calculates and plots the change in transit depth according to the analytic equation:
+    Plots the change in transit depth according to the analytic equation
+    (calculated by scale_heights.depth_changes):
     
     deltadelta = 2*(NH/Rs)*delta           where delta = (Rp/Rs)^2
     
@@ -116,12 +187,16 @@ def plot_depth_changes(name, wave, spec, errs, molecules, N = 1):
     
     ================== Params ==================
     
-    name       : name of system ; must match what is on {name}_params.py
-    wave       : array or list of wavelengths (microns)
-    spec       : transit spectrum including the CSRE
-    errs       : error array output by CSRE function
-    molecules  : list of molecules included in your ExoTransmit fit
-    N          : number of scale heights to use, should be of order unity (Default = 1)
+    name         : name of system ; must match what is on {name}_params.py
+    wave         : array or list of wavelengths (microns)
+    spec         : transit spectrum including the CSRE
+    errs         : error array output by CSRE function
+    molecules    : list of molecules included in your ExoTransmit fit
+    N            : number of scale heights to use, should be of order unity (Default = 1)
+    mu           : flux-weighted mean, if already known (Default is None, from chisquared)
+    params       : parameters (Default is None, loading {name}_params.py)
+    headless     : see new_figure (Default is False)
+    deltadeltas  : deltadelta of each molecule, if already known (Default is None, calculated here)
     
     ================== Returns =================
     
@@ -129,45 +204,26 @@ def plot_depth_changes(name, wave, spec, errs, molecules, N = 1):
     ax   : axes object
     """
     
-    params = importlib.import_module(f'{name}_params') # for loading param values
+    params = load_params(name if params is None else params) # for loading param values
     
-    # initializing dict of molecular masses
-    masses_dict = {}
-    for molecule in molecules:
-        masses_dict[molecule] = molmass.Formula(molecule).mass
+    if deltadeltas is None:
+        deltadeltas = depth_changes(params.csre_params['Rp'], params.csre_params['Rs'],
+                                    params.pandexo_params['star_temp'], params.pandexo_params['star_logg'],
+                                    molecules, N)[0, :, 0]
     
-    # sorting by increasing mass (so smallest deltadeltas get plotted first)
-    keys = list(masses_dict.keys())
-    values = list(masses_dict.values())
-    sorted_value_index = np.argsort(values)
-    masses_dict = {keys[i]: values[i] for i in sorted_value_index}
-    amu = sp.constants.physical_constants['atomic mass constant'][0] # [kg]
-
-    # constants and param values
-    g      = 10**params.pandexo_params['star_logg'] / 100 # [m/s^2]
-    T      = params.pandexo_params['star_temp'] # [K]
-    k      = sp.constants.k # [J / K]
-    Rp, Rs = params.csre_params['Rp'], params.csre_params['Rs'] # [m]
-    depth  = (Rp / Rs) ** 2 * 1e6 # [ppm]
-
-    # calculating the change in transit depth due to each molecule
-    deltadeltas = []
-    for molecule in masses_dict:
-        u = masses_dict[molecule] * amu
-        H = k * T / (u * g)
-
-        deltadelta = 2 * depth * (N*H) / Rs
-        deltadeltas.append(deltadelta)
+    # sorting by decreasing deltadelta, i.e. increasing mass (so the smaller ones get plotted on top)
+    deltadeltas = np.sort(np.asarray(deltadeltas, dtype = float))[::-1]
 
-    # using a fancy color map for the deldels
-    plt.rcParams['axes.prop_cycle'] = plt.cycler('color', plt.cm.Wistia(np.linspace(1,0,int(len(molecules)))))
+    # using a fancy color map for the deldels (passed to each fill rather than set in rcParams)
+    colors = plt.cm.Wistia(np.linspace(1,0,int(len(molecules))))
 
-    mu = chisquared(name, errs)[-1]
-    fig, ax = plotting(name, wave, spec, mu = mu)
+    if mu is None:
+        mu = chisquared(name, errs)[-1]
+    fig, ax = plotting(name, wave, spec, mu = mu, params = params, headless = headless)
 
     # plotting all the deltadeltas from each molecule
     for i in range(len(deltadeltas)):
-        ax.fill_between(wave, mu - deltadeltas[i], mu + deltadeltas[i])
+        ax.fill_between(wave, mu - deltadeltas[i], mu + deltadeltas[i], color = colors[i])
     
     
     return fig, ax
\ No newline at end of file
@@ -0,0 +1,142 @@
+import numpy as np
+
+import os
+from contextlib import contextmanager
+
+# dtype spectra, smoothed spectra and error bars are stored and computed in by
+# smoothing, binning, resampling and main ('float64', or 'float32' for half the memory)
+dtype = np.dtype(os.environ.get('CSRE_DTYPE', 'float64'))
+
+# dtype the prefix sums in smoothing and binning accumulate in, whatever dtype is.
+# float32 running sums over a whole grid lose too much precision (~1 ppm in the
+# smoothed spectrum and up to ~20% in the binned errors on a 10^6 pixel grid)
+accum_dtype = np.dtype(np.float64)
+
+
+def get_dtype(override = None):
+    """
+    The dtype to use: override if given, otherwise the module-wide dtype.
+    """
+
+    return np.dtype(dtype if override is None else override)
+
+
+def set_dtype(new):
+    """
+    Sets the module-wide dtype, e.g. set_dtype('float32').
+    """
+
+    global dtype
+
+    new = np.dtype(new)
+    if new.kind != 'f':
+        raise ValueError(f"dtype has to be a floating point type, not '{new}'")
+
+    dtype = new
+
+
+@contextmanager
+def using_dtype(new):
+    """
+    Sets the module-wide dtype for the duration of the block.
+    """
+
+    old = dtype
+    set_dtype(new)
+    try:
+        yield
+    finally:
+        set_dtype(old)
+
+
+def compare_dtypes(run, compact = 'float32'):
+    """
+    Runs run() in float64 and in a compact dtype and compares the outputs.
+
+    ================== Params ==================
+
+    run      : function returning a dict of name -> array (or number)
+    compact  : dtype to compare against float64 (Default is 'float32')
+
+    ================== Returns =================
+
+    diffs : dict of name -> {'max_abs', 'max_rel', 'nbytes_ratio'} of the compact
+            result against the float64 one (nans are ignored)
+
+    """
+
+    with using_dtype('float64'):
+        reference = run()
+    with using_dtype(compact):
+        result = run()
+
+    diffs = {}
+    for name, ref in reference.items():
+        ref, new = np.asarray(ref), np.asarray(result[name])
+        # empty bins are inf in both, which gives nan here (and is ignored)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            diff = np.abs(new.astype(np.float64) - ref)
+            rel  = diff / np.abs(ref)
+
+        diffs[name] = {'max_abs'      : float(np.nanmax(diff)) if np.any(np.isfinite(diff)) else np.nan,
+                       'max_rel'      : float(np.nanmax(rel[np.isfinite(rel)])) if np.any(np.isfinite(rel)) else np.nan,
+                       'nbytes_ratio' : new.nbytes / ref.nbytes if ref.nbytes else np.nan}
+
+    return diffs
+
+
+def accuracy_report(sizes = (2900, 100000, 1000000), Rs = (100, 1000, 2700), names = None, compact = 'float32'):
+    """
+    Accuracy of the compact dtype against float64, on synthetic ExoTransmit-like
+    grids (smoothing, binning and the depths at the error bars, see benchmarks.py)
+    and optionally end to end through main.CSRE + chisquared for real systems.
+
+    ================== Params ==================
+
+    sizes    : synthetic grid sizes in pixels (Default is 2900, 10^5 and 10^6)
+    Rs       : resolutions (Default is 100, 1000 and 2700)
+    names    : systems to run main.CSRE for (Default is None, synthetic grids only)
+    compact  : dtype to compare against float64 (Default is 'float32')
+
+    ================== Returns =================
+
+    report : human-readable table of max absolute (ppm) and relative differences
+
+    """
+
+    import main
+    from benchmarks import synthetic_grid, synthetic_errs
+    from smoothing import adap_smooth
+    from binning import bin_err
+    from resampling import resample
+
+    rows = []
+    for npix in sizes:
+        wave, spec    = synthetic_grid(npix)
+        err_wave, err = synthetic_errs(npix)
+
+        for R in Rs:
+            def run():
+                smooth = adap_smooth(wave, spec, R)
+                x, yerr, widths = bin_err(err_wave, err, R)
+                return {'adap_smooth' : smooth, 'bin_err' : yerr, 'resample' : resample(wave, smooth, x)}
+
+            for stage_name, diff in compare_dtypes(run, compact).items():
+                rows.append((f'n={npix},R={R}', stage_name, diff))
+
+    for name in (names or []):
+        def run():
+            wave, smooth_csre_spec, errs = main.CSRE(name)
+            chisq, numsig, mu = main.chisquared(name, errs)
+            return {'smooth_csre_spec' : smooth_csre_spec, 'y' : errs[1], 'yerr' : errs[2],
+                    'chisq' : chisq, 'mu' : mu}
+
+        for stage_name, diff in compare_dtypes(run, compact).items():
+            rows.append((name, stage_name, diff))
+
+    header = f"{'case':<20} {'output':<18} {'max |diff|':>12} {'max |rel diff|':>15} {'memory':>8}"
+    lines  = [f'{compact} vs. float64', header, '-' * len(header)]
+    for case, stage_name, diff in rows:
+        lines.append(f"{case:<20} {stage_name:<18} {diff['max_abs']:12.3e} {diff['max_rel']:15.3e} {diff['nbytes_ratio']:8.2f}")
+
+    return '\n'.join(lines)
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# file every record is appended to as a JSON line (None to only keep them in memory).
+# enable(path) exports it as CSRE_PROFILE, so worker processes started with spawn
+# (which re-import this module instead of inheriting it) record to the same file
+report_path = os.environ.get('CSRE_PROFILE') or None
+
+# whether stages are being recorded at all (off by default, so it costs nothing)
+enabled = report_path is not None
+
+# records of the current session
+records = []
+
+# currently running stages and the current target, per thread (so stages run
+# in thread pools, e.g. by async_pipeline, don't end up nested in each other)
+_local = threading.local()
+
+
+def _state():
+    """
+    This thread's stack of running stages and current target.
+    """
+
+    if not hasattr(_local, 'stack'):
+        _local.stack, _local.target = [], None
+
+    return _local
+
+
+def enable(path = None, memory = True):
+    """
+    Turns on stage timing.
+
+    ================== Params ==================
+
+    path    : JSON lines file to append each record to as it happens (Default is None,
+              only keep them in memory). Use this for process pool runs, since records
+              made in worker processes don't make it back to the parent otherwise; it's
+              also set as CSRE_PROFILE for worker processes started after this.
+    memory  : whether to also track peak allocated memory with tracemalloc (slower,
+              and only in this process)
+
+    """
+
+    global enabled, report_path
+
+    enabled, report_path = True, path
+
+    if path is not None:
+        os.environ['CSRE_PROFILE'] = path
+    else:
+        os.environ.pop('CSRE_PROFILE', None)
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """
+    Turns off stage timing (and tracemalloc, if it's running), here and in
+    worker processes started after this.
+    """
+
+    global enabled
+
+    enabled = False
+    os.environ.pop('CSRE_PROFILE', None)
+
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    """
+    Clears the in-memory records.
+    """
+
+    records.clear()
+
+
+@contextmanager
+def target(name):
+    """
+    Labels every stage recorded inside the block with a target name.
+    """
+
+    state = _state()
+    previous, state.target = state.target, name
+    try:
+        yield
+    finally:
+        state.target = previous
+
+
+@contextmanager
+def stage(name):
+    """
+    Records wall time, CPU time and peak allocated memory (if tracemalloc is on)
+    of the block as one pipeline stage. Does nothing unless enable() was called.
+    Stages can be nested; a stage's peak memory includes its sub-stages.
+    """
+
+    if not enabled:
+        yield
+        return
+
+    stack   = _state().stack
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        # remember the peak so far of the enclosing stage before resetting it
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+    else:
+        current = 0
+
+    frame = {'start_mem' : current, 'peak' : current}
+    stack.append(frame)
+
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+        stack.pop()
+
+        peak_mem = None
+        if tracing and tracemalloc.is_tracing():
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            peak_mem = peak - frame['start_mem']
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+
+        record(name, wall, cpu, peak_mem)
+
+
+def record(name, wall, cpu, peak_mem = None):
+    """
+    Adds a stage record (in memory, and to report_path if set).
+    """
+
+    state = _state()
+    row   = {'target' : state.target, 'stage' : name, 'wall' : wall, 'cpu' : cpu,
+             'peak_mem' : peak_mem, 'depth' : len(state.stack), 'pid' : os.getpid(), 'time' : time.time()}
+    records.append(row)
+
+    if report_path is not None:
+        with open(report_path, 'a') as f:
+            f.write(json.dumps(row) + '\n')
+
+
+def write_jsonl(path, rows = None):
+    """
+    Writes records (Default is this session's) to a JSON lines file.
+    """
+
+    with open(path, 'w') as f:
+        for row in (records if rows is None else rows):
+            f.write(json.dumps(row) + '\n')
+
+
+def read_jsonl(path):
+    """
+    Reads records back from a JSON lines file.
+    """
+
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summary(rows = None, by_target = False):
+    """
+    Human-readable table of the records: number of calls, total and mean wall
+    time, total CPU time and max peak memory per stage (and per target if by_target).
+
+    ================== Params ==================
+
+    rows       : list of records, or path to a JSON lines report (Default is this session's records)
+    by_target  : whether to break the table down by target as well (Default is False)
+
+    ================== Returns =================
+
+    table : string
+
+    """
+
+    if rows is None:
+        rows = records
+    elif isinstance(rows, str):
+        rows = read_jsonl(rows)
+
+    # grouping, keeping stages in the order they first ran
+    groups = {}
+    for row in rows:
+        key = (row['target'], row['stage']) if by_target else (None, row['stage'])
+        groups.setdefault(key, []).append(row)
+
+    header = f"{'target':<16} {'stage':<16} {'calls':>6} {'wall [s]':>10} {'mean [s]':>10} {'cpu [s]':>10} {'peak [MB]':>10}"
+    lines  = [header, '-' * len(header)]
+    for (name, stage_name), group in groups.items():
+        wall  = sum(row['wall'] for row in group)
+        cpu   = sum(row['cpu'] for row in group)
+        peaks = [row['peak_mem'] for row in group if row['peak_mem'] is not None]
+        peak  = f'{max(peaks) / 2**20:10.2f}' if peaks else f"{'-':>10}"
+        lines.append(f"{str(name if by_target else 'all'):<16.16} {stage_name:<16.16} {len(group):>6} "
+                     f"{wall:10.4f} {wall / len(group):10.4f} {cpu:10.4f} {peak}")
+
+    return '\n'.join(lines)
@@ -0,0 +1,247 @@
+import numpy as np
+
+import os
+import json
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# my functions
+from main import load_params, chisquared
+from pandexo_cache import _jsonable
+from scale_heights import depth_changes
+
+# figures that can be rendered for each target
+figure_kinds = ['csre', 'deldel', 'chisq']
+
+# numbers of transits for the chisq figures and the error bars on the csre figures
+default_numtran = np.arange(1, 101)
+default_errorbar_numtran = [1, 10, 100]
+
+# file in the output directory with the input hash of every rendered figure
+index_file = 'figures.json'
+
+# source of the plotting code, part of every figure's hash so changing it re-renders everything
+plotting_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plotting.py')
+
+
+def _hash_update(h, obj):
+    """
+    Adds arrays (by dtype, shape and raw bytes) and anything json can handle to a hash.
+    """
+
+    if isinstance(obj, np.ndarray):
+        h.update(f'{obj.dtype.str}{obj.shape}'.encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'[')
+        for item in obj:
+            _hash_update(h, item)
+        h.update(b']')
+    else:
+        h.update(json.dumps(obj, sort_keys = True, default = _jsonable).encode())
+
+
+def figure_hash(job):
+    """
+    Hash of everything a figure is drawn from (its data, params and options,
+    plus the plotting code), used to skip figures that haven't changed.
+    """
+
+    h = hashlib.sha256()
+    with open(plotting_file, 'rb') as f:
+        h.update(f.read())
+
+    for key in sorted(job):
+        if key not in ('paths', 'hash'):
+            h.update(key.encode())
+            _hash_update(h, job[key])
+
+    return h.hexdigest()
+
+
+def _as_result(result):
+    """
+    (wave, smooth_csre_spec, errs) from main.CSRE output or a dict with those keys.
+    """
+
+    if isinstance(result, dict):
+        return result['wave'], result['spec'], result['errs']
+
+    return result
+
+
+def render_figure(job):
+    """
+    Draws one figure headlessly (see plotting.new_figure) and saves it in every
+    requested format. Runs in the worker processes of render_figures.
+    """
+
+    # only the workers need matplotlib
+    from plotting import plotting, plot_chisq, plot_depth_changes
+
+    kind, name, params = job['kind'], job['name'], job['params']
+    wave, spec, errs = job['wave'], job['spec'], job['errs']
+
+    if kind == 'csre':
+        fig, ax = plotting(name, wave, spec, errs, list(job['numtran']), params = params, headless = True)
+    elif kind == 'deldel':
+        fig, ax = plot_depth_changes(name, wave, spec, errs, job['molecules'], N = job['N'], mu = job['mu'],
+                                     params = params, headless = True, deltadeltas = job['deltadeltas'])
+    elif kind == 'chisq':
+        fig, axs = plot_chisq(name, job['numtran'], job['chisq'], job['numsig'], headless = True)
+    else:
+        raise ValueError(f"unknown figure kind '{kind}', expected one of {figure_kinds}")
+
+    for path in job['paths']:
+        fig.savefig(path, dpi = job['dpi'], bbox_inches = 'tight')
+
+    return job['paths']
+
+
+def figure_jobs(results, kinds = None, out_dir = 'figures', formats = ('png',), molecules = None,
+                numtran = None, errorbar_numtran = None, N = 1, dpi = 150, params = None):
+    """
+    Everything needed to draw each figure, one job per (target, kind). The
+    cheap derived values (chisq, numsig, mu and the deltadeltas) are worked
+    out here, so the workers only draw.
+
+    See render_figures for the params.
+
+    ================== Returns =================
+
+    jobs : list of job dicts (with 'paths' to write and the input 'hash')
+
+    """
+
+    kinds            = figure_kinds if kinds is None else kinds
+    numtran          = default_numtran if numtran is None else np.asarray(numtran)
+    errorbar_numtran = default_errorbar_numtran if errorbar_numtran is None else list(errorbar_numtran)
+    molecules        = molecules or {}
+    params           = params or {}
+
+    jobs = []
+    for name, result in results.items():
+        wave, spec, errs = _as_result(result)
+        wave, spec = np.asarray(wave), np.asarray(spec)
+        errs = tuple(np.asarray(e) for e in errs)
+
+        target_params = load_params(params.get(name, name))
+        target_params = {'csre_params'    : dict(target_params.csre_params),
+                         'pandexo_params' : dict(target_params.pandexo_params)}
+
+        chisq, numsig, mu = chisquared(name, errs, numtran)
+
+        for kind in kinds:
+            job = {'kind' : kind, 'name' : name, 'params' : target_params, 'dpi' : dpi}
+
+            if kind == 'csre':
+                job.update(wave = wave, spec = spec, errs = errs, numtran = errorbar_numtran)
+            elif kind == 'deldel':
+                if name not in molecules:
+                    continue
+                csre, pandexo = target_params['csre_params'], target_params['pandexo_params']
+                deltadeltas   = depth_changes(csre['Rp'], csre['Rs'], pandexo['star_temp'], pandexo['star_logg'],
+                                              molecules[name], N)[0, :, 0]
+                job.update(wave = wave, spec = spec, errs = errs, molecules = list(molecules[name]), N = N, mu = mu,
+                           deltadeltas = deltadeltas)
+            elif kind == 'chisq':
+                job.update(wave = None, spec = None, errs = None, numtran = numtran, chisq = chisq, numsig = numsig)
+            else:
+                raise ValueError(f"unknown figure kind '{kind}', expected one of {figure_kinds}")
+
+            job['paths'] = [os.path.join(out_dir, f'{name}_{kind}.{fmt}') for fmt in formats]
+            job['hash']  = figure_hash(job)
+            jobs.append(job)
+
+    return jobs
+
+
+def load_index(out_dir):
+    """
+    Figure path -> input hash for the figures already rendered in out_dir.
+    """
+
+    try:
+        with open(os.path.join(out_dir, index_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_index(out_dir, index):
+    """
+    Writes the figure index atomically (temp file + rename).
+    """
+
+    fd, tmp = tempfile.mkstemp(dir = out_dir, suffix = '.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f, indent = 1, sort_keys = True)
+    os.replace(tmp, os.path.join(out_dir, index_file))
+
+
+def render_figures(results, kinds = None, out_dir = 'figures', formats = ('png',), molecules = None,
+                   numtran = None, errorbar_numtran = None, N = 1, dpi = 150, params = None,
+                   max_workers = None, force = False):
+    """
+    Renders the CSRE, CSRE + deltadelta and chisq figures for many targets from
+    already computed results, headlessly over a process pool, straight to files
+    ({out_dir}/{name}_{kind}.{format}). A figure is skipped if all its files exist
+    and the hash of its inputs matches the one saved when it was last rendered.
+
+    ================== Params ==================
+
+    results           : dict of name -> (wave, smooth_csre_spec, errs) as returned by main.CSRE
+                        (or a dict with 'wave', 'spec' and 'errs')
+    kinds             : figures to make, any of 'csre', 'deldel', 'chisq' (Default is all)
+    out_dir           : directory to save the figures in (Default is 'figures')
+    formats           : file formats, e.g. ('png', 'pdf') (Default is png only)
+    molecules         : dict of name -> molecules for the deldel figure (targets without one get no deldel figure)
+    numtran           : numbers of transits for the chisq figure (Default is 1 - 100)
+    errorbar_numtran  : numbers of transits to show error bars for on the csre figure (Default is 1, 10, 100)
+    N                 : number of scale heights for the deldel figure (Default is 1)
+    dpi               : resolution of raster formats (Default is 150)
+    params            : dict of name -> param dict/object for targets without a {name}_params.py
+    max_workers       : number of worker processes (Default is None, one per CPU)
+    force             : whether to re-render unchanged figures too (Default is False)
+
+    ================== Returns =================
+
+    rows : list of dicts with name, kind, paths, status ('rendered', 'skipped' or 'failed') and error
+
+    """
+
+    os.makedirs(out_dir, exist_ok = True)
+
+    jobs  = figure_jobs(results, kinds, out_dir, formats, molecules, numtran, errorbar_numtran, N, dpi, params)
+    index = load_index(out_dir)
+
+    rows, todo = [], []
+    for job in jobs:
+        unchanged = all(index.get(path) == job['hash'] and os.path.exists(path) for path in job['paths'])
+        if unchanged and not force:
+            rows.append({'name' : job['name'], 'kind' : job['kind'], 'paths' : job['paths'],
+                         'status' : 'skipped', 'error' : ''})
+        else:
+            todo.append(job)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            futures = {executor.submit(render_figure, job) : job for job in todo}
+
+            for future in as_completed(futures):
+                job = futures[future]
+                row = {'name' : job['name'], 'kind' : job['kind'], 'paths' : job['paths'],
+                       'status' : 'rendered', 'error' : ''}
+                try:
+                    future.result()
+                    index.update({path : job['hash'] for path in job['paths']})
+                except Exception as e:
+                    row.update(status = 'failed', error = f'{type(e).__name__}: {e}')
+                    for path in job['paths']:
+                        index.pop(path, None)
+                rows.append(row)
+
+        save_index(out_dir, index)
+
+    return rows
@@ -0,0 +1,148 @@
+import numpy as np
+
+from precision import get_dtype, accum_dtype
+
+
+def linear_weights(wave, x):
+    """
+    Precomputes linear interpolation from a sorted wavelength grid onto points x,
+    so it can be applied to any number of spectra on that grid (see apply_linear).
+    Points outside the grid are clamped to the end values, like np.interp
+    (resample raises for them instead, unless extrapolate = True).
+
+    ================== Params ==================
+
+    wave  : sorted array of wavelengths of the spectra
+    x     : wavelengths to interpolate to
+
+    ================== Returns =================
+
+    i, t  : left grid index and fractional position between wave[i] and wave[i+1] for each x
+
+    """
+
+    wave, x = np.asarray(wave, dtype = float), np.asarray(x, dtype = float)
+
+    i = np.clip(np.searchsorted(wave, x, side = 'right') - 1, 0, len(wave) - 2)
+    t = np.clip((x - wave[i]) / (wave[i + 1] - wave[i]), 0, 1)
+
+    return i, t
+
+
+def apply_linear(weights, specs, dtype = None):
+    """
+    Applies linear_weights to a spectrum or a (n_spectra x n_wave) stack of spectra,
+    giving the result in dtype (Default is None, precision.dtype).
+    """
+
+    i, t  = weights
+    specs = np.asarray(specs, dtype = get_dtype(dtype))
+    t     = t.astype(specs.dtype, copy = False)
+
+    return specs[..., i] * (1 - t) + specs[..., i + 1] * t
+
+
+def bin_average_weights(wave, centers, widths):
+    """
+    Precomputes flux-conserving resampling onto bins: the average of the
+    (piecewise linear) spectrum over each bin [center - width/2, center + width/2],
+    clipped to the wavelength grid. See apply_bin_average.
+
+    ================== Params ==================
+
+    wave     : sorted array of wavelengths of the spectra
+    centers  : bin centers (e.g. from binning.bin_err)
+    widths   : full bin widths (e.g. from binning.bin_err)
+
+    ================== Returns =================
+
+    weights : (lo, hi, widths, wave) needed by apply_bin_average
+
+    """
+
+    wave    = np.asarray(wave, dtype = float)
+    centers = np.asarray(centers, dtype = float)
+    widths  = np.asarray(widths, dtype = float)
+
+    lo = np.clip(centers - widths/2, wave[0], wave[-1])
+    hi = np.clip(centers + widths/2, wave[0], wave[-1])
+
+    return linear_weights(wave, lo), linear_weights(wave, hi), hi - lo, wave
+
+
+def _cumulative_integral(weights, specs, cumsum, wave):
+    """
+    Integral of the piecewise linear spectrum from wave[0] up to the points in weights.
+    """
+
+    i, t  = weights
+    dx    = t * (wave[i + 1] - wave[i])
+    right = specs[..., i] * (1 - t) + specs[..., i + 1] * t
+
+    return cumsum[..., i] + dx * (specs[..., i] + right) / 2
+
+
+def apply_bin_average(weights, specs, dtype = None):
+    """
+    Applies bin_average_weights to a spectrum or a (n_spectra x n_wave) stack of spectra,
+    giving the result in dtype (Default is None, precision.dtype; the integrals are
+    done in precision.accum_dtype). Bins narrower than the grid spacing (or of zero
+    width after clipping) just get the interpolated value at the bin.
+    """
+
+    lo, hi, widths, wave = weights
+    dtype = get_dtype(dtype)
+    specs = np.asarray(specs, dtype = accum_dtype)
+
+    # trapezoid rule integral up to each grid point, with a leading zero
+    cumsum = np.cumsum(np.diff(wave) * (specs[..., 1:] + specs[..., :-1]) / 2, axis = -1)
+    cumsum = np.concatenate((np.zeros_like(specs[..., :1]), cumsum), axis = -1)
+
+    integral = _cumulative_integral(hi, specs, cumsum, wave) - _cumulative_integral(lo, specs, cumsum, wave)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        average = integral / widths
+
+    return np.where(widths > 0, average, apply_linear(lo, specs, accum_dtype)).astype(dtype, copy = False)
+
+
+def resample(wave, specs, x, widths = None, method = 'linear', dtype = None, extrapolate = False):
+    """
+    Resamples a spectrum (or a stack of spectra on the same grid) onto new wavelengths.
+    Like the interp1d it replaces, raises ValueError for points outside the grid
+    unless extrapolate is True, in which case they get the end values.
+
+    ================== Params ==================
+
+    wave         : sorted array of wavelengths of the spectra
+    specs        : spectrum, or (n_spectra x n_wave) stack of spectra
+    x            : wavelengths (or bin centers) to resample to
+    widths       : full bin widths, needed for method = 'bin_average'
+    method       : 'linear' (np.interp-like) or 'bin_average' (flux-conserving average over each bin)
+    dtype        : dtype of the result (Default is None, precision.dtype)
+    extrapolate  : whether to clamp points outside wave to the end values instead of
+                   raising (Default is False)
+
+    ================== Returns =================
+
+    resampled : values at x, shape (len(x),) or (n_spectra, len(x))
+
+    """
+
+    if not extrapolate:
+        wave, x = np.asarray(wave), np.asarray(x)
+        outside = (x < wave[0]) | (x > wave[-1])
+        if np.any(outside):
+            raise ValueError(f'{np.count_nonzero(outside)} of the points to resample to ({np.min(x):g} - {np.max(x):g}) '
+                             f'are outside the wavelength grid ({wave[0]:g} - {wave[-1]:g}), '
+                             'use extrapolate = True to clamp them to the end values')
+
+    if method == 'linear':
+        return apply_linear(linear_weights(wave, x), specs, dtype)
+
+    if method == 'bin_average':
+        if widths is None:
+            raise ValueError("method = 'bin_average' needs the bin widths")
+        return apply_bin_average(bin_average_weights(wave, x, widths), specs, dtype)
+
+    raise ValueError(f"unknown resampling method '{method}', use 'linear' or 'bin_average'")
@@ -0,0 +1,271 @@
+import numpy as np
+
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+# my functions
+from main import load_params, chisquared, transits_needed
+from pandexo_cache import _jsonable
+import run_pandexo
+import main
+
+# default location of the result store
+db_path = os.environ.get('CSRE_RESULTS_DB', 'csre_results.db')
+
+# significance levels with a "transits needed" column
+transit_levels = (1, 3, 5)
+
+schema = """
+CREATE TABLE IF NOT EXISTS results (
+    key          TEXT PRIMARY KEY,
+    name         TEXT NOT NULL,
+    params_hash  TEXT NOT NULL,
+    params       TEXT NOT NULL,
+    Rp           REAL,
+    Rs           REAL,
+    star_temp    REAL,
+    star_logg    REAL,
+    mag          REAL,
+    chisq        REAL,
+    numsig       REAL,
+    mu           REAL,
+    transits_1sigma  REAL,
+    transits_3sigma  REAL,
+    transits_5sigma  REAL,
+    status       TEXT NOT NULL,
+    error        TEXT,
+    elapsed      REAL,
+    created      REAL,
+    spectrum     BLOB,
+    errs         BLOB
+);
+CREATE INDEX IF NOT EXISTS results_name ON results (name);
+CREATE INDEX IF NOT EXISTS results_star_temp ON results (star_temp);
+CREATE INDEX IF NOT EXISTS results_chisq ON results (chisq);
+CREATE INDEX IF NOT EXISTS results_numsig ON results (numsig);
+CREATE INDEX IF NOT EXISTS results_mu ON results (mu);
+CREATE INDEX IF NOT EXISTS results_transits_1sigma ON results (transits_1sigma);
+CREATE INDEX IF NOT EXISTS results_transits_3sigma ON results (transits_3sigma);
+CREATE INDEX IF NOT EXISTS results_transits_5sigma ON results (transits_5sigma);
+"""
+
+# columns returned by query (everything but the blobs)
+summary_columns = ['key', 'name', 'params_hash', 'Rp', 'Rs', 'star_temp', 'star_logg', 'mag', 'chisq', 'numsig', 'mu',
+                   'transits_1sigma', 'transits_3sigma', 'transits_5sigma', 'status', 'error', 'elapsed', 'created']
+
+
+def connect(path = None):
+    """
+    Opens (and creates, if needed) a result store.
+
+    ================== Params ==================
+
+    path  : SQLite file (Default is None, db_path)
+
+    ================== Returns =================
+
+    conn : sqlite3 connection
+
+    """
+
+    conn = sqlite3.connect(db_path if path is None else path)
+    conn.executescript(schema)
+
+    return conn
+
+
+def params_hash(params):
+    """
+    Hash of everything a result depends on: csre_params, pandexo_params, and the
+    noise backend and resampling method in use (so e.g. surrogate and PandExo
+    results are kept apart).
+    """
+
+    inputs = {'csre_params'     : params.csre_params,
+              'pandexo_params'  : params.pandexo_params,
+              'noise_backend'   : run_pandexo.noise_backend,
+              'resample_method' : main.resample_method}
+    text = json.dumps(inputs, sort_keys = True, default = _jsonable)
+
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def result_key(target):
+    """
+    Key of a target in the store, '{name}:{params_hash}'.
+
+    ================== Params ==================
+
+    target  : system name or param dict/object (see main.load_params)
+
+    ================== Returns =================
+
+    key : string
+
+    """
+
+    from batch import target_name
+
+    return f'{target_name(target)}:{params_hash(load_params(target))}'
+
+
+def pack_arrays(**arrays):
+    """
+    Compressed npz blob of some arrays.
+    """
+
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+
+    return buffer.getvalue()
+
+
+def unpack_arrays(blob):
+    """
+    Arrays back from a pack_arrays blob (dict of name -> array).
+    """
+
+    with np.load(io.BytesIO(blob)) as data:
+        return {name : data[name] for name in data.files}
+
+
+def existing_keys(conn, status = 'ok'):
+    """
+    Set of keys already in the store (only ones with this status, None for all).
+    """
+
+    if status is None:
+        return {key for key, in conn.execute('SELECT key FROM results')}
+
+    return {key for key, in conn.execute('SELECT key FROM results WHERE status = ?', (status,))}
+
+
+def store_result(conn, target, row, result = None, key = None):
+    """
+    Adds (or replaces) a target's result. chisq, numsig and mu are stored for a
+    single transit, along with the number of transits needed for 1, 3 and 5 sigma.
+
+    ================== Params ==================
+
+    conn    : connection from connect()
+    target  : system name or param dict/object (see main.load_params)
+    row     : result row from batch.run_target (for the name, status, error and elapsed time)
+    result  : (wave, smooth_csre_spec, errs) as returned by main.CSRE (None for failed targets)
+    key     : key to store it under (Default is None, result_key(target))
+
+    """
+
+    params = load_params(target)
+    csre, pandexo = params.csre_params, params.pandexo_params
+    key = result_key(target) if key is None else key
+
+    values = {
+        'key'         : key,
+        'name'        : row['name'],
+        'params_hash' : key.rsplit(':', 1)[-1],
+        'params'      : json.dumps({'csre_params' : csre, 'pandexo_params' : pandexo}, default = _jsonable),
+        'Rp'          : csre.get('Rp'),
+        'Rs'          : csre.get('Rs'),
+        'star_temp'   : pandexo.get('star_temp'),
+        'star_logg'   : pandexo.get('star_logg'),
+        'mag'         : pandexo.get('mag'),
+        'status'      : row['status'],
+        'error'       : row['error'],
+        'elapsed'     : row['elapsed'],
+        'created'     : time.time()
+    }
+
+    if result is not None:
+        wave, smooth_csre_spec, errs = result
+        chisq, numsig, mu = chisquared(row['name'], errs)
+        needed = transits_needed(errs, transit_levels)
+
+        values.update(chisq = float(chisq), numsig = float(numsig), mu = float(mu),
+                      spectrum = pack_arrays(wave = wave, smooth_csre_spec = smooth_csre_spec),
+                      errs = pack_arrays(x = errs[0], y = errs[1], yerr = errs[2]))
+        values.update({f'transits_{level}sigma' : float(n) for level, n in zip(transit_levels, needed)})
+
+    columns = ', '.join(values)
+    marks   = ', '.join('?' * len(values))
+    with conn:
+        conn.execute(f'INSERT OR REPLACE INTO results ({columns}) VALUES ({marks})', list(values.values()))
+
+
+def query(conn, where = None, args = (), order_by = None, limit = None):
+    """
+    Summary rows (no blobs) matching an SQL condition, e.g.
+
+        query(conn, 'star_temp < ? AND transits_5sigma < ?', (4000, 10), order_by = 'transits_5sigma')
+
+    ================== Params ==================
+
+    conn      : connection from connect()
+    where     : SQL condition on the columns (Default is None, every row)
+    args      : values for the ? placeholders in where
+    order_by  : SQL ordering, e.g. 'numsig DESC' (Default is None)
+    limit     : maximum number of rows (Default is None, no limit)
+
+    ================== Returns =================
+
+    rows : list of dicts with the summary_columns
+
+    """
+
+    sql = f"SELECT {', '.join(summary_columns)} FROM results"
+    if where:
+        sql += f' WHERE {where}'
+    if order_by:
+        sql += f' ORDER BY {order_by}'
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+
+    return [dict(zip(summary_columns, values)) for values in conn.execute(sql, args)]
+
+
+def detectable(conn, numsig = 5, max_transits = 10, max_temp = 4000):
+    """
+    Targets reaching numsig (1, 3 or 5) in fewer than max_transits transits, e.g.
+    M dwarf hosts (Default star_temp < 4000 K, None for any star) reaching 5 sigma in under 10.
+    """
+
+    if numsig not in transit_levels:
+        raise ValueError(f'numsig has to be one of {transit_levels}')
+
+    where, args = f'status = ? AND transits_{numsig}sigma < ?', ['ok', max_transits]
+    if max_temp is not None:
+        where += ' AND star_temp < ?'
+        args.append(max_temp)
+
+    return query(conn, where, args, order_by = f'transits_{numsig}sigma')
+
+
+def load_result(conn, key):
+    """
+    Full result for a key (or the latest one for a name), with the arrays unpacked.
+
+    ================== Returns =================
+
+    result : summary row dict plus 'params', 'wave', 'smooth_csre_spec' and 'errs' ((x, y, yerr))
+
+    """
+
+    columns = summary_columns + ['params', 'spectrum', 'errs']
+    sql = f"SELECT {', '.join(columns)} FROM results WHERE key = ? OR name = ? ORDER BY key = ? DESC, created DESC LIMIT 1"
+    values = conn.execute(sql, (key, key, key)).fetchone()
+    if values is None:
+        raise KeyError(f"no result for '{key}'")
+
+    result = dict(zip(columns, values))
+    result['params'] = json.loads(result['params'])
+
+    spectrum, errs = result.pop('spectrum'), result.pop('errs')
+    if spectrum is not None:
+        result.update(unpack_arrays(spectrum))
+        errs = unpack_arrays(errs)
+        result['errs'] = (errs['x'], errs['y'], errs['yerr'])
+
+    return result
@@ -1,20 +1,47 @@
 import numpy as np
-import matplotlib.pyplot as plt
 
 import warnings
 warnings.filterwarnings('ignore')
-import pandexo.engine.justdoit as jdi # THIS IS THE HOLY GRAIL OF PANDEXO
 import os
 
-import pandexo.engine.justplotit as jpi
 import pickle as pk
+from concurrent.futures import ProcessPoolExecutor
 
-def run_pandexo(params):
+from pandexo_cache import cache_key, load_cached, save_cached
+from noise_model import surrogate_errors
+
+# PandExo instrument used for all our runs
+instrument = 'NIRSpec Prism'
+
+# where error bars come from by default: 'pandexo' (the real thing) or 
+# 'surrogate' (fast template-based stand-in, see noise_model.py)
+noise_backend = os.environ.get('NOISE_BACKEND', 'pandexo')
+
+# exo_dict['observation'] entries the surrogate can change; it's built from runs with
+# the defaults in build_exo_dict, so anything else (sat_level, baseline, ...) is an error
+surrogate_observation = ('noccultations', 'noise_floor')
+
+
+def load_jdi():
     """
-    Runs Pandexo and returns wavelength axis (microns) and error bars (ppm).
-    For our purposes, we don't need Pandexo's transit spectrum model.
+    Imports PandExo only when it's actually needed, so the rest of the
+    pipeline can be imported (and PandExo stubbed out) without a PandExo install.
+    """
+    
+    import pandexo.engine.justdoit as jdi # THIS IS THE HOLY GRAIL OF PANDEXO
+    
+    return jdi
+
+
+def build_exo_dict(params, observation = None):
+    """
+    Fills in a blank PandExo exo_dict from the system's pandexo_params.
     Comments on specifics in my pandexo notebook and/or their documentation.
     
+    observation is an optional dict of exo_dict['observation'] entries to change
+    from our defaults, e.g. {'noccultations' : 5, 'sat_level' : 60}. Only PandExo
+    uses the exo_dict; the surrogate backend only takes noccultations and noise_floor.
+    
     ==================================== Params ====================================
     
     sys_name      : name of transiting planet system
@@ -33,11 +60,14 @@ def run_pandexo(params):
     
     # loading PandExo params
     sys_name, mag, ref_wave, star_temp, star_metal, \
-    star_logg, trans_dur, star_radius, planet_radius = params.pandexo_params.values()
+    star_logg, trans_dur, star_radius, planet_radius = [params.pandexo_params[key] for key in 
+                                                        ('sys_name', 'mag', 'ref_wave', 'star_temp', 'star_metal',
+                                                         'star_logg', 'trans_dur', 'star_radius', 'planet_radius')]
     
     ref_wave_dict = {'J' : 1.25, 'H' : 1.6, 'K' : 2.22}
 
     ### Loading blank exo dictionary
+    jdi      = load_jdi()
     exo_dict = jdi.load_exo_dict()
 
     ### Observational properties
@@ -48,6 +78,7 @@ def run_pandexo(params):
     exo_dict['observation']['baseline_unit'] = 'total'
     exo_dict['observation']['baseline']      = (5 * trans_dur) *60.0*60.0
     exo_dict['observation']['noise_floor']   = 14
+    exo_dict['observation'].update(observation or {})
 
     ### Star properties
     exo_dict['star']['type']     = 'phoenix'
@@ -68,16 +99,171 @@ def run_pandexo(params):
     exo_dict['planet']['w_unit']           = 'um'
     exo_dict['planet']['f_unit']           = 'rp^2/r*^2'
     
-    ### The actual run
-    result_dict = jdi.run_pandexo(exo_dict, ['NIRSpec Prism'], output_file = f'{sys_name}_pandexo.p')
+    return exo_dict
 
+
+def extract_errors(result_dict):
+    """
+    Pulls the wavelength axis (microns) and error bars (ppm) out of a PandExo result.
+    """
+    
     ### Pulling out wavelength and error values (copied from source)
     wave = result_dict['FinalSpectrum']['wave']
     err = result_dict['FinalSpectrum']['error_w_floor']*1e6
     wave = wave[~np.isnan(err)]
     err = err[~np.isnan(err)]
-
+    
     return wave, err
 
 
+def pandexo_worker(exo_dict, instruments, output_file = None):
+    """
+    One PandExo invocation for one exo_dict and any number of instruments
+    (PandExo sets up the star and planet once and reuses them for each instrument).
+    
+    ==================================== Params ====================================
+    
+    exo_dict     : filled in exo_dict (see build_exo_dict)
+    instruments  : list of PandExo instrument names
+    output_file  : pickle file to save PandExo's full output to (Default is None, don't save)
+    
+    ================================================================================
+    
+    Returns a dict of instrument -> (wave, err)
+    """
+    
+    result = load_jdi().run_pandexo(exo_dict, instruments, save_file = output_file is not None, 
+                                    output_file = output_file or '')
+    
+    # a single instrument gives its result dict directly, several give a list of {instrument : result dict}
+    if not isinstance(result, list):
+        result = [{instruments[0] : result}]
+    
+    errors = {}
+    for inst_result in result:
+        for inst, result_dict in inst_result.items():
+            errors[inst] = extract_errors(result_dict)
+    
+    return errors
 
+
+def run_pandexo_batch(param_sets, instruments = None, use_cache = True, backend = None, 
+                      max_workers = 1, save_pickle = False):
+    """
+    Runs PandExo for many parameter sets (e.g. the same target at several
+    noccultations, saturation levels or baselines) and several instruments.
+    All instruments for a parameter set go through a single PandExo call, cached
+    results are skipped, and the remaining calls can be spread over worker processes.
+    
+    ==================================== Params ====================================
+    
+    param_sets   : list or dict (label -> entry) where each entry is a parameter 
+                   module/object, or a (params, observation) tuple with observation
+                   a dict of exo_dict['observation'] changes (see build_exo_dict; the
+                   surrogate only takes noccultations and noise_floor, and raises a
+                   ValueError for anything else)
+    instruments  : list of PandExo instrument names (Default is ['NIRSpec Prism'])
+    use_cache    : whether to read/write the on-disk PandExo cache (Default is True)
+    backend      : 'pandexo' or 'surrogate' (Default is noise_backend); the surrogate
+                   only does NIRSpec Prism
+    max_workers  : number of worker processes for the PandExo calls (Default is 1, run here)
+    save_pickle  : whether to save PandExo's full output as {sys_name}_{label}_pandexo.p
+                   (Default is False)
+    
+    ================================================================================
+    
+    Returns a dict of (label, instrument) -> (wave, err), with labels being the 
+    list indices if param_sets is a list
+    """
+    
+    backend     = noise_backend if backend is None else backend
+    instruments = [instrument] if instruments is None else list(instruments)
+    if not isinstance(param_sets, dict):
+        param_sets = dict(enumerate(param_sets))
+    
+    if backend not in ('pandexo', 'surrogate'):
+        raise ValueError(f"unknown noise backend '{backend}', use 'pandexo' or 'surrogate'")
+    
+    errors, jobs = {}, []
+    for label, entry in param_sets.items():
+        params, observation = entry if isinstance(entry, tuple) else (entry, None)
+        observation = observation or {}
+        
+        ### Surrogate noise model (no PandExo at all) ###
+        if backend == 'surrogate':
+            unsupported = sorted(set(observation) - set(surrogate_observation))
+            if unsupported:
+                # raised rather than warned, since warnings are switched off above
+                raise ValueError(f'the surrogate noise model only takes {list(surrogate_observation)} '
+                                 f'observation changes, not {unsupported}; use the pandexo backend')
+            for inst in instruments:
+                if inst != 'NIRSpec Prism':
+                    raise ValueError(f"the surrogate noise model only does 'NIRSpec Prism', not '{inst}'")
+                errors[(label, inst)] = surrogate_errors(params.pandexo_params, 
+                                                         noccultations = observation.get('noccultations', 1),
+                                                         floor = observation.get('noise_floor', 14))
+            continue
+        
+        exo_dict = build_exo_dict(params, observation)
+        
+        ### Checking the cache first
+        missing, keys = [], {}
+        for inst in instruments:
+            keys[inst] = cache_key(exo_dict, inst)
+            cached = load_cached(keys[inst]) if use_cache else None
+            if cached is None:
+                missing.append(inst)
+            else:
+                errors[(label, inst)] = cached
+        
+        if missing:
+            sys_name    = params.pandexo_params['sys_name']
+            suffix      = '' if label is None else f'_{label}'
+            output_file = f'{sys_name}{suffix}_pandexo.p' if save_pickle else None
+            jobs.append((label, exo_dict, missing, output_file, keys))
+    
+    ### The actual runs
+    if max_workers == 1 or len(jobs) <= 1:
+        results = [pandexo_worker(exo_dict, missing, output_file) for _, exo_dict, missing, output_file, _ in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+            results = list(executor.map(pandexo_worker, *zip(*[job[1:4] for job in jobs])))
+    
+    for (label, exo_dict, missing, output_file, keys), result in zip(jobs, results):
+        for inst in missing:
+            errors[(label, inst)] = result[inst]
+            if use_cache:
+                save_cached(keys[inst], *result[inst])
+    
+    return errors
+
+
+def run_pandexo(params, use_cache = True, backend = None, observation = None, save_pickle = False):
+    """
+    Runs Pandexo and returns wavelength axis (microns) and error bars (ppm).
+    For our purposes, we don't need Pandexo's transit spectrum model.
+    
+    Results are cached on disk (see pandexo_cache.py) keyed by a hash of the 
+    full exo_dict and instrument, so repeated runs with unchanged pandexo_params
+    skip PandExo entirely.
+    
+    With backend = 'surrogate' the error bars come from the template-based noise
+    model in noise_model.py instead, which doesn't need PandExo installed.
+    
+    ==================================== Params ====================================
+    
+    params       : parameter module/object for the system (needs params.pandexo_params)
+    use_cache    : whether to read/write the on-disk PandExo cache (Default is True)
+    backend      : 'pandexo' or 'surrogate' (Default is noise_backend)
+    observation  : dict of exo_dict['observation'] changes, e.g. {'noccultations' : 5}
+                   (only noccultations and noise_floor with the surrogate)
+    save_pickle  : whether to save PandExo's full output as {sys_name}_pandexo.p (Default is False)
+    
+    ================================================================================
+
+    """
+    
+    errors = run_pandexo_batch({None : (params, observation)}, [instrument], use_cache = use_cache, 
+                               backend = backend, save_pickle = save_pickle)
+    
+    return errors[(None, instrument)]
@@ -0,0 +1,140 @@
+import numpy as np
+from scipy import constants
+
+# my functions
+from main import load_params
+from batch import target_name
+
+# molar masses [g/mol] of the ExoTransmit opacity species (and a few atoms), same as molmass.Formula(m).mass
+molar_mass_table = {
+    'H'    :  1.007941, 'H2'   :  2.015882, 'He'   :  4.002602, 'H2O'  : 18.015287,
+    'CH4'  : 16.042504, 'CO'   : 28.010145, 'CO2'  : 44.009550, 'NH3'  : 17.030526,
+    'N2'   : 28.013406, 'O2'   : 31.998810, 'O3'   : 47.998215, 'NO'   : 30.006108,
+    'NO2'  : 46.005513, 'OH'   : 17.007346, 'HCN'  : 27.025384, 'C2H2' : 26.037362,
+    'C2H4' : 28.053244, 'C2H6' : 30.069126, 'H2CO' : 30.026027, 'H2S'  : 34.080682,
+    'HCl'  : 36.460841, 'HF'   : 20.006344163, 'OCS'  : 60.074945, 'PH3'  : 33.997584998,
+    'SH'   : 33.072741, 'SO2'  : 64.063610, 'SiH'  : 29.093441, 'SiO'  : 44.084905,
+    'MgH'  : 25.313041, 'TiO'  : 63.866405, 'VO'   : 66.940905, 'FeH'  : 56.852941,
+    'CrH'  : 53.004041, 'CaH'  : 41.085941, 'Na'   : 22.98976928, 'K'    : 39.098300,
+    'Fe'   : 55.845000,
+}
+
+# molar masses looked up with molmass so far (anything not in the table)
+_mass_cache = {}
+
+amu = constants.physical_constants['atomic mass constant'][0] # [kg]
+k   = constants.k # [J / K]
+
+
+def molar_mass(molecule):
+    """
+    Molar mass of a molecule [g/mol], from molar_mass_table, or parsed with
+    molmass (only imported when needed) and cached if it isn't in the table.
+    """
+
+    if molecule in molar_mass_table:
+        return molar_mass_table[molecule]
+
+    if molecule not in _mass_cache:
+        import molmass
+        _mass_cache[molecule] = molmass.Formula(molecule).mass
+
+    return _mass_cache[molecule]
+
+
+def molar_masses(molecules):
+    """
+    Array of molar masses [g/mol] for a list of molecules.
+    """
+
+    return np.array([molar_mass(molecule) for molecule in molecules], dtype = float)
+
+
+def scale_height(T, logg, mass):
+    """
+    Atmospheric scale height H = kT / (m g) [m], broadcast over all inputs.
+
+    ================== Params ==================
+
+    T     : temperature [K]
+    logg  : log10 of surface gravity [cgs]
+    mass  : molar mass of the molecule [g/mol]
+
+    """
+
+    g = 10**np.asarray(logg, dtype = float) / 100 # [m/s^2]
+
+    return k * np.asarray(T, dtype = float) / (np.asarray(mass, dtype = float) * amu * g)
+
+
+def depth_changes(Rp, Rs, T, logg, molecules, N = 1):
+    """
+    Change in transit depth from the stellar atmosphere, for every combination
+    of target, molecule and number of scale heights at once:
+
+    deltadelta = 2*(NH/Rs)*delta           where delta = (Rp/Rs)^2
+
+    ================== Params ==================
+
+    Rp         : planet radius of each target [m]
+    Rs         : stellar radius of each target [m]
+    T          : stellar temperature of each target [K]
+    logg       : stellar log g of each target [cgs]
+    molecules  : list of molecules
+    N          : number(s) of scale heights, should be of order unity (Default = 1)
+
+    ================== Returns =================
+
+    deltadeltas : array of shape (targets, molecules, N) [ppm]
+
+    """
+
+    Rp, Rs, T, logg = [np.atleast_1d(np.asarray(a, dtype = float))[:, None, None] for a in (Rp, Rs, T, logg)]
+    mass = molar_masses(molecules)[None, :, None]
+    N    = np.atleast_1d(np.asarray(N, dtype = float))[None, None, :]
+
+    depth = (Rp / Rs)**2 * 1e6 # [ppm]
+    H     = scale_height(T, logg, mass)
+
+    return 2 * depth * (N * H) / Rs
+
+
+def target_arrays(targets):
+    """
+    Rp, Rs, star_temp and star_logg of each target as arrays.
+
+    ================== Params ==================
+
+    targets  : list of system names and/or param dicts (see main.load_params), e.g. from catalog.catalog_params
+
+    ================== Returns =================
+
+    arrays : dict with 'name', 'Rp', 'Rs', 'T' and 'logg'
+
+    """
+
+    params = [load_params(target) for target in targets]
+
+    return {
+        'name' : [target_name(target) for target in targets],
+        'Rp'   : np.array([p.csre_params['Rp'] for p in params], dtype = float),
+        'Rs'   : np.array([p.csre_params['Rs'] for p in params], dtype = float),
+        'T'    : np.array([p.pandexo_params['star_temp'] for p in params], dtype = float),
+        'logg' : np.array([p.pandexo_params['star_logg'] for p in params], dtype = float)
+    }
+
+
+def target_depth_changes(targets, molecules, N = 1):
+    """
+    depth_changes for a list of targets.
+
+    ================== Returns =================
+
+    names        : target names
+    deltadeltas  : array of shape (targets, molecules, N) [ppm]
+
+    """
+
+    arrays = target_arrays(targets)
+
+    return arrays['name'], depth_changes(arrays['Rp'], arrays['Rs'], arrays['T'], arrays['logg'], molecules, N)
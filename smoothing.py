@@ -1,37 +1,164 @@
 import numpy as np
 
-def adap_smooth(wave, spec, R):
+from precision import get_dtype, accum_dtype
+
+def adap_smooth(wave, spec, R, reference = False, dtype = None):
     """
     Smooths to a fixed spectral resolution according to:
-    
+
     R = lamb / deltalamb
-    
+
     Thus, the bin size changes for each wavelength.
-    
+
+    Vectorized version: the bin edges for every pixel are found at once with
+    np.searchsorted (wave must be sorted, which ExoTransmit grids are), and the
+    bin means come from a cumulative sum of the spectrum, so the cost is
+    O(N log N) instead of O(N^2).
+
+    ================== Params ==================
+
+    wave       : array or list of wavelengths (sorted, increasing)
+    spec       : array or list of transit depths
+    R          : spectral resolution (JWST NIRSPEC: ~100 (prism), ~1000, or ~2700)
+    reference  : if True, use the original per-pixel loop (adap_smooth_loop)
+    dtype      : dtype of the result (Default is None, precision.dtype)
+
+    ================== Returns =================
+
+    smooth_spec : array of smoothed transit depths, same length as wave
+
+    """
+
+    if reference:
+        return np.array(adap_smooth_loop(wave, spec, R), dtype = get_dtype(dtype))
+
+    return adap_smooth_many(wave, spec, R, dtype = dtype)
+
+
+def smooth_bins(wave, R):
+    """
+    Builds the bin structure used by adap_smooth for a given wavelength grid
+    and resolution. Only depends on (wave, R), so it can be computed once and
+    reused for every spectrum on the same grid.
+
+    ================== Params ==================
+
+    wave   : array or list of wavelengths (sorted, increasing)
+    R      : spectral resolution
+
+    ================== Returns =================
+
+    lo, hi : index arrays such that pixel i is smoothed over spec[lo[i]:hi[i]]
+
+    """
+
+    wave = np.asarray(wave)
+
+    # bin centers are the wavelengths themselves, except for the first bin
+    # which uses lamb = 2R*np.min(lambs) / (2R-1) (same as the loop version)
+    lambs    = wave.astype(float)
+    lambs[0] = (2*R*wave[0]) / (2*R - 1)
+    dellambs = lambs / R
+
+    # index ranges [lo, hi) of the pixels w/n +- dellamb/2 of each center
+    lo = np.searchsorted(wave, lambs - dellambs/2, side = 'left')
+    hi = np.searchsorted(wave, lambs + dellambs/2, side = 'left')
+
+    return lo, hi
+
+
+def adap_smooth_many(wave, specs, R, bins = None, dtype = None):
+    """
+    Smooths a whole stack of spectra on the same wavelength grid at once.
+    The bin structure is built once (or passed in from smooth_bins) and applied
+    to every row with a single cumulative sum, so smoothing 50 spectra costs
+    about the same as smoothing one.
+
+    The spectra and result are in dtype; only the cumulative sum is kept in
+    precision.accum_dtype (float64), which keeps float32 within ~1e-3 ppm.
+
+    ================== Params ==================
+
+    wave   : array or list of wavelengths (sorted, increasing)
+    specs  : array of transit depths, shape (n_wave,) or (n_spectra, n_wave)
+    R      : spectral resolution (JWST NIRSPEC: ~100 (prism), ~1000, or ~2700)
+    bins   : optional (lo, hi) output of smooth_bins(wave, R) to reuse
+    dtype  : dtype of the result (Default is None, precision.dtype)
+
+    ================== Returns =================
+
+    smooth_specs : array of smoothed transit depths, same shape as specs
+
+    """
+
+    if bins is None:
+        bins = smooth_bins(wave, R)
+    lo, hi = bins
+
+    specs = np.asarray(specs, dtype = get_dtype(dtype))
+
+    # a nan would carry through the cumulative sum into every later bin, so sum
+    # them as zeros and only give nan for the bins that actually hold one (like the loop version)
+    nans = np.isnan(specs)
+    if nans.any():
+        specs     = np.where(nans, specs.dtype.type(0), specs)
+        nan_count = np.zeros(nans.shape[:-1] + (nans.shape[-1] + 1,), dtype = np.intp)
+        np.cumsum(nans, axis = -1, out = nan_count[..., 1:])
+        has_nan   = nan_count[..., hi] > nan_count[..., lo]
+    else:
+        has_nan = None
+
+    # cumulative sum with a leading zero, so the sum over [lo, hi) is cumsum[hi] - cumsum[lo],
+    # built in place in one buffer (subtracting the first value keeps the running sum small for better precision)
+    offset = specs[..., :1]
+    cumsum = np.zeros(specs.shape[:-1] + (specs.shape[-1] + 1,), dtype = accum_dtype)
+    np.subtract(specs, offset, out = cumsum[..., 1:])
+    np.cumsum(cumsum[..., 1:], axis = -1, out = cumsum[..., 1:])
+
+    # taking mean in each bin (empty bins give nan, like the loop version)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        smooth_specs = cumsum[..., hi]
+        smooth_specs -= cumsum[..., lo]
+        smooth_specs /= hi - lo
+
+    smooth_specs  = smooth_specs.astype(specs.dtype, copy = False)
+    smooth_specs += offset
+
+    if has_nan is not None:
+        smooth_specs[has_nan] = np.nan
+
+    return smooth_specs
+
+
+def adap_smooth_loop(wave, spec, R):
+    """
+    Original per-pixel implementation of adap_smooth, kept as a reference
+    to check the vectorized version against. Slow (O(N^2)) on full grids!
+
     ================== Params ==================
-    
+
     wave   : array or list of wavelengths
     spec   : array or list of transit depths
     R      : spectral resolution (JWST NIRSPEC: ~100 (prism), ~1000, or ~2700)
-    
+
     ============================================
-    
+
     """
-    
+
     # Finding center of first bin
     # using equation lamb = 2R*np.min(lambs) / (2R-1)
     lamb0 = (2*R*wave[0]) / (2*R - 1)
     dellamb = lamb0 / R
-    
+
     # binning wavelengths w/n +- dellamb/2 of lamb0
     bin_indices = np.where(np.logical_and(wave >= lamb0 - dellamb/2, wave < lamb0 + dellamb/2))
-    
+
     # taking mean in bin
     mean0 = spec[bin_indices].mean()
-    
+
     # creating list to store the smooth spectrum
     smooth_spec = [mean0]
-    
+
     # repeating everything above for every bin
     for i in range(1,len(spec)):
         lamb = wave[i]
@@ -40,5 +167,5 @@ def adap_smooth(wave, spec, R):
         mean = spec[bin_indices].mean()
 
         smooth_spec.append(mean)
-    
-    return smooth_spec
\ No newline at end of file
+
+    return smooth_spec
@@ -0,0 +1,158 @@
+import numpy as np
+
+import os
+import glob
+import json
+
+# JWST NIRSpec wavelength range (microns)
+nirspec_range = (0.6, 5.3)
+
+# stores opened so far, so the memory maps are only set up once per session
+_open_stores = {}
+
+
+def nirspec_slice(wave, wave_range = nirspec_range):
+    """
+    Slice of a sorted wavelength array covering the NIRSpec range. Same as the
+    np.where version used in CSRE (starts at the last point below the range and
+    stops before the first point above it), but with np.searchsorted.
+
+    ================== Params ==================
+
+    wave        : sorted array of wavelengths (same units as wave_range)
+    wave_range  : (min, max) of the range (Default is 0.6 - 5.3 microns)
+
+    ================== Returns =================
+
+    wave_index : slice into wave
+
+    """
+
+    start = np.searchsorted(wave, wave_range[0], side = 'left') - 1
+    stop  = np.searchsorted(wave, wave_range[1], side = 'right')
+
+    return slice(int(start), int(stop))
+
+
+def pack_spectra(spectra_path, store_path = None, names = None):
+    """
+    Packs ExoTransmit outputs (transmission_{name}.dat) into a binary store:
+    one shared wavelength axis (microns) plus one row of transit depths (as a
+    fraction, not %) per object, and an index of names. Only needs to be run
+    once (or again whenever new ExoTransmit runs are added).
+
+    Spectra that aren't on the same wavelength grid as the first one are skipped.
+
+    ================== Params ==================
+
+    spectra_path  : directory with the ExoTransmit transmission_{name}.dat files
+    store_path    : directory to write the store to (Default is {spectra_path}/store)
+    names         : list of object names to pack (Default is every .dat file in spectra_path)
+
+    ================== Returns =================
+
+    skipped : list of names that weren't packed because their grid doesn't match
+
+    Raises ValueError if there's nothing to pack.
+
+    """
+
+    if store_path is None:
+        store_path = os.path.join(spectra_path, 'store')
+
+    if names is None:
+        files = sorted(glob.glob(os.path.join(spectra_path, 'transmission_*.dat')))
+        names = [os.path.basename(f)[len('transmission_'):-len('.dat')] for f in files]
+
+    if len(names) == 0:
+        raise ValueError(f'no spectra to pack (no transmission_*.dat files in {spectra_path}, or names is empty)')
+
+    os.makedirs(store_path, exist_ok = True)
+
+    wave, depths, index, skipped = None, None, {}, []
+    for name in names:
+        spectrum = np.loadtxt(os.path.join(spectra_path, f'transmission_{name}.dat'), skiprows = 2).T
+
+        # first spectrum sets the shared wavelength axis
+        if wave is None:
+            wave   = spectrum[0] * 1e6  # microns
+            depths = np.lib.format.open_memmap(os.path.join(store_path, 'depths.tmp.npy'), mode = 'w+',
+                                               dtype = float, shape = (len(names), len(wave)))
+
+        if len(spectrum[0]) != len(wave) or not np.array_equal(spectrum[0] * 1e6, wave):
+            skipped.append(name)
+            continue
+
+        index[name] = len(index)
+        depths[index[name]] = spectrum[1] / 100  # convert from %
+
+    depths.flush()
+    del depths
+
+    # dropping the rows left empty by skipped spectra
+    packed = np.load(os.path.join(store_path, 'depths.tmp.npy'), mmap_mode = 'r')
+    np.save(os.path.join(store_path, 'depths.npy'), packed[:len(index)])
+    del packed
+    os.remove(os.path.join(store_path, 'depths.tmp.npy'))
+
+    np.save(os.path.join(store_path, 'wave.npy'), wave)
+
+    wave_index = nirspec_slice(wave)
+    with open(os.path.join(store_path, 'index.json'), 'w') as f:
+        json.dump({'names' : index, 'nirspec' : [wave_index.start, wave_index.stop]}, f, indent = 1)
+
+    _open_stores.pop(store_path, None)
+
+    return skipped
+
+
+def open_store(store_path):
+    """
+    Opens a store written by pack_spectra, memory-mapped (nothing is read from
+    disk until it's used). Returns None if there's no store at store_path.
+    """
+
+    if store_path in _open_stores:
+        return _open_stores[store_path]
+
+    try:
+        with open(os.path.join(store_path, 'index.json')) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    store = {
+        'wave'    : np.load(os.path.join(store_path, 'wave.npy'), mmap_mode = 'r'),
+        'depths'  : np.load(os.path.join(store_path, 'depths.npy'), mmap_mode = 'r'),
+        'names'   : index['names'],
+        'nirspec' : slice(*index['nirspec'])
+    }
+    _open_stores[store_path] = store
+
+    return store
+
+
+def load_spectrum(name, store_path):
+    """
+    Reads an object's transit spectrum from the store, sliced to NIRSpec.
+    The returned arrays are read-only views into the memory map (no copies).
+
+    ================== Params ==================
+
+    name        : object name, as in transmission_{name}.dat
+    store_path  : directory written by pack_spectra
+
+    ================== Returns =================
+
+    wave   : wavelengths (microns), or None if name isn't in the store
+    depth  : transit depths (fraction, not %), or None if name isn't in the store
+
+    """
+
+    store = open_store(store_path)
+    if store is None or name not in store['names']:
+        return None, None
+
+    wave_index = store['nirspec']
+
+    return store['wave'][wave_index], store['depths'][store['names'][name], wave_index]
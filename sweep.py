@@ -0,0 +1,123 @@
+import numpy as np
+from itertools import product
+
+# my functions
+from main import load_params, with_params, load_spectrum
+from smoothing import adap_smooth
+from run_pandexo import run_pandexo
+from binning import bin_plan, bin_err
+from resampling import resample
+import main
+from constants import R_jup, R_sun
+
+# fields of the result cube
+sweep_dtype = np.dtype([('chisq', float), ('numsig', float), ('mu', float)])
+
+
+def csre_sweep(name, Rp = None, Rs = None, noise_Teff = None, R = None, numtran = 1, err_R = 25, use_cache = True):
+    """
+    Runs CSRE + chisquared over a grid of planet radius, stellar radius, stellar
+    temperature given to PandExo and smoothing resolution. Each stage is only computed for the
+    parameters it actually depends on, and the rest is broadcast with numpy:
+
+    stellar spectrum    : fixed per star, loaded once
+    smoothed spectrum   : once per R (for a flat planet, Rp only rescales the depth
+                          and smoothing is linear, so smooth(Rp^2 * x) = Rp^2 * smooth(x))
+    PandExo error bars  : once per (Rp, Rs, noise_Teff), binned with a single bin plan
+    chisq, numsig, mu   : broadcast over the whole grid at once
+
+    The CSRE spectrum always comes from the star's own ExoTransmit run (csre_params
+    'star_name'), so noise_Teff (and Rs) only change the PandExo inputs, i.e. the
+    error bars, not the stellar contamination itself. There's no grid of ExoTransmit
+    stellar spectra to interpolate over Teff; sweep the spectrum by running the sweep
+    once per star_name instead.
+
+    Any parameter left as None is held at the value in the system's params.
+
+    ================== Params ==================
+
+    name       : name of system (or param dict/object, see main.load_params)
+    Rp         : planet radii to sweep over [m]
+    Rs         : stellar radii to sweep over [m]
+    noise_Teff : stellar temperatures for PandExo (star_temp) to sweep over [K]
+    R          : smoothing resolutions to sweep over
+    numtran    : number of transits to scale the errorbars by (Default is 1)
+    err_R      : resolution of the error bars (Default is 25, same as main.errorbars)
+    use_cache  : whether to use the on-disk PandExo cache (Default is True)
+
+    ================== Returns =================
+
+    coords  : dict of the 1-D parameter grids ('Rp', 'Rs', 'noise_Teff', 'R')
+    cube    : structured array of shape (len(Rp), len(Rs), len(noise_Teff), len(R))
+              with fields 'chisq', 'numsig' and 'mu'
+
+    """
+
+    params = load_params(name)
+    csre, pandexo = params.csre_params, params.pandexo_params
+
+    coords = {
+        'Rp'         : np.atleast_1d(csre['Rp'] if Rp is None else Rp).astype(float),
+        'Rs'         : np.atleast_1d(csre['Rs'] if Rs is None else Rs).astype(float),
+        'noise_Teff' : np.atleast_1d(pandexo['star_temp'] if noise_Teff is None else noise_Teff).astype(float),
+        'R'          : np.atleast_1d(csre['R'] if R is None else R)
+    }
+
+    ### Spectra (fixed per star) ###
+    wave, star_spec  = load_spectrum(csre['star_name'])
+    star_spec_noRref = np.sqrt(star_spec) * csre['Rref']
+
+    if csre['flat']:
+        # depth for Rp = 1 m, scaled by Rp^2 below
+        base_spec = (1 / star_spec_noRref)**2 * 1e6  # ppm
+    else:
+        planet_wave, planet_spec = load_spectrum(csre['planet_name'])
+        planet_spec_noRref = np.sqrt(planet_spec) * csre['Rref']
+        base_spec = (planet_spec_noRref / star_spec_noRref)**2 * 1e6  # ppm
+
+    ### Smoothing (once per R) ###
+    smooth_base = np.stack([adap_smooth(wave, base_spec, r) for r in coords['R']])
+
+    ### PandExo error bars (once per Rp, Rs, noise_Teff) ###
+    # only overriding the PandExo radii that are actually being swept
+    errs, plan = [], None
+    for rp, rs, teff in product(coords['Rp'], coords['Rs'], coords['noise_Teff']):
+        changes = {'star_temp' : teff}
+        if Rp is not None:
+            changes['planet_radius'] = rp / R_jup
+        if Rs is not None:
+            changes['star_radius'] = rs / R_sun
+
+        err_wave, err = run_pandexo(with_params(params, pandexo_params = changes), use_cache = use_cache)
+
+        # PandExo's wavelength grid is the same for every run, so the bin plan is too
+        if plan is None:
+            plan, plan_wave = bin_plan(err_wave, err_R), err_wave
+        elif not np.array_equal(err_wave, plan_wave):
+            raise ValueError('PandExo runs in the sweep came back on different wavelength grids')
+
+        errs.append(bin_err(err_wave, err, err_R, plan = plan)[1])
+
+    x    = plan.centers
+    yerr = np.reshape(errs, (len(coords['Rp']), len(coords['Rs']), len(coords['noise_Teff']), 1, len(x)))
+
+    ### Transit depths at the error bars ###
+    # (R, bins), then broadcast to (Rp, 1, 1, R, bins)
+    y = resample(wave, smooth_base, x, plan.widths, main.resample_method)
+    if csre['flat']:
+        y = coords['Rp'][:, None, None, None, None]**2 * y
+    else:
+        y = y[None, None, None]
+
+    ### chisq (same as main.chisquared, over the whole grid) ###
+    weights = yerr**-2
+    mu      = np.sum(y * weights, axis = -1) / np.sum(weights, axis = -1)
+    chisq   = np.sum((y - mu[..., None])**2 * weights, axis = -1) * numtran
+
+    shape = (len(coords['Rp']), len(coords['Rs']), len(coords['noise_Teff']), len(coords['R']))
+    cube  = np.empty(shape, dtype = sweep_dtype)
+    cube['chisq']  = chisq
+    cube['numsig'] = np.sqrt(chisq)
+    cube['mu']     = np.broadcast_to(mu, shape)
+
+    return coords, cube
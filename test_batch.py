@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+
+import os
+import csv
+import threading
+
+# my functions
+import main
+import run_pandexo
+import pandexo_cache
+from batch import run_batch
+from async_pipeline import run_pipeline
+
+
+class Crash:
+    """
+    Kills whichever process unpickles it, like a segfault in PandExo would.
+    """
+
+    def __reduce__(self):
+        return os._exit, (1,)
+
+
+def target(name, Rp = 7.134e7, crash = False):
+    """
+    Param dict for a flat planet around the synthetic 'test' star (surrogate noise).
+    A crashing target takes down the worker process it's sent to.
+    """
+
+    pandexo_params = {'sys_name' : 'test', 'mag' : 10.5, 'ref_wave' : 'J', 'star_temp' : 3000, 'star_metal' : 0.0,
+                      'star_logg' : 4.7, 'trans_dur' : 2.0, 'star_radius' : 0.57, 'planet_radius' : 1.0}
+    if crash:
+        pandexo_params['crash'] = Crash()
+
+    return {'name'           : name,
+            'csre_params'    : {'Rp' : Rp, 'Rs' : 3.9655e8, 'Rref' : 6.957e8, 'planet_name' : name,
+                                'star_name' : 'test', 'flat' : True, 'R' : 100},
+            'pandexo_params' : pandexo_params}
+
+
+@pytest.fixture
+def spectra(tmp_path, monkeypatch):
+    """
+    ExoTransmit-like stellar spectrum in a temporary spectra_path, with the surrogate
+    noise backend and a temporary PandExo cache (also exported for spawned workers).
+    """
+
+    wave  = np.geomspace(0.3e-6, 30e-6, 5000)
+    depth = 1.42 * (1 + 0.02*np.sin(wave * 1e6))
+    np.savetxt(tmp_path / 'transmission_test.dat', np.column_stack((wave, depth)), header = 'h1\nh2', comments = '')
+
+    settings = [(main, 'spectra_path', 'CSRE_SPECTRA_PATH', str(tmp_path)),
+                (run_pandexo, 'noise_backend', 'NOISE_BACKEND', 'surrogate'),
+                (pandexo_cache, 'cache_dir', 'PANDEXO_CACHE_DIR', str(tmp_path / 'cache'))]
+    for module, name, env, value in settings:
+        monkeypatch.setattr(module, name, value)
+        monkeypatch.setenv(env, value)
+    monkeypatch.setattr(main, 'store_path', str(tmp_path / 'store'))
+
+    return tmp_path
+
+
+def by_name(rows):
+    return {row['name'] : row for row in rows}
+
+
+def test_resume_skips_stored_targets(spectra):
+    store = str(spectra / 'results.db')
+
+    first = by_name(run_batch([target('a'), target('b', Rp = 5e7)], max_workers = 2, results_file = None, store = store))
+    assert [first[name]['status'] for name in 'ab'] == ['ok', 'ok']
+
+    again = by_name(run_batch([target('a'), target('b', Rp = 5e7), target('c', Rp = 3e7)], max_workers = 2,
+                              results_file = None, store = store))
+    assert [again[name]['status'] for name in 'abc'] == ['skipped', 'skipped', 'ok']
+    for name in 'ab':
+        assert np.isclose(again[name]['chisq'], first[name]['chisq'], rtol = 1e-12, atol = 0)
+
+    # changed params mean a different result, so it's run again
+    changed = run_batch([target('a', Rp = 6e7)], max_workers = 1, results_file = None, store = store)
+    assert changed[0]['status'] == 'ok'
+
+
+def test_repeats_in_a_batch_run_once(spectra):
+    rows = run_batch([target('a'), target('b', Rp = 5e7), target('a'), target('a')], max_workers = 2,
+                     results_file = None, store = str(spectra / 'results.db'))
+
+    a = [row for row in rows if row['name'] == 'a']
+    assert sorted(row['status'] for row in a) == ['ok', 'skipped', 'skipped']
+    assert len({row['chisq'] for row in a}) == 1
+    assert len(rows) == 4
+
+
+def test_dead_worker_only_fails_its_target(spectra):
+    results_file = str(spectra / 'results.csv')
+    targets      = [target('a'), target('crash', crash = True), target('b', Rp = 5e7), target('c', Rp = 3e7)]
+
+    rows = by_name(run_batch(targets, max_workers = 2, results_file = results_file))
+
+    assert rows['crash']['status'] == 'failed'
+    assert rows['crash']['error'].startswith('BrokenProcessPool')
+    assert [rows[name]['status'] for name in 'abc'] == ['ok', 'ok', 'ok']
+
+    with open(results_file) as f:
+        assert sorted(row['name'] for row in csv.DictReader(f)) == ['a', 'b', 'c', 'crash']
+
+
+def test_pipeline_matches_batch(spectra):
+    targets = [target('a'), target('b', Rp = 5e7), 'no_such_system']
+
+    rows  = by_name(run_pipeline(targets, results_file = None, prefetch = 1))
+    batch = by_name(run_batch(targets, max_workers = 2, results_file = None))
+
+    assert rows['no_such_system']['status'] == 'failed'
+    for name in 'ab':
+        assert rows[name]['status'] == 'ok'
+        assert np.isclose(rows[name]['chisq'], batch[name]['chisq'], rtol = 1e-12, atol = 0)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_pipeline_dead_worker_only_fails_its_target(spectra, workers):
+    targets = [target('a'), target('crash', crash = True), target('b', Rp = 5e7), target('c', Rp = 3e7)]
+
+    rows = by_name(run_pipeline(targets, results_file = None, workers = {'noise' : workers}))
+
+    assert rows['crash']['status'] == 'failed'
+    assert rows['crash']['error'].startswith('BrokenProcessPool')
+    assert [rows[name]['status'] for name in 'abc'] == ['ok', 'ok', 'ok']
+
+
+def test_pipeline_targets_raising(spectra):
+    results_file = str(spectra / 'results.csv')
+
+    def targets():
+        yield target('a')
+        raise ValueError('bad catalog')
+
+    # in a thread, so a hang fails the test instead of stopping the whole run
+    outcome = {}
+    def run():
+        try:
+            run_pipeline(targets(), results_file = results_file)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target = run, daemon = True)
+    thread.start()
+    thread.join(timeout = 60)
+
+    assert not thread.is_alive(), 'run_pipeline hung'
+    assert isinstance(outcome.get('error'), ValueError)
+
+    # the target it got before the error still finished
+    with open(results_file) as f:
+        assert [row['status'] for row in csv.DictReader(f)] == ['ok']
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+# my functions
+from binning import bin_err, bin_plan, error_pyramid, pyramid_level, white_light_curve
+
+
+def errors(npix = 3000, seed = 0):
+    """
+    Sorted wavelengths (microns) and PandExo-like error bars (ppm), lowest around 1.5 um.
+    """
+
+    rng  = np.random.default_rng(seed)
+    wave = np.geomspace(0.6, 5.3, npix)
+    err  = 150 * (1 + ((wave - 1.5)/1.5)**2) * rng.uniform(0.9, 1.1, npix)
+
+    return wave, err
+
+
+# the loop version divides by zero for empty bins (at R = 2700 most bins of this grid are empty)
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('R', [25, 100, 1000, 2700])
+def test_matches_reference(R):
+    wave, err = errors()
+
+    centers, new_err, widths = bin_err(wave, err, R, dtype = np.float64)
+    ref_centers, ref_err, ref_widths = bin_err(wave, err, R, reference = True, dtype = np.float64)
+
+    # the loop builds the centers by repeated multiplication and the bin plan with
+    # powers, so they drift apart by a few ulps per bin
+    assert len(centers) == len(ref_centers)
+    assert np.allclose(centers, ref_centers, rtol = 1e-12, atol = 0)
+    assert np.allclose(widths[1:], ref_widths[1:], rtol = 1e-12, atol = 0)
+
+    # the first bin's width is a difference of two close numbers, so compare it absolutely (microns)
+    assert np.isclose(widths[0], ref_widths[0], rtol = 0, atol = 1e-12)
+
+    # empty bins are inf in both
+    assert np.array_equal(np.isinf(new_err), np.isinf(ref_err))
+    assert np.allclose(new_err, ref_err, rtol = 1e-11, atol = 0)
+
+
+def test_plan_reuse_and_stacks():
+    wave, err = errors()
+    plan = bin_plan(wave, 100)
+    errs = np.stack([err, 2*err, err / np.sqrt(10)])
+
+    centers, new_errs, widths = bin_err(wave, errs, 100, plan = plan, dtype = np.float64)
+
+    for row, one in zip(new_errs, errs):
+        assert np.allclose(row, bin_err(wave, one, 100, dtype = np.float64)[1], rtol = 1e-13, atol = 0)
+
+
+def test_pyramid_matches_bin_err():
+    wave, err = errors()
+    Rs = [25, 100, 1000, 2700]
+
+    pyramid = error_pyramid(wave, err, Rs, dtype = np.float64)
+
+    for R in Rs:
+        centers, new_err, widths = pyramid_level(pyramid, R)
+        ref_centers, ref_err, ref_widths = bin_err(wave, err, R, dtype = np.float64)
+
+        assert np.array_equal(centers, ref_centers)
+        assert np.array_equal(widths, ref_widths)
+        assert np.array_equal(new_err, ref_err)
+
+
+def test_pyramid_white_light_curve():
+    wave, err = errors()
+    pyramid = error_pyramid(wave, err, [25], dtype = np.float64)
+
+    center, new_err, width = pyramid_level(pyramid, 0)
+
+    assert np.allclose((center[0], new_err[0], width[0]), white_light_curve(wave, err), rtol = 1e-12, atol = 0)
+
+
+def test_pyramid_stacks_and_missing_levels():
+    wave, err = errors()
+    errs = np.stack([err, 3*err])
+
+    pyramid = error_pyramid(wave, errs, [100], white = False, dtype = np.float64)
+
+    assert np.allclose(pyramid_level(pyramid, 100)[1][1], 3 * pyramid_level(pyramid, 100)[1][0], rtol = 1e-11, atol = 0)
+    with pytest.raises(KeyError):
+        pyramid_level(pyramid, 0)
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+# my functions
+import main
+from catalog import row_to_params, catalog_params
+
+row = {'pl_name' : 'TEST-1 b', 'hostname' : 'TEST-1', 'pl_rade' : 1.1, 'st_rad' : 0.12, 'st_mass' : 0.09,
+       'pl_trandep' : 0.7, 'st_teff' : 2600.0, 'st_logg' : 5.2, 'pl_trandur' : 0.6}
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    """
+    Two-row catalog in a temporary directory, with a spectrum for TEST-1 only.
+    """
+
+    path = tmp_path / 'catalog.csv'
+    other = dict(row, pl_name = 'OTHER-2 b', hostname = 'OTHER-2')
+    with open(path, 'w') as f:
+        f.write('# comment header\n' + ','.join(row) + '\n')
+        for r in (row, other):
+            f.write(','.join(str(value) for value in r.values()) + '\n')
+
+    wave = np.geomspace(0.3e-6, 30e-6, 500)
+    np.savetxt(tmp_path / 'transmission_test1.dat', np.column_stack((wave, np.ones_like(wave))),
+               header = 'h1\nh2', comments = '')
+
+    monkeypatch.setattr(main, 'spectra_path', str(tmp_path))
+    monkeypatch.setattr(main, 'store_path', str(tmp_path / 'store'))
+
+    return path
+
+
+def test_defaults_are_marked():
+    params = row_to_params(row)
+    assert params['defaults_used'] == ['mag']
+    assert params['pandexo_params']['mag'] == 10.0
+
+    params = row_to_params(dict(row, sy_jmag = 8.4, pl_trandur = np.nan))
+    assert params['defaults_used'] == ['trans_dur']
+    assert (params['pandexo_params']['mag'], params['pandexo_params']['ref_wave']) == (8.4, 'J')
+
+
+def test_rows_without_spectra(catalog):
+    assert [params['name'] for params in catalog_params(catalog)] == ['TEST-1 b']
+
+    kept = list(catalog_params(catalog, require_spectra = False))
+    assert [params.get('missing_spectra') for params in kept] == [None, ['other2']]
+
+    main.spectra_path = str(catalog.parent / 'nowhere')
+    with pytest.raises(ValueError, match = 'spectra'):
+        list(catalog_params(catalog))
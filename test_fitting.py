@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+import os
+
+# my functions
+import main
+from fitting import read_observed, CSRELikelihood, fit_grid
+from smoothing import adap_smooth
+
+# directory with the observed spectra (trappist-1b.csv, hat-p-18b.csv)
+here = os.path.dirname(os.path.abspath(__file__))
+
+params = {
+    'csre_params'    : {'Rp' : 7.118e6, 'Rs' : 8.2927e7, 'Rref' : 6.957e8, 'planet_name' : 'testb',
+                        'star_name' : 'test', 'flat' : True, 'R' : 100},
+    'pandexo_params' : {}
+}
+
+
+@pytest.fixture
+def spectra(tmp_path, monkeypatch):
+    """
+    ExoTransmit-like stellar spectrum (wavelengths in m, depths in %) in a temporary spectra_path.
+    """
+
+    wave  = np.geomspace(0.3e-6, 30e-6, 5000)
+    depth = 1.42 * (1 + 0.02*np.sin(wave * 1e6))
+    np.savetxt(tmp_path / 'transmission_test.dat', np.column_stack((wave, depth)), header = 'h1\nh2', comments = '')
+
+    monkeypatch.setattr(main, 'spectra_path', str(tmp_path))
+    monkeypatch.setattr(main, 'store_path', str(tmp_path / 'store'))
+
+    return wave * 1e6, depth / 100
+
+
+@pytest.mark.parametrize('path', ['trappist-1b.csv', 'hat-p-18b.csv'])
+def test_read_observed(path):
+    path     = os.path.join(here, path)
+    observed = read_observed(path)
+
+    with open(path) as f:
+        nrows = sum(1 for line in f if line.strip())
+
+    assert len(observed.wave) == nrows // 3
+    assert np.all(np.diff(observed.wave) >= 0)
+    assert np.all(observed.err_lo > 0) and np.all(observed.err_hi > 0)
+
+    # both are a few thousand ppm deep or more (trappist-1b.csv is a fraction, converted to ppm)
+    assert np.all(observed.depth > 1000)
+
+
+@pytest.mark.parametrize('path', ['trappist-1b.csv', 'hat-p-18b.csv'])
+def test_likelihood_matches_brute_force(spectra, path):
+    wave, star_spec = spectra
+    observed = read_observed(os.path.join(here, path))
+    like     = CSRELikelihood(params, observed, method = 'linear')
+
+    # the model the long way: CSRE spectrum at the system's Rp, smoothed and interpolated
+    csre     = params['csre_params']
+    nirspec  = (wave >= 0.6) & (wave <= 5.3)
+    smooth   = adap_smooth(wave[nirspec], (csre['Rp'] / csre['Rref'])**2 * 1e6 / star_spec[nirspec],
+                           csre['R'], dtype = np.float64)
+    template = np.interp(observed.wave, wave[nirspec], smooth)
+
+    def brute_force(Rp, Rs, offset):
+        model = (Rp / csre['Rp'] * csre['Rs'] / Rs)**2 * template + offset
+        logl  = 0
+        for depth, lo, hi, m in zip(observed.depth, observed.err_lo, observed.err_hi, model):
+            # split normal: upper error bar if the model is above the point, lower one otherwise
+            sigma = hi if m > depth else lo
+            logl += np.log(2 / (np.sqrt(2*np.pi) * (lo + hi))) - 0.5 * ((depth - m) / sigma)**2
+        return logl
+
+    rng = np.random.default_rng(0)
+    Rp  = csre['Rp'] * rng.uniform(0.8, 1.2, 20)
+    Rs  = csre['Rs'] * rng.uniform(0.8, 1.2, 20)
+    off = rng.uniform(-500, 500, 20)
+
+    logl = like.log_likelihood(Rp, Rs, off, chunksize = 7)
+
+    assert logl.shape == (20,)
+    assert np.allclose(logl, [brute_force(*theta) for theta in zip(Rp, Rs, off)], rtol = 1e-10, atol = 0)
+
+    # the (n x 3) interface gives the same, and -inf for non-positive radii
+    theta = np.column_stack((Rp, Rs, off))
+    theta[0, 0] = -1
+    assert np.allclose(like(theta)[1:], logl[1:], rtol = 1e-15, atol = 0)
+    assert like(theta)[0] == -np.inf
+
+
+def test_fit_grid_finds_the_max(spectra):
+    like = CSRELikelihood(params, os.path.join(here, 'trappist-1b.csv'))
+    csre = params['csre_params']
+
+    Rp  = csre['Rp'] * np.linspace(0.9, 1.1, 7)
+    Rs  = csre['Rs'] * np.linspace(0.9, 1.1, 5)
+    off = np.linspace(-300, 300, 9)
+
+    logl, best = fit_grid(like, Rp, Rs, off)
+
+    assert logl.shape == (7, 5, 9)
+    assert best['logl'] == np.max(logl)
+    assert np.isclose(like.log_likelihood(best['Rp'], best['Rs'], best['offset']), best['logl'], rtol = 1e-15)
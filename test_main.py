@@ -0,0 +1,55 @@
+import numpy as np
+
+# my functions
+from main import chisquared, transits_needed
+
+
+def errs(nbins = 60, seed = 0):
+    """
+    (x, y, yerr) error bars on a bumpy transit spectrum (ppm).
+    """
+
+    rng  = np.random.default_rng(seed)
+    x    = np.geomspace(0.6, 5.3, nbins)
+    y    = 5000 + 80*np.sin(4*x) + rng.normal(0, 10, nbins)
+    yerr = rng.uniform(20, 60, nbins)
+
+    return x, y, yerr
+
+
+def chisquared_scaled(errs, numtran):
+    """
+    chisq the long way: shrink the error bars by sqrt(numtran) and recompute everything.
+    """
+
+    x, y, yerr = errs
+    yerr = yerr / np.sqrt(numtran)
+    mu   = np.sum(y * yerr**-2) / np.sum(yerr**-2)
+
+    return np.sum(((y - mu)/yerr)**2), mu
+
+
+def test_chisquared_linear_in_numtran():
+    numtran = np.array([1, 2, 3, 10, 37, 100])
+
+    chisq, numsig, mu = chisquared(None, errs(), numtran)
+
+    for n, c in zip(numtran, chisq):
+        ref_chisq, ref_mu = chisquared_scaled(errs(), n)
+        assert np.isclose(c, ref_chisq, rtol = 1e-12, atol = 0)
+        assert np.isclose(mu, ref_mu, rtol = 1e-12, atol = 0)
+
+    assert np.allclose(numsig, np.sqrt(chisq), rtol = 1e-15, atol = 0)
+
+
+def test_chisquared_scalar_matches_array():
+    for n in [1, 5, 42]:
+        assert np.isclose(chisquared(None, errs(), n)[0], chisquared(None, errs(), [n])[0][0], rtol = 1e-15, atol = 0)
+
+
+def test_transits_needed():
+    levels  = [1, 3, 5]
+    numtran = transits_needed(errs(), levels)
+
+    # chisq after that many transits is exactly numsig^2
+    assert np.allclose(chisquared(None, errs(), numtran)[1], levels, rtol = 1e-12, atol = 0)
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import os
+
+# my functions
+import pandexo_cache
+from pandexo_cache import cache_key, load_cached, save_cached, evict, clear_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """
+    Empty cache in a temporary directory, with fresh hit/miss counters.
+    """
+
+    monkeypatch.setattr(pandexo_cache, 'cache_dir', str(tmp_path / 'cache'))
+    monkeypatch.setattr(pandexo_cache, 'cache_stats', {'hits' : 0, 'misses' : 0})
+
+    return tmp_path / 'cache'
+
+
+def entry(i):
+    wave = np.linspace(0.6, 5.3, 400)
+    return wave, np.full_like(wave, 100.0 + i)
+
+
+def fill(cache, n):
+    """
+    Saves n entries, each one older than the next (by file modification time).
+    """
+
+    keys = [cache_key({'i' : i}, 'NIRSpec Prism') for i in range(n)]
+    for i, key in enumerate(keys):
+        save_cached(key, *entry(i))
+        os.utime(cache / f'{key}.npz', (1000 + i, 1000 + i))
+
+    return keys
+
+
+def test_round_trip_and_stats(cache):
+    key = cache_key({'star' : {'temp' : 3000}}, 'NIRSpec Prism')
+    assert key != cache_key({'star' : {'temp' : 3001}}, 'NIRSpec Prism')
+    assert key != cache_key({'star' : {'temp' : 3000}}, 'NIRSpec G395H')
+
+    assert load_cached(key) is None
+    save_cached(key, *entry(0))
+    wave, err = load_cached(key)
+
+    assert np.array_equal(wave, entry(0)[0]) and np.array_equal(err, entry(0)[1])
+    assert pandexo_cache.cache_stats == {'hits' : 1, 'misses' : 1}
+
+
+def test_evicts_least_recently_used(cache):
+    keys = fill(cache, 4)
+    size = os.path.getsize(cache / f'{keys[0]}.npz')
+
+    # reading the oldest entry makes it the most recently used
+    assert load_cached(keys[0]) is not None
+
+    evict(max_size = 2*size + size // 2)
+
+    assert sorted(os.listdir(cache)) == sorted(f'{key}.npz' for key in (keys[0], keys[3]))
+
+
+def test_saving_keeps_the_cache_under_max_size(cache, monkeypatch):
+    keys = fill(cache, 2)
+    size = os.path.getsize(cache / f'{keys[0]}.npz')
+    monkeypatch.setattr(pandexo_cache, 'max_cache_size', 2*size + size // 2)
+
+    save_cached(cache_key({'i' : 'new'}, 'NIRSpec Prism'), *entry(2))
+
+    assert len(os.listdir(cache)) == 2
+    assert load_cached(keys[0]) is None
+    assert load_cached(keys[1]) is not None
+
+    clear_cache()
+    assert os.listdir(cache) == []
+    assert pandexo_cache.cache_stats == {'hits' : 0, 'misses' : 0}
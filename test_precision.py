@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+# my functions
+import precision
+from precision import compare_dtypes, using_dtype
+from benchmarks import synthetic_grid, synthetic_errs
+from smoothing import adap_smooth
+from binning import bin_err
+from resampling import resample
+from main import chisquared
+
+
+@pytest.mark.parametrize('npix', [3000, 100000])
+@pytest.mark.parametrize('R', [25, 100, 2700])
+def test_float32_matches_float64(npix, R):
+    wave, spec    = synthetic_grid(npix)
+    err_wave, err = synthetic_errs(npix)
+
+    def run():
+        smooth = adap_smooth(wave, spec, R)
+        x, yerr, widths = bin_err(err_wave, err, R)
+        return {'adap_smooth' : smooth, 'bin_err' : yerr, 'resample' : resample(wave, smooth, x)}
+
+    for name, diff in compare_dtypes(run, 'float32').items():
+        # a couple of float32 ulps, since the prefix sums stay in float64
+        assert diff['max_rel'] < 3e-7, name
+        assert diff['nbytes_ratio'] == 0.5, name
+
+
+def test_dtype_is_used_and_restored():
+    wave, spec = synthetic_grid(3000)
+
+    with using_dtype('float32'):
+        assert adap_smooth(wave, spec, 100).dtype == np.float32
+    assert precision.dtype == np.float64
+    assert adap_smooth(wave, spec, 100).dtype == np.float64
+
+    with pytest.raises(ValueError):
+        precision.set_dtype('int32')
+
+
+def test_chisquared_float32_errs():
+    wave, spec    = synthetic_grid(3000)
+    err_wave, err = synthetic_errs(3000)
+
+    def run():
+        smooth = adap_smooth(wave, spec, 100)
+        x, yerr, widths = bin_err(err_wave, err, 25)
+        chisq, numsig, mu = chisquared(None, (x, resample(wave, smooth, x), yerr))
+        return {'chisq' : chisq, 'mu' : mu}
+
+    for name, diff in compare_dtypes(run, 'float32').items():
+        assert diff['max_rel'] < 1e-5, name
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+# my functions
+from resampling import resample
+
+
+def spectrum(npix = 500):
+    wave = np.geomspace(0.6, 5.3, npix)
+
+    return wave, 5000 + 80*np.sin(4*wave)
+
+
+def test_linear_matches_interp():
+    wave, spec = spectrum()
+    x = np.linspace(0.6, 5.3, 77)
+
+    assert np.allclose(resample(wave, spec, x, dtype = np.float64), np.interp(x, wave, spec), rtol = 1e-13, atol = 0)
+
+
+@pytest.mark.parametrize('method', ['linear', 'bin_average'])
+@pytest.mark.parametrize('x', [[0.5, 1.0], [1.0, 5.4]])
+def test_outside_grid_raises(method, x):
+    wave, spec = spectrum()
+
+    with pytest.raises(ValueError, match = 'outside the wavelength grid'):
+        resample(wave, spec, x, widths = [0.01, 0.01], method = method)
+
+
+def test_extrapolate_clamps():
+    wave, spec = spectrum()
+
+    y = resample(wave, spec, [0.5, 5.4], extrapolate = True, dtype = np.float64)
+
+    assert np.array_equal(y, spec[[0, -1]])
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+# my functions
+from smoothing import adap_smooth, adap_smooth_loop, adap_smooth_many, smooth_bins
+
+
+def grid(npix = 2000, seed = 0):
+    """
+    Sorted, log-spaced wavelengths (microns) and a bumpy transit depth (ppm).
+    """
+
+    rng  = np.random.default_rng(seed)
+    wave = np.geomspace(0.6, 5.3, npix)
+    spec = 7000 + 200*np.sin(3*wave) + 100*np.exp(-((wave - 1.4)/0.05)**2) + rng.normal(0, 5, npix)
+
+    return wave, spec
+
+
+# the loop version warns about the mean of an empty bin
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('R', [25, 100, 1000, 2700])
+def test_matches_loop(R):
+    # at R = 1000 the first bin of this grid comes out empty (its left edge rounds
+    # to just above wave[0]), which both versions should give as nan
+    wave, spec = grid()
+    lo, hi = smooth_bins(wave, R)
+
+    smooth = adap_smooth(wave, spec, R, dtype = np.float64)
+
+    assert np.array_equal(np.isnan(smooth), hi == lo)
+    assert np.allclose(smooth, adap_smooth_loop(wave, spec, R), rtol = 1e-12, atol = 0, equal_nan = True)
+
+
+def test_has_empty_bin():
+    # keeps the empty bin case above covered
+    lo, hi = smooth_bins(grid()[0], 1000)
+
+    assert np.any(hi == lo)
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('R', [25, 2700])
+def test_matches_loop_with_gap(R):
+    # a big hole in the grid, so the bins next to it only hold a pixel or two
+    wave, spec = grid()
+    keep = (wave < 1.5) | (wave > 3)
+    wave, spec = wave[keep], spec[keep]
+
+    assert np.allclose(adap_smooth(wave, spec, R, dtype = np.float64), adap_smooth_loop(wave, spec, R),
+                       rtol = 1e-12, atol = 0, equal_nan = True)
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('R', [25, 100])
+def test_nans_stay_in_their_bins(R):
+    wave, spec = grid()
+    spec[[0, 700, 701, 1500]] = np.nan
+
+    smooth    = adap_smooth(wave, spec, R, dtype = np.float64)
+    reference = np.array(adap_smooth_loop(wave, spec, R))
+
+    assert np.array_equal(np.isnan(smooth), np.isnan(reference))
+    assert np.isfinite(smooth).any()
+    assert np.allclose(smooth, reference, rtol = 1e-12, atol = 0, equal_nan = True)
+
+
+def test_many_matches_one_at_a_time():
+    wave, spec = grid()
+    specs = np.stack([spec, 2*spec, spec[::-1]])
+
+    smooth = adap_smooth_many(wave, specs, 100, dtype = np.float64)
+
+    for row, one in zip(smooth, specs):
+        assert np.allclose(row, adap_smooth(wave, one, 100, dtype = np.float64), rtol = 1e-12, atol = 0)